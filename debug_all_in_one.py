@@ -1,5 +1,7 @@
 """调试 search_advanced (all_in_one) API 返回格式"""
-import requests
+import orjson
+
+from debug_common import SESSION as session
 
 url = "https://cbdata.dila.edu.tw/stable/search/all_in_one"
 params = {"q": "日出眾闇", "facet": 1, "rows": 3}
@@ -7,11 +9,11 @@ params = {"q": "日出眾闇", "facet": 1, "rows": 3}
 print(f"请求 URL: {url}")
 print(f"参数: {params}")
 
-response = requests.get(url, params=params, timeout=20, verify=False)
+response = session.get(url, params=params, timeout=20)
 print(f"\n状态码: {response.status_code}")
 print(f"Content-Type: {response.headers.get('Content-Type')}")
 
-data = response.json()
+data = orjson.loads(response.content)
 print(f"\n顶层键: {list(data.keys())}")
 
 if "results" in data:
@@ -8,9 +8,9 @@ queries = [
     "一切有為法"  # Traditional Chinese
 ]
 
-for q in queries:
+# 并发发起全部查询，按原顺序输出
+for q, (results, num_found) in zip(queries, s.search_many(queries)):
     print(f"Testing query: '{q}'")
-    results, num_found = s.search(q)  # 正确解包元组
     print(f"Found {len(results)} results (total: {num_found})")
     if results:
         print(f"Top: {results[0].get('title')} ({results[0].get('id')})")
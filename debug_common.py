@@ -0,0 +1,36 @@
+"""调试脚本共用的 HTTP 会话 (已禁用 SSL 验证)"""
+import ssl
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+# 禁用这类安全警告，保持输出只有我们要的信息
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+def _build_ssl_context() -> ssl.SSLContext:
+    """构建一次 SSL 上下文，所有连接共用，避免每次握手重复加载证书与丢失会话票据"""
+    ctx = ssl.create_default_context()
+    ctx.check_hostname = False
+    ctx.verify_mode = ssl.CERT_NONE
+    return ctx
+
+
+class _SharedContextAdapter(HTTPAdapter):
+    """把共享的 SSL 上下文注入 urllib3 连接池"""
+
+    def __init__(self, ssl_context: ssl.SSLContext, **kwargs):
+        self._ssl_context = ssl_context
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = self._ssl_context
+        return super().init_poolmanager(*args, **kwargs)
+
+
+SSL_CONTEXT = _build_ssl_context()
+
+SESSION = requests.Session()
+SESSION.verify = False
+SESSION.mount("https://", _SharedContextAdapter(SSL_CONTEXT))
@@ -6,10 +6,8 @@ import requests
 import httpx  # 需要安装: pip install httpx
 from dotenv import load_dotenv
 from openai import OpenAI
-import urllib3
 
-# 禁用这类安全警告，保持输出只有我们要的信息
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from debug_common import SESSION as session
 
 load_dotenv()
 
@@ -31,8 +29,8 @@ base_url = "https://new.12ai.org/v1"
 print(f"\n🌐 测试连接到: {base_url}")
 
 try:
-    # 修改点 1: 添加 verify=False 跳过证书验证
-    response = requests.get(base_url, timeout=5, verify=False)
+    # 修改点 1: Session 上已设置 verify=False 跳过证书验证
+    response = session.get(base_url, timeout=5)
     print(f"✅ 服务器响应: {response.status_code}")
 except requests.exceptions.Timeout:
     print("❌ 连接超时")
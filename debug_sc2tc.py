@@ -1,5 +1,7 @@
 """调试简繁转换 API"""
-import requests
+import orjson
+
+from debug_common import SESSION as session
 
 base_url = "https://cbdata.dila.edu.tw/stable"
 
@@ -12,14 +14,14 @@ print(f"\n请求 URL: {url}")
 print(f"参数: q={test_text}")
 
 try:
-    response = requests.get(url, params={"q": test_text}, timeout=10, verify=False)
+    response = session.get(url, params={"q": test_text}, timeout=10)
     print(f"\n状态码: {response.status_code}")
     print(f"Content-Type: {response.headers.get('Content-Type')}")
     print(f"响应内容: {response.text[:500]}")
     
     if response.status_code == 200:
         try:
-            data = response.json()
+            data = orjson.loads(response.content)
             print(f"\nJSON 解析结果: {data}")
             print(f"result 字段: {data.get('result')}")
         except Exception as e:
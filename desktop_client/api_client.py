@@ -1,14 +1,31 @@
 """
 后端 API 客户端封装
 """
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
+from urllib3.util.retry import Retry
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
 
 from .config import config
 from .models import ServerMeta, TaskStatus
 
 
+# 上传进度回调：(已发送字节数, 总字节数)
+ProgressCallback = Callable[[int, int], None]
+
+# 图片路径可以是 str 或 Path，内部只需要 open() 和文件名
+PathLike = Union[str, Path]
+
+
 class APIError(Exception):
     """API 调用异常"""
     def __init__(self, message: str, status_code: int = 0):
@@ -16,12 +33,140 @@ class APIError(Exception):
         self.status_code = status_code
 
 
+class UploadCancelled(Exception):
+    """上传被调用方主动中止（由 progress_callback 抛出）"""
+
+
+# 终态任务的状态不会再变化，可以无限期缓存
+_TERMINAL_STATUSES = frozenset({
+    TaskStatus.SUCCEEDED.value,
+    TaskStatus.FAILED.value,
+    TaskStatus.CANCELLED.value,
+})
+
+
+@lru_cache(maxsize=1024)
+def _job_url(base_url: str, task_id: str) -> str:
+    """单图任务 URL，轮询时反复用到，缓存避免每次重新拼接"""
+    return f"{base_url}/api/v1/jobs/{task_id}"
+
+
+class _TTLCache:
+    """线程安全的简易 TTL 缓存，ttl 为 None 表示永不过期"""
+    
+    def __init__(self, maxsize: int = 512):
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data: Dict[Any, Tuple[Optional[float], Any]] = {}
+    
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._data[key]
+                return None
+            return value
+    
+    def set(self, key: Any, value: Any, ttl: Optional[float]):
+        with self._lock:
+            if key not in self._data and len(self._data) >= self._maxsize:
+                # 淘汰最早写入的条目
+                self._data.pop(next(iter(self._data)))
+            expires_at = None if ttl is None else time.monotonic() + ttl
+            self._data[key] = (expires_at, value)
+    
+    def pop(self, key: Any):
+        with self._lock:
+            self._data.pop(key, None)
+
+
 class APIClient:
     """后端 API 客户端"""
     
-    def __init__(self, base_url: Optional[str] = None):
+    STATUS_CHUNK_SIZE = 64  # 批量状态查询每次请求携带的最大任务数
+    META_CACHE_TTL = 3600  # 服务器元信息缓存时间（秒）
+    PROCESS_CACHE_TTL = 60  # 处理过程缓存时间（秒）
+    HEALTH_CACHE_TTL = 2.0  # 健康检查结果缓存时间（秒）
+    
+    def __init__(self, base_url: Optional[str] = None, pool_size: Optional[int] = None):
         self.base_url = (base_url or config.api_base_url).rstrip("/")
-        self.timeout = 60  # 请求超时（秒）
+        # 常用接口 URL 预先拼接好，轮询热路径上不再重复构造
+        self._url_meta = self._url("/api/v1/meta")
+        self._url_batches = self._url("/api/v1/batches")
+        self._url_jobs_batch_status = self._url("/api/v1/jobs/batch_status")
+        # (连接超时, 读取超时)：后端不可达时约 3 秒即失败，AI 推理的长读取仍可完成
+        self.timeout: Tuple[float, float] = (3.05, 60)
+        # 连接池大小需覆盖并发上传 + 轮询的在途请求数，避免 "Connection pool is full"
+        self.pool_size = max(32, pool_size or config.max_concurrent_uploads)
+        self._session = self._init_session()
+        self._cache = _TTLCache()
+        # url -> (ETag, 上次的响应数据)，用于条件请求；服务端返回 304 时直接复用
+        self._etags = _TTLCache(maxsize=1024)
+        # 进行中的幂等 GET：相同 key 的并发调用共享同一次 HTTP 请求
+        self._inflight: Dict[Any, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._health_cache: Tuple[float, bool] = (0.0, False)  # (检查时刻, 是否可用)
+        # 常驻线程池：并发扇出多个轮询请求，共享同一个连接池
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="api-poll")
+        
+        # 后台预热连接池，首个用户请求无需再付出 TCP 握手开销
+        if not os.getenv("API_CLIENT_DISABLE_PREWARM"):
+            threading.Thread(target=self._prewarm, daemon=True).start()
+    
+    def _init_session(self) -> requests.Session:
+        """
+        创建复用连接池的 Session，避免每次请求重新握手。
+        
+        后端由 uvicorn 提供服务，只支持 HTTP/1.1，切换到 HTTP/2 客户端并不能获得多路复用；
+        并发请求依靠 keep-alive 连接池来复用连接。
+        """
+        session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504])
+        # 只连接单一后端主机，故 pool_connections=1，容量集中在 pool_maxsize
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=retries,
+            pool_block=False,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+        })
+        return session
+    
+    def _prewarm(self):
+        """预热连接：以 HEAD 探测建立 keep-alive 连接（不下载响应体），结果顺带写入健康检查缓存"""
+        self.health_check()
+    
+    def close(self):
+        """关闭轮询线程池与底层连接池"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
+    
+    def __enter__(self) -> "APIClient":
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    def invalidate(self, task_id: Optional[str] = None, session_id: Optional[str] = None):
+        """使指定任务/会话的缓存失效"""
+        if task_id:
+            self._cache.pop(("job", task_id))
+        if session_id:
+            self._cache.pop(("process", session_id))
+    
+    def _cache_job_status(self, data: Dict[str, Any]):
+        """终态任务的状态写入缓存，后续轮询直接命中"""
+        if data.get("status") in _TERMINAL_STATUSES and data.get("task_id"):
+            self._cache.set(("job", data["task_id"]), data, ttl=None)
     
     def _url(self, path: str) -> str:
         """构造完整 URL"""
@@ -31,52 +176,146 @@ class APIClient:
         """处理响应"""
         if resp.status_code >= 400:
             try:
-                detail = resp.json().get("detail", resp.text)
+                detail = orjson.loads(resp.content).get("detail", resp.text)
             except Exception:
                 detail = resp.text
             raise APIError(f"API 错误: {detail}", resp.status_code)
-        return resp.json()
+        try:
+            return orjson.loads(resp.content)
+        except orjson.JSONDecodeError as e:
+            raise APIError(f"API 响应不是合法 JSON: {e}", resp.status_code)
+    
+    def _get_singleflight(self, key: Any, url: str) -> Dict[str, Any]:
+        """
+        合并并发的相同 GET 请求：首个调用者发起请求，其余调用者等待并共享结果。
+        
+        携带上次的 ETag 发起条件请求，304 时复用已解析的数据。
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+        
+        if not is_leader:
+            return future.result()
+        
+        try:
+            known = self._etags.get(url)
+            headers = {"If-None-Match": known[0]} if known else None
+            resp = self._session.get(url, headers=headers, timeout=self.timeout)
+            if resp.status_code == 304 and known:
+                data = known[1]
+            else:
+                data = self._handle_response(resp)
+                etag = resp.headers.get("ETag")
+                if etag:
+                    self._etags.set(url, (etag, data), ttl=None)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+    
+    def _post_multipart(
+        self,
+        path: str,
+        field_name: str,
+        image_paths: Sequence[PathLike],
+        *,
+        params: Optional[Dict[str, Any]] = None,
+        timeout: Any = None,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> requests.Response:
+        """
+        以流式 multipart 上传图片，按块从磁盘读取而不是整体载入内存。
+        
+        MultipartEncoder 不负责关闭文件句柄，这里统一在 finally 中关闭。
+        progress_callback 在每读出一块数据后调用，抛出 UploadCancelled 即可中止上传。
+        """
+        file_handles = []
+        try:
+            fields = []
+            for image_path in image_paths:
+                f = open(image_path, "rb")
+                file_handles.append(f)
+                fields.append((field_name, (os.path.basename(image_path), f, "image/png")))
+            
+            encoder = MultipartEncoder(fields=fields)
+            body: Any = encoder
+            if progress_callback:
+                body = MultipartEncoderMonitor(
+                    encoder,
+                    lambda monitor: progress_callback(monitor.bytes_read, monitor.len),
+                )
+            return self._session.post(
+                self._url(path),
+                params=params,
+                data=body,
+                headers={"Content-Type": encoder.content_type},
+                timeout=timeout or self.timeout,
+            )
+        finally:
+            for f in file_handles:
+                f.close()
     
     # ------------------------------------------------------------------ #
     # 健康检查与元信息
     # ------------------------------------------------------------------ #
     
     def health_check(self) -> bool:
-        """检查服务是否可用"""
+        """检查服务是否可用（结果短暂缓存，HEAD 请求无需解析响应体）"""
+        checked_at, healthy = self._health_cache
+        now = time.monotonic()
+        if checked_at and now - checked_at < self.HEALTH_CACHE_TTL:
+            return healthy
         try:
-            resp = requests.get(self._url("/api/v1/meta"), timeout=5)
-            return resp.status_code == 200
+            resp = self._session.head(self._url_meta, timeout=(2, 2))
+            healthy = resp.status_code == 200
         except Exception:
-            return False
+            healthy = False
+        self._health_cache = (now, healthy)
+        return healthy
     
     def get_meta(self) -> ServerMeta:
         """获取服务器元信息"""
-        resp = requests.get(self._url("/api/v1/meta"), timeout=self.timeout)
-        data = self._handle_response(resp)
-        return ServerMeta(
+        cached = self._cache.get(("meta",))
+        if cached is not None:
+            return cached
+        data = self._get_singleflight(("meta",), self._url_meta)
+        meta = ServerMeta(
             version=data["version"],
             output_dir=data["output_dir"],
             supports_batch=data["supports_batch"],
         )
+        self._cache.set(("meta",), meta, ttl=self.META_CACHE_TTL)
+        return meta
     
     # ------------------------------------------------------------------ #
     # 单图任务接口
     # ------------------------------------------------------------------ #
     
-    def upload_single_image(self, image_path: Path) -> str:
+    def upload_single_image(
+        self,
+        image_path: PathLike,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> str:
         """
         上传单张图片创建任务。
         
         Returns:
             task_id: 任务 ID
         """
-        with open(image_path, "rb") as f:
-            files = {"file": (image_path.name, f, "image/png")}
-            resp = requests.post(
-                self._url("/api/v1/jobs/image"),
-                files=files,
-                timeout=self.timeout,
-            )
+        resp = self._post_multipart(
+            "/api/v1/jobs/image",
+            "file",
+            [image_path],
+            progress_callback=progress_callback,
+        )
         data = self._handle_response(resp)
         return data["task_id"]
     
@@ -87,11 +326,87 @@ class APIClient:
         Returns:
             包含 task_id, status, result, error 等字段的字典
         """
-        resp = requests.get(
-            self._url(f"/api/v1/jobs/{task_id}"),
-            timeout=self.timeout,
+        cached = self._cache.get(("job", task_id))
+        if cached is not None:
+            return cached
+        data = self._get_singleflight(("job", task_id), _job_url(self.base_url, task_id))
+        self._cache_job_status(data)
+        return data
+    
+    def stream_job_events(self, task_id: str) -> Iterator[Dict[str, Any]]:
+        """
+        订阅单图任务的状态推送（SSE），每次状态变化产出一个状态字典，终态后结束。
+        
+        旧版后端没有事件接口时，回退为按 poll_interval_single 轮询 get_job_status。
+        """
+        resp = self._session.get(
+            f"{_job_url(self.base_url, task_id)}/events",
+            headers={"Accept": "text/event-stream"},
+            stream=True,
+            timeout=(self.timeout[0], None),
         )
-        return self._handle_response(resp)
+        with resp:
+            if resp.status_code == 404 and self.get_job_status(task_id):
+                # 任务存在但事件接口不存在
+                yield from self._poll_job_events(task_id)
+                return
+            if resp.status_code >= 400:
+                self._handle_response(resp)
+            for line in resp.iter_lines():
+                if line.startswith(b"data:"):
+                    data = orjson.loads(line[5:])
+                    self._cache_job_status(data)
+                    yield data
+    
+    def _poll_job_events(self, task_id: str) -> Iterator[Dict[str, Any]]:
+        """以轮询模拟状态推送"""
+        last_updated_at = None
+        while True:
+            data = self.get_job_status(task_id)
+            if data.get("updated_at") != last_updated_at:
+                last_updated_at = data.get("updated_at")
+                yield data
+            if data.get("status") in _TERMINAL_STATUSES:
+                return
+            time.sleep(config.poll_interval_single)
+    
+    def get_jobs_status(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        批量获取单图任务状态，一次请求代替逐个 get_job_status。
+        
+        Returns:
+            task_id -> 状态字典；后端不存在的任务不会出现在结果中
+        """
+        statuses: Dict[str, Dict[str, Any]] = {}
+        pending: List[str] = []
+        for task_id in task_ids:
+            cached = self._cache.get(("job", task_id))
+            if cached is not None:
+                statuses[task_id] = cached
+            else:
+                pending.append(task_id)
+        
+        for start in range(0, len(pending), self.STATUS_CHUNK_SIZE):
+            chunk = pending[start:start + self.STATUS_CHUNK_SIZE]
+            resp = self._session.post(
+                self._url_jobs_batch_status,
+                json={"task_ids": chunk},
+                timeout=self.timeout,
+            )
+            if resp.status_code in (404, 405):
+                # 旧版后端没有批量接口，回退为逐个查询
+                for task_id in chunk:
+                    try:
+                        statuses[task_id] = self.get_job_status(task_id)
+                    except APIError as e:
+                        if e.status_code != 404:
+                            raise
+                continue
+            jobs = self._handle_response(resp).get("jobs", {})
+            for data in jobs.values():
+                self._cache_job_status(data)
+            statuses.update(jobs)
+        return statuses
     
     def get_job_process(self, task_id: str) -> Dict[str, Any]:
         """
@@ -100,8 +415,8 @@ class APIClient:
         Returns:
             包含 session_id, rounds, total_rounds 的字典
         """
-        resp = requests.get(
-            self._url(f"/api/v1/jobs/{task_id}/process"),
+        resp = self._session.get(
+            f"{_job_url(self.base_url, task_id)}/process",
             timeout=self.timeout,
         )
         return self._handle_response(resp)
@@ -113,13 +428,19 @@ class APIClient:
         Returns:
             包含 task_id, status, message 的字典
         """
-        resp = requests.post(
-            self._url(f"/api/v1/jobs/{task_id}/cancel"),
+        self.invalidate(task_id=task_id)
+        resp = self._session.post(
+            f"{_job_url(self.base_url, task_id)}/cancel",
             timeout=self.timeout,
         )
         return self._handle_response(resp)
     
-    def resume_job(self, session_id: str, image_path: Path) -> Tuple[str, str]:
+    def resume_job(
+        self,
+        session_id: str,
+        image_path: PathLike,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Tuple[str, str]:
         """
         断点续传任务。
         
@@ -130,14 +451,14 @@ class APIClient:
         Returns:
             (task_id, session_id) 元组
         """
-        with open(image_path, "rb") as f:
-            files = {"file": (image_path.name, f, "image/png")}
-            resp = requests.post(
-                self._url("/api/v1/jobs/resume"),
-                params={"session_id": session_id},
-                files=files,
-                timeout=self.timeout,
-            )
+        self.invalidate(session_id=session_id)
+        resp = self._post_multipart(
+            "/api/v1/jobs/resume",
+            "file",
+            [image_path],
+            params={"session_id": session_id},
+            progress_callback=progress_callback,
+        )
         data = self._handle_response(resp)
         return data["task_id"], data["session_id"]
     
@@ -145,33 +466,44 @@ class APIClient:
     # 批处理任务接口
     # ------------------------------------------------------------------ #
     
-    def upload_batch(self, image_paths: List[Path]) -> str:
+    def upload_batch(
+        self,
+        image_paths: Sequence[PathLike],
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> str:
         """
         上传多张图片创建批处理任务。
         
         Returns:
             batch_id: 批处理 ID
         """
-        files = []
-        file_handles = []
-        try:
-            for path in image_paths:
-                f = open(path, "rb")
-                file_handles.append(f)
-                files.append(("files", (path.name, f, "image/png")))
-            
-            resp = requests.post(
-                self._url("/api/v1/batches"),
-                files=files,
-                timeout=self.timeout * 2,  # 批量上传需要更长时间
-            )
-        finally:
-            for f in file_handles:
-                f.close()
-        
+        resp = self._post_multipart(
+            "/api/v1/batches",
+            "files",
+            image_paths,
+            timeout=(self.timeout[0], 300),  # 批量上传需要更长的读取时间
+            progress_callback=progress_callback,
+        )
         data = self._handle_response(resp)
         return data["batch_id"]
     
+    def upload_batch_parallel(self, image_paths: Sequence[PathLike], max_workers: int = 8) -> List[str]:
+        """
+        将多张图片作为独立的单图任务并发上传。
+        
+        Session 可在多线程间共享连接池，各图片的上传互不阻塞；
+        适用于服务器不支持批处理（ServerMeta.supports_batch=False）的场景。
+        
+        Returns:
+            与 image_paths 顺序一致的 task_id 列表
+        """
+        if not image_paths:
+            return []
+        workers = max(1, min(max_workers, len(image_paths), self.pool_size))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.upload_single_image, p) for p in image_paths]
+            return [f.result() for f in futures]
+    
     def get_batch_status(self, batch_id: str) -> Dict[str, Any]:
         """
         获取批处理任务状态。
@@ -179,11 +511,26 @@ class APIClient:
         Returns:
             包含 batch_id, status, round, total_jobs, completed_jobs, failed_jobs, details 的字典
         """
-        resp = requests.get(
-            self._url(f"/api/v1/batches/{batch_id}"),
-            timeout=self.timeout,
-        )
-        return self._handle_response(resp)
+        return self._get_singleflight(("batch", batch_id), f"{self._url_batches}/{batch_id}")
+    
+    def get_batches_status(self, batch_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        并发获取多个批处理任务状态。
+        
+        Returns:
+            batch_id -> 状态字典；查询失败的批次不会出现在结果中
+        """
+        futures = {
+            batch_id: self._executor.submit(self.get_batch_status, batch_id)
+            for batch_id in batch_ids
+        }
+        statuses: Dict[str, Dict[str, Any]] = {}
+        for batch_id, future in futures.items():
+            try:
+                statuses[batch_id] = future.result()
+            except (APIError, requests.RequestException) as e:
+                print(f"⚠️ 查询批处理 {batch_id} 状态失败: {e}")
+        return statuses
     
     def get_batch_results(self, batch_id: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -196,8 +543,8 @@ class APIClient:
         if session_id:
             params["session_id"] = session_id
         
-        resp = requests.get(
-            self._url(f"/api/v1/batches/{batch_id}/results"),
+        resp = self._session.get(
+            f"{self._url_batches}/{batch_id}/results",
             params=params,
             timeout=self.timeout,
         )
@@ -214,11 +561,12 @@ class APIClient:
         Returns:
             包含 session_id, rounds, total_rounds 的字典
         """
-        resp = requests.get(
-            self._url(f"/api/v1/process/{session_id}"),
-            timeout=self.timeout,
-        )
-        return self._handle_response(resp)
+        cached = self._cache.get(("process", session_id))
+        if cached is not None:
+            return cached
+        data = self._get_singleflight(("process", session_id), self._url(f"/api/v1/process/{session_id}"))
+        self._cache.set(("process", session_id), data, ttl=self.PROCESS_CACHE_TTL)
+        return data
 
 
 # 全局客户端实例
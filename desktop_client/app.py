@@ -2,12 +2,16 @@
 敦煌残卷分析桌面客户端主程序
 基于 PySide6 实现的 GUI 应用
 """
+import json
 import os
+import re
 import sys
-import subprocess
+import threading
+import time
+from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 from PySide6.QtWidgets import (
     QApplication,
@@ -32,13 +36,17 @@ from PySide6.QtWidgets import (
     QSplitter,
     QStatusBar,
 )
-from PySide6.QtCore import Qt, QTimer, Signal, QObject, QThread
-from PySide6.QtGui import QColor, QFont
+from PySide6.QtCore import Qt, QEvent, QTimer, QUrl, Signal, QObject, QRunnable, QThreadPool
+from PySide6.QtGui import QBrush, QColor, QDesktopServices, QFont
 
 from .config import config
-from .models import TaskRecord, TaskStatus, TaskType
+from .models import ServerMeta, TaskRecord, TaskStatus, TaskType
 from .task_store import task_store
-from .api_client import api_client, APIError
+from .api_client import api_client, APIError, UploadCancelled
+
+
+# .env 中的 OUTPUT_DIR 行（允许行首空白）
+_ENV_OUTPUT_DIR_RE = re.compile(r"(?m)^[ \t]*OUTPUT_DIR=.*$")
 
 
 # ------------------------------------------------------------------ #
@@ -50,21 +58,34 @@ class WorkerSignals(QObject):
     task_updated = Signal(str)  # local_id
     upload_finished = Signal(str, bool, str)  # local_id, success, message
     error = Signal(str)  # error message
+    poll_finished = Signal(object)  # {local_id: (TaskType, 状态字典)}
+    process_loaded = Signal(str, str, str, bool)  # local_id, cache_key, text, success
+    server_checked = Signal(bool, object, str)  # online, ServerMeta | None, error message
 
 
 # ------------------------------------------------------------------ #
-# 上传工作线程
+# 上传任务
 # ------------------------------------------------------------------ #
 
-class UploadWorker(QThread):
-    """单个上传任务的工作线程"""
+class UploadRunnable(QRunnable):
+    """单个上传任务，提交到 QThreadPool 中复用线程执行"""
     
-    def __init__(self, task: TaskRecord, signals: WorkerSignals):
+    def __init__(self, task: TaskRecord, signals: WorkerSignals, cancel_event: threading.Event):
         super().__init__()
         self.task = task
         self.signals = signals
+        self.cancel_event = cancel_event
+    
+    def _check_cancelled(self, _sent: int = 0, _total: int = 0):
+        """作为上传进度回调：窗口关闭时在下一个数据块处中止上传"""
+        if self.cancel_event.is_set():
+            raise UploadCancelled()
     
     def run(self):
+        # 排队期间任务可能已被取消
+        current = task_store.get_task(self.task.local_id)
+        if not current or current.status != TaskStatus.QUEUED:
+            return
         try:
             # 更新状态为上传中
             task_store.update_task(self.task.local_id, status=TaskStatus.UPLOADING)
@@ -72,15 +93,15 @@ class UploadWorker(QThread):
             
             if self.task.task_type == TaskType.SINGLE:
                 # 单图上传
-                image_path = Path(self.task.image_paths[0])
+                image_path = self.task.image_paths[0]
                 
                 # 检查是否是断点续传
                 if self.task.session_id:
                     task_id, session_id = api_client.resume_job(
-                        self.task.session_id, image_path
+                        self.task.session_id, image_path, self._check_cancelled
                     )
                 else:
-                    task_id = api_client.upload_single_image(image_path)
+                    task_id = api_client.upload_single_image(image_path, self._check_cancelled)
                     session_id = None
                 
                 task_store.update_task(
@@ -91,8 +112,8 @@ class UploadWorker(QThread):
                 )
             else:
                 # 批量上传
-                image_paths = [Path(p) for p in self.task.image_paths]
-                batch_id = api_client.upload_batch(image_paths)
+                image_paths = self.task.image_paths
+                batch_id = api_client.upload_batch(image_paths, self._check_cancelled)
                 task_store.update_task(
                     self.task.local_id,
                     batch_id=batch_id,
@@ -101,6 +122,9 @@ class UploadWorker(QThread):
                 )
             
             self.signals.upload_finished.emit(self.task.local_id, True, "上传成功")
+        except UploadCancelled:
+            task_store.update_task(self.task.local_id, status=TaskStatus.CANCELLED)
+            self.signals.upload_finished.emit(self.task.local_id, False, "上传已取消")
         except APIError as e:
             task_store.update_task(
                 self.task.local_id,
@@ -124,6 +148,24 @@ class UploadWorker(QThread):
 class MainWindow(QMainWindow):
     """主窗口"""
     
+    PROCESS_CACHE_TTL = 5.0  # 未结束任务的处理过程缓存时间（秒）
+    ROW_FLUSH_INTERVAL_MS = 33  # 合并行刷新的最小间隔（约 30 fps）
+    
+    # 状态颜色画刷，类加载时构建一次
+    _STATUS_COLORS = {
+        TaskStatus.QUEUED: QBrush(QColor(128, 128, 128)),  # 灰色
+        TaskStatus.UPLOADING: QBrush(QColor(100, 149, 237)),  # 蓝色
+        TaskStatus.PENDING: QBrush(QColor(128, 128, 128)),  # 灰色
+        TaskStatus.RUNNING: QBrush(QColor(30, 144, 255)),  # 蓝色
+        TaskStatus.SUCCEEDED: QBrush(QColor(34, 139, 34)),  # 绿色
+        TaskStatus.FAILED: QBrush(QColor(220, 20, 60)),  # 红色
+        TaskStatus.CANCELLED: QBrush(QColor(255, 140, 0)),  # 橙色
+        TaskStatus.BATCH_PENDING: QBrush(QColor(128, 128, 128)),
+        TaskStatus.BATCH_RUNNING: QBrush(QColor(30, 144, 255)),
+        TaskStatus.BATCH_MERGING: QBrush(QColor(138, 43, 226)),  # 紫色
+    }
+    _DEFAULT_COLOR = QBrush(QColor(0, 0, 0))
+    
     def __init__(self):
         super().__init__()
         self.setWindowTitle("敦煌残卷 AI 分析工具")
@@ -134,9 +176,36 @@ class MainWindow(QMainWindow):
         self.worker_signals.task_updated.connect(self._on_task_updated)
         self.worker_signals.upload_finished.connect(self._on_upload_finished)
         self.worker_signals.error.connect(self._on_error)
-        
-        self.upload_workers: List[UploadWorker] = []
+        self.worker_signals.poll_finished.connect(self._on_poll_finished)
+        self.worker_signals.process_loaded.connect(self._on_process_loaded)
+        self.worker_signals.server_checked.connect(self._apply_server_state)
+        
+        # 上传线程池：线程在整个会话中复用，超出并发数的任务在池内排队
+        self.pool = QThreadPool(self)
+        # 空闲线程不过期回收，整个会话复用同一批线程
+        self.pool.setExpiryTimeout(-1)
+        # 关闭窗口时置位，进行中的上传在下一个数据块处协作式退出
+        self._upload_cancel = threading.Event()
         self.upload_queue: List[str] = []  # 等待上传的 local_id 列表
+        self._row_by_local_id: Dict[str, int] = {}  # local_id -> 表格行号
+        # local_id -> 上次渲染时的行状态，未变化时跳过刷新
+        self._last_row_state: Dict[str, tuple] = {}
+        # local_id -> 格式化后的结果 JSON，结果变化时失效
+        self._result_json_cache: Dict[str, str] = {}
+        # task_id/session_id -> (获取时刻, 渲染后的处理过程文本)
+        self._process_cache: Dict[str, Tuple[float, str]] = {}
+        self._selected_local_id: Optional[str] = None
+        # 待刷新的行：信号密集到达时合并成一次批量刷新
+        self._dirty_rows: Set[str] = set()
+        self._flush_scheduled = False
+        
+        # 状态查询在后台线程执行，避免网络往返阻塞界面
+        self._poll_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="status-poll")
+        self._poll_in_flight = False
+        # 自适应轮询间隔：连续无变化时逐次翻倍，出现变化或新任务时恢复基础间隔
+        self._poll_interval_ms = config.poll_interval_single * 1000
+        # 窗口最小化或隐藏时暂停轮询（上传不依赖定时器，照常进行）
+        self._polling_suspended = False
         
         # 轮询定时器
         self.poll_timer = QTimer()
@@ -148,6 +217,7 @@ class MainWindow(QMainWindow):
         
         # 初始化 UI
         self._init_ui()
+        self.pool.setMaxThreadCount(self.spin_concurrent.value())
         self._load_tasks()
         
         # 检查服务器连接
@@ -166,6 +236,7 @@ class MainWindow(QMainWindow):
         
         # 主内容区
         splitter = QSplitter(Qt.Vertical)
+        self.splitter = splitter
         
         # 上半部分：控制面板 + 任务列表
         upper_widget = QWidget()
@@ -219,6 +290,9 @@ class MainWindow(QMainWindow):
         self.detail_tabs.addTab(self.process_text, "AI 处理过程")
         
         splitter.addWidget(self.detail_tabs)
+        # 详情只渲染当前可见的标签页，切换标签或展开面板时再补上
+        self.detail_tabs.currentChanged.connect(self._render_current_detail)
+        splitter.splitterMoved.connect(self._render_current_detail)
         splitter.setSizes([400, 200])
         
         main_layout.addWidget(splitter)
@@ -310,11 +384,28 @@ class MainWindow(QMainWindow):
         
         return table
     
+    @contextmanager
+    def _bulk_table_update(self) -> Iterator[None]:
+        """批量修改表格期间暂停重绘、排序与信号，结束后统一刷新一次"""
+        table = self.task_table
+        sorting = table.isSortingEnabled()
+        table.setUpdatesEnabled(False)
+        table.setSortingEnabled(False)
+        table.blockSignals(True)
+        try:
+            yield
+        finally:
+            table.blockSignals(False)
+            table.setSortingEnabled(sorting)
+            table.setUpdatesEnabled(True)
+            table.viewport().update()
+    
     def _load_tasks(self):
         """加载已保存的任务"""
         tasks = task_store.get_all_tasks()
-        for task in tasks:
-            self._add_task_to_table(task)
+        with self._bulk_table_update():
+            for task in tasks:
+                self._add_task_to_table(task)
         
         # 启动轮询
         if task_store.get_active_tasks():
@@ -324,6 +415,8 @@ class MainWindow(QMainWindow):
         """添加任务到表格"""
         row = self.task_table.rowCount()
         self.task_table.insertRow(row)
+        self._row_by_local_id[task.local_id] = row
+        self._last_row_state[task.local_id] = self._row_state(task)
         
         # 文件名
         name_item = QTableWidgetItem(task.get_display_name())
@@ -350,70 +443,92 @@ class MainWindow(QMainWindow):
         # 操作按钮
         self.task_table.setItem(row, 5, QTableWidgetItem(""))
     
+    @staticmethod
+    def _row_state(task: TaskRecord) -> tuple:
+        """
+        决定行显示内容的原始字段，按 (状态列, 进度列, 错误列) 分组。
+        
+        状态文本还依赖轮次与批处理计数；进度为 0 时显示 "-"，用 -1 区分。
+        """
+        return (
+            (task.status, task.current_round, task.completed_jobs, task.total_jobs),
+            int(task.progress * 100) if task.progress > 0 else -1,
+            task.error,
+        )
+    
     def _update_task_row(self, task: TaskRecord):
         """更新表格中的任务行"""
-        for row in range(self.task_table.rowCount()):
-            item = self.task_table.item(row, 0)
-            if item and item.data(Qt.UserRole) == task.local_id:
-                # 更新状态
-                status_item = QTableWidgetItem(task.get_status_text())
+        row = self._row_by_local_id.get(task.local_id)
+        if row is None:
+            return
+        
+        state = self._row_state(task)
+        last_state = self._last_row_state.get(task.local_id)
+        if state == last_state:
+            return
+        self._last_row_state[task.local_id] = state
+        status_key, progress_key, error = state
+        last_status_key, last_progress_key, last_error = last_state or (None, None, None)
+        
+        # 只改动发生变化的单元格，并且原地修改已有单元格
+        if status_key != last_status_key:
+            status_item = self.task_table.item(row, 2)
+            status_item.setText(task.get_status_text())
+            if last_status_key is None or last_status_key[0] != task.status:
                 self._set_status_color(status_item, task.status)
-                self.task_table.setItem(row, 2, status_item)
-                
-                # 更新进度
-                progress_text = f"{int(task.progress * 100)}%" if task.progress > 0 else "-"
-                self.task_table.setItem(row, 3, QTableWidgetItem(progress_text))
-                
-                # 更新错误
-                error_text = task.error[:50] + "..." if task.error and len(task.error) > 50 else (task.error or "")
-                self.task_table.setItem(row, 4, QTableWidgetItem(error_text))
-                break
+        
+        if progress_key != last_progress_key:
+            progress_text = f"{progress_key}%" if progress_key >= 0 else "-"
+            self.task_table.item(row, 3).setText(progress_text)
+        
+        if error != last_error:
+            error_text = error[:50] + "..." if error and len(error) > 50 else (error or "")
+            self.task_table.item(row, 4).setText(error_text)
     
     def _set_status_color(self, item: QTableWidgetItem, status: TaskStatus):
         """设置状态颜色"""
-        colors = {
-            TaskStatus.QUEUED: QColor(128, 128, 128),  # 灰色
-            TaskStatus.UPLOADING: QColor(100, 149, 237),  # 蓝色
-            TaskStatus.PENDING: QColor(128, 128, 128),  # 灰色
-            TaskStatus.RUNNING: QColor(30, 144, 255),  # 蓝色
-            TaskStatus.SUCCEEDED: QColor(34, 139, 34),  # 绿色
-            TaskStatus.FAILED: QColor(220, 20, 60),  # 红色
-            TaskStatus.CANCELLED: QColor(255, 140, 0),  # 橙色
-            TaskStatus.BATCH_PENDING: QColor(128, 128, 128),
-            TaskStatus.BATCH_RUNNING: QColor(30, 144, 255),
-            TaskStatus.BATCH_MERGING: QColor(138, 43, 226),  # 紫色
-        }
-        item.setForeground(colors.get(status, QColor(0, 0, 0)))
+        item.setForeground(self._STATUS_COLORS.get(status, self._DEFAULT_COLOR))
     
     # ------------------------------------------------------------------ #
     # 事件处理
     # ------------------------------------------------------------------ #
     
     def _check_server(self):
-        """检查服务器连接"""
+        """检查服务器连接（在后台线程执行，结果通过信号回到 GUI 线程）"""
+        self._poll_pool.submit(self._do_check_server)
+    
+    def _do_check_server(self):
+        """后台线程：探测服务器并获取元信息"""
         try:
             if api_client.health_check():
-                meta = api_client.get_meta()
-                self.output_dir = meta.output_dir
-                self.supports_batch = meta.supports_batch
-                
-                self.server_status_label.setText(f"服务器: 已连接 (v{meta.version})")
-                self.server_status_label.setStyleSheet("color: green;")
-                
-                self.output_dir_label.setText(f"输出目录: {self.output_dir}")
-                self.btn_open_output.setEnabled(True)
-                
-                self.chk_batch_mode.setEnabled(self.supports_batch)
-                if not self.supports_batch:
-                    self.chk_batch_mode.setToolTip("服务器未配置批处理支持")
-                
-                # 处理排队中的任务
-                self._process_upload_queue()
+                self.worker_signals.server_checked.emit(True, api_client.get_meta(), "")
             else:
-                self._set_server_offline()
+                self.worker_signals.server_checked.emit(False, None, "")
         except Exception as e:
+            self.worker_signals.server_checked.emit(False, None, str(e))
+    
+    def _apply_server_state(self, online: bool, meta: Optional[ServerMeta], error: str):
+        """根据探测结果更新服务器状态显示"""
+        if online and meta is not None:
+            self.output_dir = meta.output_dir
+            self.supports_batch = meta.supports_batch
+            
+            self.server_status_label.setText(f"服务器: 已连接 (v{meta.version})")
+            self.server_status_label.setStyleSheet("color: green;")
+            
+            self.output_dir_label.setText(f"输出目录: {self.output_dir}")
+            self.btn_open_output.setEnabled(True)
+            
+            self.chk_batch_mode.setEnabled(self.supports_batch)
+            if not self.supports_batch:
+                self.chk_batch_mode.setToolTip("服务器未配置批处理支持")
+            
+            # 处理排队中的任务
+            self._process_upload_queue()
+        else:
             self._set_server_offline()
-            self.status_bar.showMessage(f"连接服务器失败: {e}")
+            if error:
+                self.status_bar.showMessage(f"连接服务器失败: {error}")
     
     def _set_server_offline(self):
         """设置服务器离线状态"""
@@ -441,43 +556,48 @@ class MainWindow(QMainWindow):
             self._add_task_to_table(task)
             self.upload_queue.append(task.local_id)
         else:
-            # 单图模式：每张图片一个任务
-            for file_path in files:
-                task = task_store.create_task([file_path], TaskType.SINGLE)
-                self._add_task_to_table(task)
-                self.upload_queue.append(task.local_id)
+            # 单图模式：每张图片一个任务，一次性创建并落盘
+            tasks = task_store.create_tasks_bulk(
+                ([file_path], TaskType.SINGLE) for file_path in files
+            )
+            with self._bulk_table_update():
+                for task in tasks:
+                    self._add_task_to_table(task)
+            self.upload_queue.extend(task.local_id for task in tasks)
         
         self._process_upload_queue()
         self.status_bar.showMessage(f"已添加 {len(files)} 张图片")
     
     def _process_upload_queue(self):
-        """处理上传队列"""
-        # 清理已完成的 worker
-        self.upload_workers = [w for w in self.upload_workers if w.isRunning()]
-        
-        # 计算可以启动的新任务数
-        max_concurrent = self.spin_concurrent.value()
-        available = max_concurrent - len(self.upload_workers)
-        
-        while available > 0 and self.upload_queue:
+        """处理上传队列：全部提交给线程池，并发数由线程池上限控制"""
+        submitted = 0
+        while self.upload_queue:
             local_id = self.upload_queue.pop(0)
             task = task_store.get_task(local_id)
             
             if task and task.status == TaskStatus.QUEUED:
-                worker = UploadWorker(task, self.worker_signals)
-                self.upload_workers.append(worker)
-                worker.start()
-                available -= 1
+                self.pool.start(UploadRunnable(task, self.worker_signals, self._upload_cancel))
+                submitted += 1
+        
+        if submitted:
+            self._reset_poll_interval()
         
         # 如果有活跃任务，启动轮询
-        if task_store.get_active_tasks() or self.upload_workers:
+        if task_store.get_active_tasks() or self.pool.activeThreadCount():
             self._start_polling()
     
     def _start_polling(self):
         """启动轮询定时器"""
+        if self._polling_suspended:
+            return
         if not self.poll_timer.isActive():
-            interval = config.poll_interval_single * 1000
-            self.poll_timer.start(interval)
+            self.poll_timer.start(self._poll_interval_ms)
+    
+    def _reset_poll_interval(self):
+        """恢复基础轮询间隔，用于新任务提交或状态发生变化时"""
+        self._poll_interval_ms = config.poll_interval_single * 1000
+        if self.poll_timer.isActive():
+            self.poll_timer.setInterval(self._poll_interval_ms)
     
     def _stop_polling(self):
         """停止轮询定时器"""
@@ -488,43 +608,119 @@ class MainWindow(QMainWindow):
         """轮询任务状态"""
         active_tasks = task_store.get_active_tasks()
         
-        if not active_tasks and not self.upload_workers and not self.upload_queue:
+        if not active_tasks and not self.pool.activeThreadCount() and not self.upload_queue:
             self._stop_polling()
             return
         
-        for task in active_tasks:
+        # 上一轮查询尚未返回时不再叠加新的请求
+        if self._poll_in_flight:
+            return
+        
+        single_ids = {
+            t.local_id: t.task_id for t in active_tasks
+            if t.task_type == TaskType.SINGLE and t.task_id
+        }
+        batch_ids = {
+            t.local_id: t.batch_id for t in active_tasks
+            if t.task_type == TaskType.BATCH and t.batch_id
+        }
+        if not single_ids and not batch_ids:
+            self._process_upload_queue()
+            return
+        
+        self._poll_in_flight = True
+        future = self._poll_pool.submit(self._fetch_statuses, single_ids, batch_ids)
+        future.add_done_callback(self._on_fetch_done)
+    
+    @staticmethod
+    def _fetch_statuses(single_ids: Dict[str, str], batch_ids: Dict[str, str]) -> Dict[str, tuple]:
+        """在后台线程查询状态，返回 {local_id: (任务类型, 状态字典)}，不触碰任何界面对象"""
+        results: Dict[str, tuple] = {}
+        
+        # 单图任务合并为一次批量状态查询
+        if single_ids:
             try:
-                if task.task_type == TaskType.SINGLE and task.task_id:
-                    data = api_client.get_job_status(task.task_id)
-                    self._update_single_task(task, data)
-                elif task.task_type == TaskType.BATCH and task.batch_id:
-                    data = api_client.get_batch_status(task.batch_id)
-                    self._update_batch_task(task, data)
+                statuses = api_client.get_jobs_status(list(single_ids.values()))
+                for local_id, task_id in single_ids.items():
+                    data = statuses.get(task_id)
+                    if data:
+                        results[local_id] = (TaskType.SINGLE, data)
             except APIError as e:
-                print(f"轮询任务 {task.local_id} 失败: {e}")
+                print(f"批量轮询单图任务失败: {e}")
+        
+        # 批处理任务并发查询
+        if batch_ids:
+            statuses = api_client.get_batches_status(list(batch_ids.values()))
+            for local_id, batch_id in batch_ids.items():
+                data = statuses.get(batch_id)
+                if data:
+                    results[local_id] = (TaskType.BATCH, data)
+        
+        return results
+    
+    def _on_fetch_done(self, future):
+        """后台查询结束（在工作线程中回调），通过信号把结果交回 GUI 线程"""
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"⚠️ 轮询任务状态失败: {e}")
+            results = {}
+        self.worker_signals.poll_finished.emit(results)
+    
+    def _on_poll_finished(self, results: Dict[str, tuple]):
+        """在 GUI 线程应用一轮轮询结果"""
+        self._poll_in_flight = False
+        before: Dict[str, tuple] = {}
+        updates: Dict[str, dict] = {}
+        for local_id, (task_type, data) in results.items():
+            task = task_store.get_task(local_id)
+            if not task:
+                continue
+            before[local_id] = self._row_state(task)
+            if task_type == TaskType.SINGLE:
+                updates[local_id] = self._single_task_updates(task, data)
+            else:
+                updates[local_id] = self._batch_task_updates(task, data)
+        
+        # 一轮结果集中写回存储
+        changed = False
+        for task in task_store.update_many(updates):
+            self._update_task_row(task)
+            if self._row_state(task) != before[task.local_id]:
+                changed = True
+        
+        if changed:
+            self._reset_poll_interval()
+        elif self.poll_timer.isActive():
+            max_interval_ms = max(config.poll_interval_max, config.poll_interval_single) * 1000
+            self._poll_interval_ms = min(self._poll_interval_ms * 2, max_interval_ms)
+            self.poll_timer.setInterval(self._poll_interval_ms)
         
         # 继续处理上传队列
         self._process_upload_queue()
     
-    def _update_single_task(self, task: TaskRecord, data: dict):
-        """更新单图任务状态"""
+    def _single_task_updates(self, task: TaskRecord, data: dict) -> dict:
+        """根据后端返回的单图任务状态计算要更新的字段"""
         status_str = data.get("status", "")
         new_status = TaskStatus(status_str) if status_str else task.status
         
         updates = {"status": new_status}
+        if new_status != task.status and task.task_id:
+            self._process_cache.pop(task.task_id, None)
         
         if data.get("result"):
             updates["result"] = data["result"]
             updates["progress"] = 1.0
+            if data["result"] != task.result:
+                self._result_json_cache.pop(task.local_id, None)
         
         if data.get("error"):
             updates["error"] = data["error"]
         
-        task_store.update_task(task.local_id, **updates)
-        self._update_task_row(task_store.get_task(task.local_id))
+        return updates
     
-    def _update_batch_task(self, task: TaskRecord, data: dict):
-        """更新批处理任务状态"""
+    def _batch_task_updates(self, task: TaskRecord, data: dict) -> dict:
+        """根据后端返回的批处理状态计算要更新的字段"""
         status_str = data.get("status", "")
         new_status = TaskStatus(status_str) if status_str else task.status
         
@@ -543,21 +739,37 @@ class MainWindow(QMainWindow):
             "progress": progress,
         }
         
-        task_store.update_task(task.local_id, **updates)
-        self._update_task_row(task_store.get_task(task.local_id))
+        return updates
+    
+    def _mark_row_dirty(self, local_id: str):
+        """登记需要刷新的行，按固定间隔统一刷新"""
+        self._dirty_rows.add(local_id)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            QTimer.singleShot(self.ROW_FLUSH_INTERVAL_MS, self._flush_dirty_rows)
+    
+    def _flush_dirty_rows(self):
+        """一次性刷新所有待刷新的行"""
+        self._flush_scheduled = False
+        dirty, self._dirty_rows = self._dirty_rows, set()
+        self.task_table.setUpdatesEnabled(False)
+        try:
+            for local_id in dirty:
+                task = task_store.get_task(local_id)
+                if task:
+                    self._update_task_row(task)
+        finally:
+            self.task_table.setUpdatesEnabled(True)
     
     def _on_task_updated(self, local_id: str):
         """任务更新信号处理"""
-        task = task_store.get_task(local_id)
-        if task:
-            self._update_task_row(task)
+        self._mark_row_dirty(local_id)
     
     def _on_upload_finished(self, local_id: str, success: bool, message: str):
         """上传完成信号处理"""
-        task = task_store.get_task(local_id)
-        if task:
-            self._update_task_row(task)
+        self._mark_row_dirty(local_id)
         
+        self._reset_poll_interval()
         if success:
             self.status_bar.showMessage(f"上传成功: {message}")
         else:
@@ -574,6 +786,7 @@ class MainWindow(QMainWindow):
         """选择变化处理"""
         selected = self.task_table.selectedItems()
         if not selected:
+            self._selected_local_id = None
             self.result_text.clear()
             self.process_text.clear()
             return
@@ -585,35 +798,78 @@ class MainWindow(QMainWindow):
             return
         
         local_id = item.data(Qt.UserRole)
-        task = task_store.get_task(local_id)
-        if not task:
+        if not task_store.get_task(local_id):
             return
+        self._selected_local_id = local_id
         
-        # 显示结果
-        if task.result:
-            import json
-            self.result_text.setText(json.dumps(task.result, indent=2, ensure_ascii=False))
-        else:
-            self.result_text.setText("暂无结果")
+        # 另一个标签页的内容属于上一个任务，先清空，切换过去时再渲染
+        self.result_text.clear()
+        self.process_text.clear()
+        self._render_current_detail()
+    
+    def _render_current_detail(self, *_):
+        """只渲染当前可见的详情标签页；详情面板被折叠时跳过"""
+        if not self._selected_local_id or self.detail_tabs.visibleRegion().isEmpty():
+            return
+        task = task_store.get_task(self._selected_local_id)
+        if not task:
+            return
         
-        # 尝试获取处理过程
-        self._load_process_info(task)
+        if self.detail_tabs.currentWidget() is self.result_text:
+            if self.result_text.toPlainText():
+                return
+            # 显示结果
+            if task.result:
+                cached = self._result_json_cache.get(task.local_id)
+                if cached is None:
+                    cached = json.dumps(task.result, indent=2, ensure_ascii=False)
+                    self._result_json_cache[task.local_id] = cached
+                self.result_text.setText(cached)
+            else:
+                self.result_text.setText("暂无结果")
+        elif not self.process_text.toPlainText():
+            # 尝试获取处理过程
+            self._load_process_info(task)
     
     def _load_process_info(self, task: TaskRecord):
-        """加载处理过程信息"""
+        """加载处理过程信息：优先用缓存，否则在后台线程获取，避免阻塞界面"""
         self.process_text.clear()
         
-        if not task.task_id and not task.session_id:
+        cache_key = task.task_id or task.session_id
+        if not cache_key:
             self.process_text.setText("暂无处理记录")
             return
         
+        cached = self._process_cache.get(cache_key)
+        if cached is not None:
+            fetched_at, text = cached
+            if task.is_terminal() or time.monotonic() - fetched_at < self.PROCESS_CACHE_TTL:
+                self.process_text.setText(text)
+                return
+        
+        self.process_text.setText("正在加载处理记录...")
+        future = self._poll_pool.submit(self._fetch_process_text, task.task_id, task.session_id)
+        local_id = task.local_id
+        future.add_done_callback(lambda f: self._on_process_fetched(f, local_id, cache_key))
+    
+    def _on_process_fetched(self, future, local_id: str, cache_key: str):
+        """处理过程获取结束（在工作线程中回调）；窗口关闭时取消的任务不再回传"""
+        if future.cancelled():
+            return
         try:
-            if task.task_id:
-                data = api_client.get_job_process(task.task_id)
-            elif task.session_id:
-                data = api_client.get_process_by_session(task.session_id)
+            text, ok = future.result()
+        except Exception as e:
+            text, ok = f"获取处理记录失败: {e}", False
+        self.worker_signals.process_loaded.emit(local_id, cache_key, text, ok)
+    
+    @staticmethod
+    def _fetch_process_text(task_id: Optional[str], session_id: Optional[str]) -> Tuple[str, bool]:
+        """在后台线程获取并渲染处理过程，返回 (文本, 是否成功)"""
+        try:
+            if task_id:
+                data = api_client.get_job_process(task_id)
             else:
-                return
+                data = api_client.get_process_by_session(session_id)
             
             lines = []
             for round_info in data.get("rounds", []):
@@ -628,14 +884,22 @@ class MainWindow(QMainWindow):
                         lines.append(f"  - {tc.get('name', '?')}: {tc.get('result_summary', '-')}")
                 lines.append("")
             
-            self.process_text.setText("\n".join(lines) if lines else "暂无处理记录")
-        except APIError as e:
-            self.process_text.setText(f"获取处理记录失败: {e}")
+            return ("\n".join(lines) if lines else "暂无处理记录"), True
+        except Exception as e:
+            return f"获取处理记录失败: {e}", False
+    
+    def _on_process_loaded(self, local_id: str, cache_key: str, text: str, success: bool):
+        """处理过程加载完成（GUI 线程），仅在该任务仍被选中时刷新显示"""
+        if success:
+            self._process_cache[cache_key] = (time.monotonic(), text)
+        if local_id == self._selected_local_id:
+            self.process_text.setText(text)
     
     def _on_concurrent_changed(self, value: int):
         """并发数变化处理"""
         config.max_concurrent_uploads = value
         config.save()
+        self.pool.setMaxThreadCount(value)
     
     # ------------------------------------------------------------------ #
     # 任务操作
@@ -694,6 +958,7 @@ class MainWindow(QMainWindow):
             retried += 1
         
         if retried > 0:
+            self._reset_poll_interval()
             self._process_upload_queue()
         
         self.status_bar.showMessage(f"已重试 {retried} 个任务")
@@ -714,19 +979,29 @@ class MainWindow(QMainWindow):
     
     def _clear_completed(self):
         """清除已完成的任务"""
+        before = {t.local_id: t for t in task_store.get_all_tasks()}
         count = task_store.clear_completed()
-        
-        # 从表格中移除
-        rows_to_remove = []
-        for row in range(self.task_table.rowCount()):
-            item = self.task_table.item(row, 0)
-            if item:
-                local_id = item.data(Qt.UserRole)
-                if not task_store.get_task(local_id):
-                    rows_to_remove.append(row)
-        
-        for row in reversed(rows_to_remove):
-            self.task_table.removeRow(row)
+        surviving = task_store.get_all_tasks()
+        
+        # 释放被清除任务的各级缓存
+        for local_id in before.keys() - {t.local_id for t in surviving}:
+            removed = before[local_id]
+            self._result_json_cache.pop(local_id, None)
+            self._dirty_rows.discard(local_id)
+            for key in (removed.task_id, removed.session_id):
+                if key:
+                    self._process_cache.pop(key, None)
+            api_client.invalidate(task_id=removed.task_id, session_id=removed.session_id)
+        
+        # 整表重建，避免逐行 removeRow 反复重排模型
+        with self._bulk_table_update():
+            self.task_table.setRowCount(0)
+            self._row_by_local_id.clear()
+            self._last_row_state.clear()
+            for task in surviving:
+                self._add_task_to_table(task)
+        # 重建期间信号被屏蔽，手动同步详情面板
+        self._on_selection_changed()
         
         self.status_bar.showMessage(f"已清除 {count} 个已完成任务")
     
@@ -746,15 +1021,8 @@ class MainWindow(QMainWindow):
             QMessageBox.warning(self, "错误", f"目录不存在: {self.output_dir}")
             return
         
-        # Windows
-        if sys.platform == "win32":
-            os.startfile(str(path))
-        # macOS
-        elif sys.platform == "darwin":
-            subprocess.run(["open", str(path)])
-        # Linux
-        else:
-            subprocess.run(["xdg-open", str(path)])
+        # 交给系统文件管理器异步打开，跨平台且不阻塞界面
+        QDesktopServices.openUrl(QUrl.fromLocalFile(str(path)))
     
     def _change_output_dir(self):
         """更改输出目录"""
@@ -776,29 +1044,19 @@ class MainWindow(QMainWindow):
         env_path = Path(__file__).parent.parent / ".env"
         
         try:
-            # 读取现有内容
-            env_content = ""
-            if env_path.exists():
-                env_content = env_path.read_text(encoding="utf-8")
-            
-            # 更新或添加 OUTPUT_DIR
-            lines = env_content.splitlines()
-            found = False
-            new_lines = []
-            
-            for line in lines:
-                if line.strip().startswith("OUTPUT_DIR="):
-                    new_lines.append(f"OUTPUT_DIR={new_dir}")
-                    found = True
-                else:
-                    new_lines.append(line)
+            env_content = env_path.read_text(encoding="utf-8") if env_path.exists() else ""
             
-            if not found:
-                new_lines.append(f"\n# Output directory")
-                new_lines.append(f"OUTPUT_DIR={new_dir}")
+            # 单次替换 OUTPUT_DIR；用函数作替换值，避免 Windows 路径中的反斜杠被当作转义
+            new_content, count = _ENV_OUTPUT_DIR_RE.subn(
+                lambda _: f"OUTPUT_DIR={new_dir}", env_content
+            )
+            if count == 0:
+                new_content = env_content.rstrip() + f"\n\n# Output directory\nOUTPUT_DIR={new_dir}\n"
             
-            # 写入文件
-            env_path.write_text("\n".join(new_lines), encoding="utf-8")
+            # 先写临时文件再原子替换，避免中途失败留下残缺的 .env
+            tmp_path = env_path.with_name(env_path.name + ".tmp")
+            tmp_path.write_text(new_content, encoding="utf-8")
+            os.replace(tmp_path, env_path)
             
             # 提示用户
             QMessageBox.information(
@@ -815,15 +1073,48 @@ class MainWindow(QMainWindow):
         except Exception as e:
             QMessageBox.warning(self, "错误", f"更新配置文件失败: {e}")
     
+    def _suspend_polling(self):
+        """窗口不可见：停止轮询"""
+        self._polling_suspended = True
+        self._stop_polling()
+    
+    def _resume_polling(self):
+        """窗口重新可见：恢复轮询并立即补一次"""
+        if not self._polling_suspended:
+            return
+        self._polling_suspended = False
+        self._reset_poll_interval()
+        self._start_polling()
+        QTimer.singleShot(0, self._poll_tasks)
+    
+    def changeEvent(self, event):
+        """最小化时暂停轮询，还原后恢复"""
+        if event.type() == QEvent.WindowStateChange:
+            if self.isMinimized():
+                self._suspend_polling()
+            else:
+                self._resume_polling()
+        super().changeEvent(event)
+    
+    def hideEvent(self, event):
+        self._suspend_polling()
+        super().hideEvent(event)
+    
+    def showEvent(self, event):
+        super().showEvent(event)
+        self._resume_polling()
+    
     def closeEvent(self, event):
         """关闭窗口事件"""
-        # 停止所有 worker
-        for worker in self.upload_workers:
-            if worker.isRunning():
-                worker.terminate()
-                worker.wait()
+        # 丢弃尚未开始的上传，通知进行中的上传中止并稍作等待
+        self._upload_cancel.set()
+        self.pool.clear()
+        self.pool.waitForDone(2000)
         
         self._stop_polling()
+        self._poll_pool.shutdown(wait=False, cancel_futures=True)
+        api_client.close()
+        task_store.flush()
         event.accept()
 
 
@@ -3,6 +3,7 @@
 """
 import json
 import os
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
@@ -11,6 +12,7 @@ DEFAULT_CONFIG = {
     "api_base_url": "http://127.0.0.1:8000",
     "poll_interval_single": 3,  # 单图任务轮询间隔（秒）
     "poll_interval_batch": 10,  # 批量任务轮询间隔（秒）
+    "poll_interval_max": 30,  # 状态无变化时轮询间隔退避的上限（秒）
     "max_concurrent_uploads": 3,  # 最大并发上传数
     "auto_open_output": False,  # 完成后是否自动打开输出目录
 }
@@ -25,8 +27,9 @@ class ClientConfig:
         self._load()
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def _default_config_path() -> Path:
-        """获取默认配置文件路径"""
+        """获取默认配置文件路径（进程内只解析一次）"""
         # 优先使用项目目录下的配置文件
         project_config = Path(__file__).parent / "client_config.json"
         if project_config.exists():
@@ -48,11 +51,15 @@ class ClientConfig:
                 print(f"⚠️ 加载配置文件失败: {e}，使用默认配置")
     
     def save(self):
-        """保存配置到文件"""
+        """保存配置到文件（先写临时文件再原子替换，写到一半崩溃也不会留下损坏的配置）"""
+        tmp_path = self._config_path.with_name(self._config_path.name + ".tmp")
         try:
             self._config_path.parent.mkdir(parents=True, exist_ok=True)
-            with open(self._config_path, "w", encoding="utf-8") as f:
+            with open(tmp_path, "w", encoding="utf-8") as f:
                 json.dump(self._config, f, indent=2, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._config_path)
         except IOError as e:
             print(f"⚠️ 保存配置文件失败: {e}")
     
@@ -80,6 +87,14 @@ class ClientConfig:
     def poll_interval_batch(self, value: int):
         self._config["poll_interval_batch"] = max(1, value)
     
+    @property
+    def poll_interval_max(self) -> int:
+        return self._config["poll_interval_max"]
+    
+    @poll_interval_max.setter
+    def poll_interval_max(self, value: int):
+        self._config["poll_interval_max"] = max(1, value)
+    
     @property
     def max_concurrent_uploads(self) -> int:
         return self._config["max_concurrent_uploads"]
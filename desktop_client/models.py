@@ -1,11 +1,12 @@
 """
 桌面客户端数据模型
 """
+import sys
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Optional, Sequence
 
 
 class TaskStatus(str, Enum):
@@ -33,12 +34,50 @@ class TaskType(str, Enum):
     BATCH = "batch"  # 批处理任务
 
 
-@dataclass
+# 状态分组，供 TaskRecord 的判断方法做 O(1) 查找
+_ACTIVE_STATES = frozenset({
+    TaskStatus.PENDING,
+    TaskStatus.RUNNING,
+    TaskStatus.BATCH_PENDING,
+    TaskStatus.BATCH_RUNNING,
+    TaskStatus.BATCH_MERGING,
+})
+_TERMINAL_STATES = frozenset({
+    TaskStatus.SUCCEEDED,
+    TaskStatus.FAILED,
+    TaskStatus.CANCELLED,
+})
+_CANCELABLE_STATES = frozenset({
+    TaskStatus.QUEUED,
+    TaskStatus.UPLOADING,
+    TaskStatus.PENDING,
+    TaskStatus.RUNNING,
+    TaskStatus.BATCH_PENDING,
+    TaskStatus.BATCH_RUNNING,
+})
+_RETRYABLE_STATES = frozenset({TaskStatus.FAILED, TaskStatus.CANCELLED})
+_BATCH_PROGRESS_STATES = frozenset({TaskStatus.BATCH_RUNNING, TaskStatus.BATCH_MERGING})
+
+_STATUS_TEXT = {
+    TaskStatus.QUEUED: "排队中",
+    TaskStatus.UPLOADING: "上传中",
+    TaskStatus.PENDING: "等待处理",
+    TaskStatus.RUNNING: "处理中",
+    TaskStatus.SUCCEEDED: "已完成",
+    TaskStatus.FAILED: "失败",
+    TaskStatus.CANCELLED: "已取消",
+    TaskStatus.BATCH_PENDING: "批处理等待",
+    TaskStatus.BATCH_RUNNING: "批处理中",
+    TaskStatus.BATCH_MERGING: "结果整合中",
+}
+
+
+@dataclass(slots=True)
 class TaskRecord:
     """任务记录"""
     local_id: str  # 本地唯一标识
     task_type: TaskType
-    image_paths: List[str]  # 本地图片路径列表
+    image_paths: Sequence[str]  # 本地图片路径，构造后统一转为驻留字符串的元组
     status: TaskStatus = TaskStatus.QUEUED
     
     # 后端返回的 ID
@@ -65,44 +104,41 @@ class TaskRecord:
     retry_count: int = 0
     max_retries: int = 3
     
+    # 持久化用的序列化结果缓存，由 TaskStore 在记录被修改时清空
+    _cache: Optional[Dict[str, Any]] = field(default=None, init=False, repr=False, compare=False)
+    # 显示名称缓存，image_paths 变化时由 TaskStore 清空
+    _display_name: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        # 不可变元组；同一张图片被多个任务引用（重试、重复选择）时共享同一个字符串对象
+        self.image_paths = tuple(sys.intern(p) for p in self.image_paths)
+    
     def can_retry(self) -> bool:
         """是否可以重试"""
         return (
-            self.status in (TaskStatus.FAILED, TaskStatus.CANCELLED)
+            self.status in _RETRYABLE_STATES
             and self.retry_count < self.max_retries
         )
     
     def can_cancel(self) -> bool:
         """是否可以取消"""
-        return self.status in (
-            TaskStatus.QUEUED,
-            TaskStatus.UPLOADING,
-            TaskStatus.PENDING,
-            TaskStatus.RUNNING,
-            TaskStatus.BATCH_PENDING,
-            TaskStatus.BATCH_RUNNING,
-        )
+        return self.status in _CANCELABLE_STATES
     
     def is_active(self) -> bool:
         """是否是活跃任务（需要轮询）"""
-        return self.status in (
-            TaskStatus.PENDING,
-            TaskStatus.RUNNING,
-            TaskStatus.BATCH_PENDING,
-            TaskStatus.BATCH_RUNNING,
-            TaskStatus.BATCH_MERGING,
-        )
+        return self.status in _ACTIVE_STATES
     
     def is_terminal(self) -> bool:
         """是否是终态"""
-        return self.status in (
-            TaskStatus.SUCCEEDED,
-            TaskStatus.FAILED,
-            TaskStatus.CANCELLED,
-        )
+        return self.status in _TERMINAL_STATES
     
     def get_display_name(self) -> str:
-        """获取显示名称"""
+        """获取显示名称（首次调用时计算并缓存）"""
+        if self._display_name is None:
+            self._display_name = self._build_display_name()
+        return self._display_name
+    
+    def _build_display_name(self) -> str:
         if self.image_paths:
             first_path = Path(self.image_paths[0])
             if len(self.image_paths) == 1:
@@ -113,31 +149,19 @@ class TaskRecord:
     
     def get_status_text(self) -> str:
         """获取状态文本"""
-        status_map = {
-            TaskStatus.QUEUED: "排队中",
-            TaskStatus.UPLOADING: "上传中",
-            TaskStatus.PENDING: "等待处理",
-            TaskStatus.RUNNING: "处理中",
-            TaskStatus.SUCCEEDED: "已完成",
-            TaskStatus.FAILED: "失败",
-            TaskStatus.CANCELLED: "已取消",
-            TaskStatus.BATCH_PENDING: "批处理等待",
-            TaskStatus.BATCH_RUNNING: "批处理中",
-            TaskStatus.BATCH_MERGING: "结果整合中",
-        }
-        text = status_map.get(self.status, self.status.value)
+        text = _STATUS_TEXT.get(self.status, self.status.value)
         
         # 添加进度信息
         if self.status == TaskStatus.RUNNING and self.current_round > 0:
             text += f" (第{self.current_round}轮)"
-        elif self.status in (TaskStatus.BATCH_RUNNING, TaskStatus.BATCH_MERGING):
+        elif self.status in _BATCH_PROGRESS_STATES:
             if self.total_jobs > 0:
                 text += f" ({self.completed_jobs}/{self.total_jobs})"
         
         return text
 
 
-@dataclass
+@dataclass(slots=True)
 class BatchDetail:
     """批处理任务详情"""
     session_id: str
@@ -147,7 +171,7 @@ class BatchDetail:
     last_round: int
 
 
-@dataclass
+@dataclass(slots=True)
 class ServerMeta:
     """服务器元信息"""
     version: str
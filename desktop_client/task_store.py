@@ -1,103 +1,294 @@
 """
 本地任务持久化存储
+
+存储由两部分组成：
+- tasks.json：全部任务的快照
+- tasks.journal.ndjson：快照之后的增量修改，每行一条 upsert/delete 记录
+
+加载时先读快照再按顺序重放日志；日志增长到快照的数倍时合并为新快照并清空日志。
 """
-import json
+import atexit
+import os
 import threading
+import time
 import uuid
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Optional
+from types import MappingProxyType
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import orjson
 
 from .models import TaskRecord, TaskStatus, TaskType
 
 
+# 需要轮询的活跃状态
+_ACTIVE_STATUSES = (
+    TaskStatus.PENDING,
+    TaskStatus.RUNNING,
+    TaskStatus.BATCH_PENDING,
+    TaskStatus.BATCH_RUNNING,
+    TaskStatus.BATCH_MERGING,
+)
+# 可能允许重试的状态（还需检查重试次数）
+_RETRYABLE_STATUSES = (TaskStatus.FAILED, TaskStatus.CANCELLED)
+
+
+def _build_dict(record: TaskRecord) -> Dict[str, Any]:
+    """TaskRecord -> 可由 orjson 序列化的字典（枚举与 datetime 由 orjson 直接处理）"""
+    return {
+        "local_id": record.local_id,
+        "task_type": record.task_type,
+        "image_paths": record.image_paths,
+        "status": record.status,
+        "task_id": record.task_id,
+        "batch_id": record.batch_id,
+        "session_id": record.session_id,
+        "progress": record.progress,
+        "current_round": record.current_round,
+        "total_jobs": record.total_jobs,
+        "completed_jobs": record.completed_jobs,
+        "failed_jobs": record.failed_jobs,
+        "result": record.result,
+        "error": record.error,
+        "created_at": record.created_at,
+        "updated_at": record.updated_at,
+        "retry_count": record.retry_count,
+    }
+
+
+def _record_dict(record: TaskRecord) -> Dict[str, Any]:
+    """取记录的序列化结果，未修改过的记录直接复用上次的转换"""
+    cached = record._cache
+    if cached is None:
+        cached = _build_dict(record)
+        record._cache = cached
+    return cached
+
+
+def _parse_record(item: Dict[str, Any]) -> TaskRecord:
+    """字典 -> TaskRecord，字段缺失或非法时抛出 KeyError/ValueError"""
+    return TaskRecord(
+        local_id=item["local_id"],
+        task_type=TaskType(item["task_type"]),
+        image_paths=item["image_paths"],
+        status=TaskStatus(item["status"]),
+        task_id=item.get("task_id"),
+        batch_id=item.get("batch_id"),
+        session_id=item.get("session_id"),
+        progress=item.get("progress", 0.0),
+        current_round=item.get("current_round", 0),
+        total_jobs=item.get("total_jobs", 0),
+        completed_jobs=item.get("completed_jobs", 0),
+        failed_jobs=item.get("failed_jobs", 0),
+        result=item.get("result"),
+        error=item.get("error"),
+        created_at=datetime.fromisoformat(item["created_at"]),
+        updated_at=datetime.fromisoformat(item["updated_at"]),
+        retry_count=item.get("retry_count", 0),
+    )
+
+
 class TaskStore:
     """本地任务存储管理"""
     
+    SAVE_DEBOUNCE = 0.2  # 合并写盘的等待时间（秒）
+    COMPACT_RATIO = 4  # 日志超过快照的倍数时合并
+    COMPACT_MIN_BYTES = 64 * 1024  # 日志小于该大小时不合并
+    
     def __init__(self, storage_path: Optional[Path] = None):
         self._storage_path = storage_path or self._default_storage_path()
+        self._journal_path = self._storage_path.with_name(
+            self._storage_path.stem + ".journal.ndjson"
+        )
         self._lock = threading.Lock()
         self._tasks: Dict[str, TaskRecord] = {}
+        # 状态 -> 该状态下的 local_id（dict 作有序集合，保持进入该状态的先后顺序）
+        self._by_status: Dict[TaskStatus, Dict[str, None]] = {status: {} for status in TaskStatus}
+        self._snapshot_bytes = 0
+        self._journal_bytes = 0
         self._load()
+        self._publish()
+        
+        # 修改只登记到待写集合，由后台写线程合并后追加到日志
+        self._write_lock = threading.Lock()
+        self._pending: Dict[str, bool] = {}  # local_id -> 是否已删除，按首次修改顺序排列
+        self._journal_torn = False  # 上次追加失败，日志末尾可能有半行
+        self._dirty = threading.Event()
+        threading.Thread(target=self._writer_loop, name="task-store-writer", daemon=True).start()
+        atexit.register(self.flush)
     
     @staticmethod
+    @lru_cache(maxsize=1)
     def _default_storage_path() -> Path:
-        """获取默认存储路径"""
+        """获取默认存储路径（进程内只解析并创建一次目录）"""
         storage_dir = Path(__file__).parent / "data"
         storage_dir.mkdir(exist_ok=True)
         return storage_dir / "tasks.json"
     
     def _load(self):
-        """从文件加载任务"""
-        if not self._storage_path.exists():
-            return
+        """从快照加载任务，再重放日志"""
+        if self._storage_path.exists():
+            try:
+                raw = self._storage_path.read_bytes()
+                data = orjson.loads(raw)
+                self._snapshot_bytes = len(raw)
+                
+                for item in data.get("tasks", []):
+                    try:
+                        self._put(_parse_record(item))
+                    except (KeyError, ValueError) as e:
+                        print(f"⚠️ 加载任务记录失败: {e}")
+            except (orjson.JSONDecodeError, IOError) as e:
+                print(f"⚠️ 加载任务文件失败: {e}")
         
+        self._replay_journal()
+    
+    def _replay_journal(self):
+        """按顺序重放日志；末尾写了一半的行会被截掉，避免后续追加与之粘连"""
+        if not self._journal_path.exists():
+            return
         try:
-            with open(self._storage_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            raw = self._journal_path.read_bytes()
+            complete = raw.rfind(b"\n") + 1
+            if complete < len(raw):
+                print("⚠️ 任务日志末尾存在未写完的记录，已丢弃")
+                with open(self._journal_path, "r+b") as f:
+                    f.truncate(complete)
             
-            for item in data.get("tasks", []):
+            for line in raw[:complete].splitlines():
+                if not line.strip():
+                    continue
                 try:
-                    record = TaskRecord(
-                        local_id=item["local_id"],
-                        task_type=TaskType(item["task_type"]),
-                        image_paths=item["image_paths"],
-                        status=TaskStatus(item["status"]),
-                        task_id=item.get("task_id"),
-                        batch_id=item.get("batch_id"),
-                        session_id=item.get("session_id"),
-                        progress=item.get("progress", 0.0),
-                        current_round=item.get("current_round", 0),
-                        total_jobs=item.get("total_jobs", 0),
-                        completed_jobs=item.get("completed_jobs", 0),
-                        failed_jobs=item.get("failed_jobs", 0),
-                        result=item.get("result"),
-                        error=item.get("error"),
-                        created_at=datetime.fromisoformat(item["created_at"]),
-                        updated_at=datetime.fromisoformat(item["updated_at"]),
-                        retry_count=item.get("retry_count", 0),
-                    )
-                    self._tasks[record.local_id] = record
-                except (KeyError, ValueError) as e:
-                    print(f"⚠️ 加载任务记录失败: {e}")
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"⚠️ 加载任务文件失败: {e}")
-    
-    def _save(self):
-        """保存任务到文件"""
-        try:
-            self._storage_path.parent.mkdir(parents=True, exist_ok=True)
+                    entry = orjson.loads(line)
+                    if entry["op"] == "delete":
+                        self._remove(entry["id"])
+                    else:
+                        self._put(_parse_record(entry["r"]))
+                except (orjson.JSONDecodeError, KeyError, ValueError) as e:
+                    print(f"⚠️ 跳过损坏的任务日志行: {e}")
+            self._journal_bytes = complete
+        except IOError as e:
+            print(f"⚠️ 加载任务日志失败: {e}")
+    
+    def _put(self, record: TaskRecord):
+        """加入或替换记录并维护状态索引（调用方需持有 self._lock 或处于初始化阶段）"""
+        old = self._tasks.get(record.local_id)
+        if old is not None:
+            self._by_status[old.status].pop(record.local_id, None)
+        self._tasks[record.local_id] = record
+        self._by_status[record.status][record.local_id] = None
+    
+    def _remove(self, local_id: str) -> Optional[TaskRecord]:
+        """移除记录并维护状态索引（调用方需持有 self._lock 或处于初始化阶段）"""
+        record = self._tasks.pop(local_id, None)
+        if record is not None:
+            self._by_status[record.status].pop(local_id, None)
+        return record
+    
+    def _publish(self):
+        """发布只读快照（调用方需持有 self._lock 或处于初始化阶段）
+        
+        读操作远多于写操作：每次修改后整体替换快照，查询方法直接读取当前快照，无需加锁。
+        """
+        self._snapshot: Mapping[str, TaskRecord] = MappingProxyType(dict(self._tasks))
+        self._status_snapshot: Mapping[TaskStatus, Tuple[TaskRecord, ...]] = MappingProxyType({
+            status: tuple(self._tasks[i] for i in ids)
+            for status, ids in self._by_status.items()
+        })
+    
+    def _with_status(self, statuses: Iterable[TaskStatus]) -> List[TaskRecord]:
+        """按状态从快照取记录，无需加锁"""
+        snap = self._status_snapshot
+        return [t for status in statuses for t in snap[status]]
+    
+    def _save(self, local_id: str, deleted: bool = False):
+        """登记一条修改（调用方需持有 self._lock），实际写盘由后台线程完成"""
+        # 已登记的记录保持原位：创建总是第一次修改，重放日志后任务顺序与创建顺序一致
+        self._pending[local_id] = deleted
+        self._dirty.set()
+    
+    def _writer_loop(self):
+        """后台写线程：等待脏标记，短暂合并后写一次日志"""
+        while True:
+            self._dirty.wait()
+            time.sleep(self.SAVE_DEBOUNCE)
+            self._dirty.clear()
+            self._write_pending()
+    
+    def flush(self):
+        """立即把未保存的修改写入文件（退出前调用）"""
+        self._write_pending()
+    
+    def _write_pending(self):
+        """把待写修改追加到日志；日志过大时合并为新快照"""
+        with self._write_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                pending, self._pending = self._pending, {}
+                lines = []
+                for local_id, deleted in pending.items():
+                    record = self._tasks.get(local_id)
+                    if deleted or record is None:
+                        entry = {"op": "delete", "id": local_id}
+                    else:
+                        entry = {"op": "upsert", "r": _record_dict(record)}
+                    lines.append(orjson.dumps(entry))
             
-            tasks_data = []
-            for record in self._tasks.values():
-                tasks_data.append({
-                    "local_id": record.local_id,
-                    "task_type": record.task_type.value,
-                    "image_paths": record.image_paths,
-                    "status": record.status.value,
-                    "task_id": record.task_id,
-                    "batch_id": record.batch_id,
-                    "session_id": record.session_id,
-                    "progress": record.progress,
-                    "current_round": record.current_round,
-                    "total_jobs": record.total_jobs,
-                    "completed_jobs": record.completed_jobs,
-                    "failed_jobs": record.failed_jobs,
-                    "result": record.result,
-                    "error": record.error,
-                    "created_at": record.created_at.isoformat(),
-                    "updated_at": record.updated_at.isoformat(),
-                    "retry_count": record.retry_count,
-                })
+            payload = b"\n".join(lines) + b"\n"
+            try:
+                self._storage_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self._journal_path, "ab") as f:
+                    if self._journal_torn:
+                        # 上次写入失败可能留下半行，先截回已确认写入的长度，避免与本次追加粘连
+                        f.truncate(self._journal_bytes)
+                        self._journal_torn = False
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._journal_bytes += len(payload)
+            except IOError as e:
+                print(f"⚠️ 保存任务日志失败: {e}")
+                self._journal_torn = True
+                # 放回待写集合（期间的新修改优先），稍后由写线程重试
+                with self._lock:
+                    pending.update(self._pending)
+                    self._pending = pending
+                    self._dirty.set()
+                return
             
-            with open(self._storage_path, "w", encoding="utf-8") as f:
-                json.dump({"tasks": tasks_data}, f, indent=2, ensure_ascii=False)
+            if self._journal_bytes > max(self.COMPACT_MIN_BYTES, self.COMPACT_RATIO * self._snapshot_bytes):
+                self._compact()
+    
+    def _compact(self):
+        """写出完整快照并清空日志（调用方需持有 self._write_lock）"""
+        # 逐条流式写出，不先拼出整个列表；快照只读，无需持锁。
+        # 并发修改中的记录可能序列化出中间状态，但其修改已登记待写，会在合并后追加到新日志
+        snap = self._snapshot
+        tmp_path = self._storage_path.with_name(self._storage_path.name + ".tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(b'{"tasks": [')
+                for i, record in enumerate(snap.values()):
+                    f.write(b",\n  " if i else b"\n  ")
+                    f.write(orjson.dumps(record._cache or _build_dict(record)))
+                f.write(b"\n]}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self._storage_path)
+            # 快照已包含日志中的全部修改；即使清空前崩溃，重放日志也只会得到相同的最终状态
+            with open(self._journal_path, "wb") as f:
+                os.fsync(f.fileno())
+            self._snapshot_bytes = self._storage_path.stat().st_size
+            self._journal_bytes = 0
         except IOError as e:
-            print(f"⚠️ 保存任务文件失败: {e}")
+            print(f"⚠️ 合并任务快照失败: {e}")
     
     def create_task(
         self,
-        image_paths: List[str],
+        image_paths: Sequence[str],
         task_type: TaskType = TaskType.SINGLE,
     ) -> TaskRecord:
         """创建新任务"""
@@ -109,14 +300,53 @@ class TaskStore:
                 image_paths=image_paths,
                 status=TaskStatus.QUEUED,
             )
-            self._tasks[local_id] = record
-            self._save()
+            self._put(record)
+            self._save(local_id)
+            self._publish()
             return record
     
+    def create_tasks_bulk(
+        self,
+        specs: Iterable[Tuple[Sequence[str], TaskType]],
+    ) -> List[TaskRecord]:
+        """批量创建任务，全部加入后只写一次文件"""
+        with self._lock:
+            records = []
+            for image_paths, task_type in specs:
+                local_id = str(uuid.uuid4())
+                record = TaskRecord(
+                    local_id=local_id,
+                    task_type=task_type,
+                    image_paths=image_paths,
+                    status=TaskStatus.QUEUED,
+                )
+                self._put(record)
+                records.append(record)
+                self._save(local_id)
+            self._publish()
+            return records
+    
     def get_task(self, local_id: str) -> Optional[TaskRecord]:
         """获取任务"""
-        with self._lock:
-            return self._tasks.get(local_id)
+        return self._snapshot.get(local_id)
+    
+    def _apply_update(self, record: TaskRecord, kwargs: Dict[str, Any]) -> bool:
+        """原地修改记录并登记写盘（调用方需持有 self._lock），返回状态是否变化"""
+        old_status = record.status
+        for key, value in kwargs.items():
+            if hasattr(record, key):
+                setattr(record, key, value)
+        status_changed = record.status != old_status
+        if status_changed:
+            self._by_status[old_status].pop(record.local_id, None)
+            self._by_status[record.status][record.local_id] = None
+        
+        record.updated_at = datetime.now()
+        record._cache = None
+        if "image_paths" in kwargs:
+            record._display_name = None
+        self._save(record.local_id)
+        return status_changed
     
     def update_task(self, local_id: str, **kwargs) -> Optional[TaskRecord]:
         """更新任务"""
@@ -124,66 +354,102 @@ class TaskStore:
             record = self._tasks.get(local_id)
             if not record:
                 return None
-            
-            for key, value in kwargs.items():
-                if hasattr(record, key):
-                    setattr(record, key, value)
-            
-            record.updated_at = datetime.now()
-            self._save()
+            # 记录对象与快照共享，字段已原地更新；只有状态变化才需要重新发布索引
+            if self._apply_update(record, kwargs):
+                self._publish()
             return record
     
+    def update_many(self, updates: Dict[str, Dict[str, Any]]) -> List[TaskRecord]:
+        """
+        批量更新任务：一次加锁、最多发布一次快照，适合轮询后集中写回。
+        
+        Args:
+            updates: local_id -> 要更新的字段
+        
+        Returns:
+            实际更新到的记录（不存在的 local_id 会被跳过）
+        """
+        records = []
+        with self._lock:
+            status_changed = False
+            for local_id, kwargs in updates.items():
+                record = self._tasks.get(local_id)
+                if not record:
+                    continue
+                status_changed |= self._apply_update(record, kwargs)
+                records.append(record)
+            if status_changed:
+                self._publish()
+        return records
+    
     def delete_task(self, local_id: str) -> bool:
         """删除任务"""
         with self._lock:
-            if local_id in self._tasks:
-                del self._tasks[local_id]
-                self._save()
+            if self._remove(local_id) is not None:
+                self._save(local_id, deleted=True)
+                self._publish()
                 return True
             return False
     
     def get_all_tasks(self) -> List[TaskRecord]:
         """获取所有任务"""
-        with self._lock:
-            return list(self._tasks.values())
+        return list(self._snapshot.values())
     
     def get_active_tasks(self) -> List[TaskRecord]:
         """获取所有活跃任务"""
-        with self._lock:
-            return [t for t in self._tasks.values() if t.is_active()]
+        return self._with_status(_ACTIVE_STATUSES)
     
     def get_queued_tasks(self) -> List[TaskRecord]:
         """获取所有排队中的任务"""
-        with self._lock:
-            return [t for t in self._tasks.values() if t.status == TaskStatus.QUEUED]
+        return self._with_status((TaskStatus.QUEUED,))
     
     def get_retryable_tasks(self) -> List[TaskRecord]:
         """获取所有可重试的任务"""
-        with self._lock:
-            return [t for t in self._tasks.values() if t.can_retry()]
+        return [t for t in self._with_status(_RETRYABLE_STATUSES) if t.can_retry()]
     
     def clear_completed(self) -> int:
         """清除已完成的任务，返回清除数量"""
         with self._lock:
-            to_remove = [
-                local_id for local_id, t in self._tasks.items()
-                if t.status == TaskStatus.SUCCEEDED
-            ]
+            to_remove = list(self._by_status[TaskStatus.SUCCEEDED])
             for local_id in to_remove:
-                del self._tasks[local_id]
-            if to_remove:
-                self._save()
+                self._remove(local_id)
+                self._save(local_id, deleted=True)
+            self._publish()
             return len(to_remove)
     
     def clear_all(self) -> int:
         """清除所有任务，返回清除数量"""
         with self._lock:
             count = len(self._tasks)
+            for local_id in self._tasks:
+                self._save(local_id, deleted=True)
             self._tasks.clear()
-            self._save()
+            for ids in self._by_status.values():
+                ids.clear()
+            self._publish()
             return count
 
 
-# 全局任务存储实例
-task_store = TaskStore()
+class _LazyTaskStore:
+    """首次访问属性时才创建 TaskStore，避免导入模块时就读盘"""
+    
+    def __init__(self):
+        self._real: Optional[TaskStore] = None
+        self._init_lock = threading.Lock()
+    
+    def _get(self) -> TaskStore:
+        real = self._real
+        if real is None:
+            with self._init_lock:
+                if self._real is None:
+                    self._real = TaskStore()
+                real = self._real
+        return real
+    
+    def __getattr__(self, name: str):
+        return getattr(self._get(), name)
+
+
+# 全局任务存储实例（延迟加载）
+task_store = _LazyTaskStore()
 
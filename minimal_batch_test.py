@@ -10,23 +10,34 @@
 - 已在环境变量中配置 GOOGLE_API_KEY 或 GEMINI_API_KEY
 """
 
+import functools
 import os
 import time
 
 from dotenv import load_dotenv
 from google import genai
 
+# 轮询间隔：从 1 秒开始逐步退避到 15 秒
+POLL_INTERVAL_MIN = 1.0
+POLL_INTERVAL_MAX = 15.0
+POLL_BACKOFF = 1.5
 
-def main() -> None:
-    # 1. 加载 .env 并初始化 Gemini 客户端（优先使用 GOOGLE_API_KEY，其次 GEMINI_API_KEY）
-    #    注意：每次单独运行 Python 脚本都会启动一个新进程，不会自动继承 diagnose_env.py 里的 load_dotenv 结果，
-    #    因此这里需要显式调用一次。
+
+@functools.lru_cache(maxsize=1)
+def _client() -> genai.Client:
+    """加载 .env 并创建 Gemini 客户端，同一进程内只创建一次（优先使用 GOOGLE_API_KEY，其次 GEMINI_API_KEY）"""
+    # 注意：每次单独运行 Python 脚本都会启动一个新进程，不会自动继承 diagnose_env.py 里的 load_dotenv 结果，
+    # 因此这里需要显式调用一次。
     load_dotenv(override=True)
     api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
     if not api_key:
         raise RuntimeError("未在环境变量中找到 GOOGLE_API_KEY 或 GEMINI_API_KEY，无法初始化 Gemini 客户端。")
+    return genai.Client(api_key=api_key)
 
-    client = genai.Client(api_key=api_key)
+
+def main() -> None:
+    # 1. 初始化 Gemini 客户端
+    client = _client()
 
     # 2. 按官方文档构造最小化 inline 请求列表
     inline_requests = [
@@ -73,6 +84,7 @@ def main() -> None:
         "JOB_STATE_EXPIRED",
     }
 
+    interval = POLL_INTERVAL_MIN
     while True:
         job = client.batches.get(name=job_name)
         state = job.state
@@ -82,7 +94,9 @@ def main() -> None:
         if state_name in terminal_states:
             break
 
-        time.sleep(10)
+        # 短任务很快就能看到结果，长任务则逐步拉长间隔、减少请求次数
+        time.sleep(interval)
+        interval = min(interval * POLL_BACKOFF, POLL_INTERVAL_MAX)
 
     print(f"✅ 任务结束，最终状态: {state_name}")
 
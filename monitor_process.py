@@ -8,14 +8,51 @@
 """
 
 import requests
+from requests_toolbelt import MultipartEncoder
 import json
-import time
+import threading
 import sys
 from pathlib import Path
 
 
 BASE_URL = "http://127.0.0.1:8000"
 
+# 轮询间隔：有新轮次时回到最小值，否则逐步退避到最大值（秒）
+POLL_INTERVAL_MIN = 0.5
+POLL_INTERVAL_MAX = 10.0
+POLL_BACKOFF = 1.5
+
+# 轮次展示：AI 思考摘要的最大长度，以及工具调用中优先展示的关键参数
+MAX_SUMMARY_CHARS = 300
+KEY_ARG_NAMES = ('text', 'keyword', 'query', 'sutra_id')
+
+
+def _watch_events(task_id: str, latest: dict, changed: threading.Event):
+    """
+    在后台线程订阅任务状态推送（SSE），收到新状态即唤醒主循环。
+    
+    推送占用一条独立的长连接，使用自己的 Session，退出时随之关闭；
+    后端没有事件接口或连接中断时直接返回，主循环退回到按间隔查询状态。
+    """
+    try:
+        with requests.Session() as session, session.get(
+            f"{BASE_URL}/api/v1/jobs/{task_id}/events",
+            headers={"Accept": "text/event-stream"},
+            stream=True,
+            timeout=(3.05, None),
+        ) as resp:
+            if resp.status_code != 200:
+                return
+            for line in resp.iter_lines():
+                if line.startswith(b"data:"):
+                    latest["status"] = json.loads(line[5:])
+                    changed.set()
+    except requests.exceptions.RequestException:
+        pass
+    finally:
+        latest["stream_closed"] = True
+        changed.set()
+
 
 def submit_and_monitor(image_path: str):
     """提交任务并实时监控处理过程"""
@@ -24,15 +61,24 @@ def submit_and_monitor(image_path: str):
         print(f"❌ 文件不存在: {image_path}")
         return
     
+    # 复用同一个连接，避免每次查询都重新建立 TCP 连接
+    with requests.Session() as session:
+        _submit_and_monitor(session, image_path)
+
+
+def _submit_and_monitor(session: requests.Session, image_path: str):
     # 1. 提交任务
     print(f"📤 提交任务: {image_path}")
     print("="*60)
     
     try:
+        # 流式 multipart：按块读取文件，不把整张图片载入内存
         with open(image_path, 'rb') as f:
-            response = requests.post(
+            encoder = MultipartEncoder(fields={'file': (Path(image_path).name, f, 'image/png')})
+            response = session.post(
                 f"{BASE_URL}/api/v1/jobs/image",
-                files={'file': f}
+                data=encoder,
+                headers={'Content-Type': encoder.content_type},
             )
         response.raise_for_status()
     except requests.exceptions.RequestException as e:
@@ -42,26 +88,38 @@ def submit_and_monitor(image_path: str):
     task_id = response.json()['task_id']
     print(f"✅ Task ID: {task_id}\n")
     
+    # 状态推送使用独立连接，主循环的查询仍复用 session 的连接
+    latest: dict = {}
+    changed = threading.Event()
+    threading.Thread(
+        target=_watch_events,
+        args=(task_id, latest, changed),
+        daemon=True,
+    ).start()
+    
     # 2. 监控处理过程
     last_round = 0
     check_count = 0
-    max_checks = 200  # 最多检查 200 次（约 16 分钟）
+    max_checks = 200  # 最多检查 200 次（退避到上限后约 30 分钟）
+    interval = POLL_INTERVAL_MIN
     
     while check_count < max_checks:
         check_count += 1
         
         try:
-            # 查询任务状态
-            status_resp = requests.get(f"{BASE_URL}/api/v1/jobs/{task_id}")
-            status_resp.raise_for_status()
-            status_data = status_resp.json()
+            # 优先使用推送来的状态，推送不可用时查询
+            status_data = latest.get("status")
+            if status_data is None or latest.get("stream_closed"):
+                status_resp = session.get(f"{BASE_URL}/api/v1/jobs/{task_id}")
+                status_resp.raise_for_status()
+                status_data = status_resp.json()
             status = status_data['status']
             
             print(f"[{check_count}] 📊 状态: {status}", end="")
             
             # 尝试获取处理过程
             try:
-                process_resp = requests.get(
+                process_resp = session.get(
                     f"{BASE_URL}/api/v1/jobs/{task_id}/process"
                 )
                 
@@ -70,8 +128,9 @@ def submit_and_monitor(image_path: str):
                     current_rounds = process_data['total_rounds']
                     print(f" | 已完成轮次: {current_rounds}")
                     
-                    # 显示新轮次
+                    # 显示新轮次；出现新轮次说明任务正活跃，缩短查询间隔
                     if current_rounds > last_round:
+                        interval = POLL_INTERVAL_MIN
                         for i in range(last_round, current_rounds):
                             round_info = process_data['rounds'][i]
                             print(f"\n{'='*60}")
@@ -80,8 +139,8 @@ def submit_and_monitor(image_path: str):
                             
                             # 显示 AI 思考摘要（前 300 字符）
                             summary = round_info['summary']
-                            if len(summary) > 300:
-                                summary = summary[:300] + "..."
+                            if len(summary) > MAX_SUMMARY_CHARS:
+                                summary = summary[:MAX_SUMMARY_CHARS] + "..."
                             print(f"\n💭 AI 思考:")
                             print(f"   {summary}")
                             
@@ -98,11 +157,10 @@ def submit_and_monitor(image_path: str):
                                         args = tool['args']
                                         # 只显示第一个参数或关键参数
                                         if isinstance(args, dict):
-                                            key_arg = None
-                                            for k in ['text', 'keyword', 'query', 'sutra_id']:
-                                                if k in args:
-                                                    key_arg = f"{k}={str(args[k])[:60]}"
-                                                    break
+                                            key_arg = next(
+                                                (f"{k}={str(args[k])[:60]}" for k in KEY_ARG_NAMES if k in args),
+                                                None,
+                                            )
                                             if key_arg:
                                                 print(f"      参数: {key_arg}...")
                         
@@ -148,7 +206,10 @@ def submit_and_monitor(image_path: str):
         except requests.exceptions.RequestException as e:
             print(f"\n⚠️ 请求失败: {e}")
         
-        time.sleep(5)
+        # 状态变化时立即进入下一轮，否则按退避间隔刷新处理记录
+        changed.wait(interval)
+        changed.clear()
+        interval = min(interval * POLL_BACKOFF, POLL_INTERVAL_MAX)
     
     if check_count >= max_checks:
         print(f"\n⏱️ 已超过最大检查次数 ({max_checks})")
@@ -1,14 +1,22 @@
+from __future__ import annotations
+
+import atexit
+import mimetypes
 import os
-import json
-import textwrap
+import queue
+import random
+import threading
 import time
 import uuid
-from typing import List, Dict, Any, Optional, Generator, Callable
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Generator, Callable
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType
+import orjson
 from pydantic import BaseModel, Field
-from google import genai
-from google.genai import types
 from dotenv import load_dotenv
 
 from src.cbeta_tools import CBETATools
@@ -16,22 +24,139 @@ from src.gallica_client import GallicaClient
 from src.gallica_mcp import GallicaMCPClient, MCPConfig
 from src.schemas import FinalAnswer, ScriptureLocation, OCRResult
 
+if TYPE_CHECKING:
+    from google.genai import types
+
 StreamHandler = Callable[[str, Dict[str, Any]], None]
 
 class AgentConfig(BaseModel):
     """Agent 配置"""
     thinking_level: str = "high"  # "low" or "high"
     max_tool_rounds: int = 5  # 最多工具调用轮数（不含最终结构化输出轮）
-    retry_interval: int = 20  # 重试间隔秒数
+    retry_interval: int = 2  # 首次重试前的等待秒数，之后按指数退避
+    retry_max_interval: int = 60  # 重试等待的上限秒数
     normal_retries: int = 3  # 普通轮重试次数
     final_retries: int = 5  # 最终结构化输出轮重试次数
     timeout_seconds: int = 120
+    max_parallel_tools: int = 4  # 同一轮内并行执行的工具调用数上限
+    # 同一 Agent 上同时执行的工具调用总数上限（批处理多个 session 并行、服务端多任务并发时共享，
+    # 各调用最终落到同一个 CBETA 会话与 Gallica MCP 进程上）
+    max_concurrent_tools: int = 8
+    # 上下文缓存：把图片与工具声明放入 Vertex 缓存，各轮只发送新增内容（内容过短时创建会失败并自动回退）
+    context_cache: bool = False
+    context_cache_ttl: str = "1800s"  # 缓存存活时间，流程结束时会主动删除
     model_name: str = "gemini-3-pro-preview"
     verbose: bool = True  # 是否开启可视化输出
     # Gallica MCP 配置
     gallica_mcp_enabled: bool = True  # 是否启用 Gallica MCP
     gallica_mcp_path: str = ""  # sweet-bnf 项目路径（留空则从环境变量读取）
 
+class _RoundWriter:
+    """
+    轮次记录的后台写入线程。
+    
+    save_round 只把编码好的行放入队列即返回；写线程一次取出所有排队的行，
+    按文件合并后单次 write 追加。文件以 O_APPEND 打开后保持复用，
+    每轮只需一次 write 系统调用；最近最少使用的文件超过上限时关闭。
+    """
+
+    MAX_OPEN_FILES = 32
+
+    def __init__(self):
+        self._queue: "queue.Queue[tuple[Path, bytes]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._fds: "OrderedDict[Path, int]" = OrderedDict()  # 仅由写线程访问
+
+    def submit(self, path: Path, line: bytes):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="round-writer", daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+        self._queue.put((path, line))
+
+    def flush(self):
+        """等待已提交的记录全部写入文件"""
+        self._queue.join()
+
+    def _fd_for(self, path: Path) -> int:
+        fd = self._fds.get(path)
+        if fd is not None:
+            self._fds.move_to_end(path)
+            return fd
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._fds[path] = fd
+        if len(self._fds) > self.MAX_OPEN_FILES:
+            _, oldest = self._fds.popitem(last=False)
+            os.close(oldest)
+        return fd
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while True:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            grouped: Dict[Path, List[bytes]] = {}
+            for path, line in batch:
+                grouped.setdefault(path, []).append(line)
+            for path, lines in grouped.items():
+                try:
+                    os.write(self._fd_for(path), b"".join(lines))
+                except OSError as exc:
+                    print(f"⚠️ 保存轮次记录失败: {exc}")
+                    fd = self._fds.pop(path, None)
+                    if fd is not None:
+                        os.close(fd)
+            for _ in batch:
+                self._queue.task_done()
+
+
+_round_writer = _RoundWriter()
+
+
+class _StreamDispatcher:
+    """
+    流式事件的后台分发线程。
+
+    调用方的 handler 可能写文件、打印终端，放在工具调度路径上会拖慢每轮；
+    这里只把事件放入队列即返回，由专用线程按提交顺序转交给 handler。
+    每次 analyze_and_locate 启动一个，流程结束时 close 等待队列排空后退出。
+    """
+
+    _STOP = object()
+
+    def __init__(self, handler: StreamHandler):
+        self._handler = handler
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="stream-dispatcher", daemon=True)
+        self._thread.start()
+
+    def __call__(self, event_type: str, payload: Dict[str, Any]):
+        self._queue.put((event_type, payload))
+
+    def close(self):
+        """停止分发线程；已排队的事件全部交付后才返回"""
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self):
+        handler = self._handler
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+            try:
+                handler(*item)
+            except Exception as exc:
+                print(f"⚠️ 流式事件处理失败: {exc}")
+
+
 class SessionManager:
     """会话管理器"""
     def __init__(self, storage_dir: str = "sessions"):
@@ -52,8 +177,8 @@ class SessionManager:
             "updated_at": datetime.now().isoformat(),
             "history_count": len(history)  # 简化：只保存数量，不保存完整历史
         }
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        with open(file_path, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
     def load_session(self, session_id: str) -> List[Dict]:
         """加载会话历史"""
@@ -64,72 +189,520 @@ class SessionManager:
         return self.storage_dir / f"{session_id}.rounds.jsonl"
 
     def save_round(self, session_id: str, payload: Dict[str, Any]):
-        """将单轮摘要写入 JSONL 文件"""
-        file_path = self._rounds_path(session_id)
-        try:
-            with open(file_path, "a", encoding="utf-8") as f:
-                json.dump(payload, f, ensure_ascii=False)
-                f.write("\n")
-        except OSError as exc:
-            print(f"⚠️ 保存轮次记录失败: {exc}")
+        """将单轮摘要追加到 JSONL 文件（交给后台线程写入，不阻塞调用方）"""
+        line = orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS) + b"\n"
+        _round_writer.submit(self._rounds_path(session_id), line)
 
     def load_rounds(self, session_id: str) -> List[Dict[str, Any]]:
         """读取指定会话的轮次记录"""
+        _round_writer.flush()
         file_path = self._rounds_path(session_id)
         rounds: List[Dict[str, Any]] = []
         if not file_path.exists():
             return rounds
 
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
+            with open(file_path, "rb") as f:
                 for line in f:
                     line = line.strip()
                     if not line:
                         continue
                     try:
-                        rounds.append(json.loads(line))
-                    except json.JSONDecodeError:
+                        rounds.append(orjson.loads(line))
+                    except orjson.JSONDecodeError:
                         continue
         except OSError as exc:
             print(f"⚠️ 读取轮次记录失败: {exc}")
             return rounds
 
+        # 轮次按顺序追加，通常已经有序，只有检测到乱序时才排序
+        indices = [record.get("round_index", 0) for record in rounds]
+        if all(prev <= cur for prev, cur in zip(indices, indices[1:])):
+            return rounds
         return sorted(rounds, key=lambda record: record.get("round_index", 0))
 
 
+@lru_cache(maxsize=1)
+def _lazy_types():
+    """首次使用时才导入 google.genai.types（连带 protobuf、认证等库，导入耗时数百毫秒）"""
+    from google.genai import types
+    return types
+
+
 def build_round_history_contents(round_records: List[Dict[str, Any]]) -> List[types.Content]:
-    """将轮次记录转换为 Gemini 可用的历史消息"""
+    """将轮次记录转换为 Gemini 可用的历史消息（相同记录复用已构建的 Content）"""
     contents: List[types.Content] = []
     for record in round_records:
-        round_index = record.get("round_index", "?")
-        segments: List[str] = []
-        summary = (record.get("summary") or "").strip()
-        segments.append(
-            f"【历史第 {round_index} 轮摘要】{summary or '未提供摘要'}"
-        )
+        # 不排序键：记录从同一文件读出，键顺序稳定，且参数的原始顺序需要保留在提示词中
+        key = orjson.dumps(record, default=str, option=orjson.OPT_NON_STR_KEYS)
+        contents.append(_round_record_content(key))
+    return contents
 
-        tool_calls = record.get("tool_calls") or []
-        if tool_calls:
-            tools_desc = []
-            for call in tool_calls:
-                name = call.get("name", "unknown")
-                args = call.get("args", {})
-                try:
-                    args_str = json.dumps(args, ensure_ascii=False)
-                except (TypeError, ValueError):
-                    args_str = str(args)
 
-                result_summary = call.get("result_summary", "")
-                tools_desc.append(f"{name}({args_str}) → {result_summary}")
-            segments.append("工具调用: " + " | ".join(tools_desc))
+def _dump_args(args: Any) -> str:
+    """工具参数 -> 紧凑 JSON，无法序列化的值按 str 处理"""
+    return orjson.dumps(args, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
 
-        notes = record.get("notes") or []
-        for note in notes:
-            segments.append(f"备注: {note}")
 
-        contents.append(types.Content(role="user", parts=[types.Part(text="\n".join(segments))]))
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+
+def _json_safe(value: Any) -> Any:
+    """逐层把值转换为 JSON 友好的形式，无法表示的值按 str 处理"""
+    if isinstance(value, _JSON_SCALARS):
+        return value
+    if isinstance(value, dict):
+        return {k: _json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    return str(value)
+
+
+@lru_cache(maxsize=512)
+def _round_record_content(record_json: bytes) -> types.Content:
+    """单条轮次记录 -> Content；以序列化后的记录为缓存键，续跑时历史轮次无需重复构建"""
+    types = _lazy_types()
+    record = orjson.loads(record_json)
+    round_index = record.get("round_index", "?")
+    segments: List[str] = []
+    summary = (record.get("summary") or "").strip()
+    segments.append(
+        f"【历史第 {round_index} 轮摘要】{summary or '未提供摘要'}"
+    )
+
+    tool_calls = record.get("tool_calls") or []
+    if tool_calls:
+        segments.append("工具调用: " + " | ".join(
+            f"{call.get('name', 'unknown')}({_dump_args(call.get('args', {}))}) → {call.get('result_summary', '')}"
+            for call in tool_calls
+        ))
+
+    notes = record.get("notes") or []
+    for note in notes:
+        segments.append(f"备注: {note}")
+
+    return types.Content(role="user", parts=[types.Part(text="\n".join(segments))])
+
+
+# Gemini 工具声明（纯静态数据）
+_TOOL_SPECS: List[Dict[str, Any]] = [
+    {
+        "function_declarations": [
+            # ===== 核心检索工具 =====
+            {
+                "name": "search_full_text",
+                "description": "【全文检索】在 CBETA 全库进行关键词搜索。返回匹配的经卷列表及上下文片段。适用场景：已知关键词，需要找出所有出处。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "query": {"type": "STRING", "description": "搜索关键词（简繁皆可，系统自动转换）"},
+                        "rows": {"type": "INTEGER", "description": "返回数量（默认20）"},
+                        "canon": {"type": "STRING", "description": "限制藏经版本：T=大正藏, X=卍续藏, J=嘉兴藏, H=正史佛教资料, A=赵城金藏 等"},
+                        "category": {"type": "STRING", "description": "限制部类（如：阿含部类、般若部类、华严部类）"},
+                        "dynasty": {"type": "STRING", "description": "限制朝代（如：唐、宋、隋）"}
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "search_advanced",
+                "description": "【高级检索】支持复杂布尔语法的整合检索，同时返回 KWIC 前后文和分类统计。语法：空格=AND, |=OR, !=NOT, NEAR/n=邻近。适用场景：需要精确组合多个条件。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "query": {"type": "STRING", "description": "高级查询串。示例：'\"法鼓\" \"聖嚴\"'(AND), '\"波羅蜜\"|\"波羅密\"'(OR), '\"法鼓\" NEAR/7 \"迦葉\"'(邻近7字内)"},
+                        "facet": {"type": "BOOLEAN", "description": "是否返回藏经/部类/朝代/作者统计（默认true）"},
+                        "around": {"type": "INTEGER", "description": "KWIC 上下文字数（默认15）"}
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "search_similar",
+                "description": "【相似文本搜索】基于 Smith-Waterman 算法查找相似段落。适用场景：输入 OCR 识别的长文本（6-50字），找出 CBETA 中相似的经文段落。对 OCR 错字有一定容错。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "text": {"type": "STRING", "description": "文本片段（建议6-50字，不含标点）"},
+                        "score_min": {"type": "INTEGER", "description": "最低匹配分数（默认16，越高越严格）"}
+                    },
+                    "required": ["text"]
+                }
+            },
+            # ===== 精确定位工具 =====
+            {
+                "name": "search_title",
+                "description": "【经名搜索】仅搜索佛典标题（经名），快速查找特定经典。适用场景：知道经名但不确定完整名称或经号。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "query": {"type": "STRING", "description": "经名关键词（如：金刚经、阿含、华严）"},
+                        "rows": {"type": "INTEGER", "description": "返回数量（默认20）"}
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "search_kwic",
+                "description": "【单卷精确检索】针对特定佛典的特定卷进行 KWIC 检索，返回所有匹配位置及前后文。适用场景：已知经号和卷号，需要精确定位关键词在该卷中的位置。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "work": {"type": "STRING", "description": "佛典编号（如：T0001, T0235, X0087）"},
+                        "juan": {"type": "INTEGER", "description": "卷号（如：1, 2, 3）"},
+                        "query": {"type": "STRING", "description": "关键词，多词用逗号分隔"},
+                        "around": {"type": "INTEGER", "description": "前后文字数（默认15）"},
+                        "include_notes": {"type": "BOOLEAN", "description": "是否包含夹注（默认true）"}
+                    },
+                    "required": ["work", "juan", "query"]
+                }
+            },
+            {
+                "name": "search_toc",
+                "description": "【目录搜索】搜索经名、部类目录或佛典内目次结构。适用场景：查找某部经的章节结构，或按部类浏览。返回类型：catalog(部类目录)、work(佛典标题)、toc(内部目次)。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "query": {"type": "STRING", "description": "搜索词（如：阿含、般若、涅槃）"},
+                        "rows": {"type": "INTEGER", "description": "返回数量（默认20）"}
+                    },
+                    "required": ["query"]
+                }
+            },
+            # ===== 辅助研究工具 =====
+            {
+                "name": "search_notes",
+                "description": "【注解检索】专门搜索校勘条目、注解或夹注。支持高级语法。适用场景：查找某词在校勘/注解中的出现，研究版本差异。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "query": {"type": "STRING", "description": "搜索词（支持 AND/OR/NOT/NEAR 语法）"},
+                        "facet": {"type": "BOOLEAN", "description": "是否返回分类统计（默认false）"},
+                        "rows": {"type": "INTEGER", "description": "返回数量（默认20）"}
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "search_variants",
+                "description": "【异体字查询】列出关键词的所有异体字变化。适用场景：OCR 结果可能有异体字（如：著/着、鉢/钵），先用此工具获取变体再搜索可提高召回率。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "query": {"type": "STRING", "description": "原始词（如：著衣持鉢）"},
+                        "scope": {"type": "STRING", "description": "可选 'title' 仅列出佛典题名中的异体字"}
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "get_facet_stats",
+                "description": "【统计分析】获取关键词在不同维度下的分布统计。适用场景：了解某词在各藏经/部类/朝代/作者中的使用频率分布。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "query": {"type": "STRING", "description": "搜索词"},
+                        "facet_type": {"type": "STRING", "description": "维度类型：canon(藏经)、category(部类)、creator(作译者)、dynasty(朝代)、work(佛典)。留空返回所有维度。"}
+                    },
+                    "required": ["query"]
+                }
+            },
+            # ===== Gallica 工具（法国国家图书馆敦煌文献） =====
+            {
+                "name": "search_gallica",
+                "description": "【Gallica 搜索】在法国国家图书馆 (BnF) Gallica 馆藏中搜索文献。适用场景：CBETA 缺少的敦煌写本、Pelliot 藏品、西域出土文献等。可与 CBETA 结果交叉验证。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "query": {"type": "STRING", "description": "搜索关键词（如：Dunhuang、敦煌、Pelliot、经名等）"},
+                        "max_records": {"type": "INTEGER", "description": "最大返回数量（默认10）"},
+                        "doc_type": {"type": "STRING", "description": "限制文档类型：manuscrit(手稿)、image(图像)"},
+                        "language": {"type": "STRING", "description": "限制语言：chi(中文)、san(梵文)、tib(藏文)"}
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "search_gallica_dunhuang",
+                "description": "【Gallica 敦煌专搜】专门搜索 Gallica 中的敦煌相关文献（自动包含 Dunhuang、Pelliot、敦煌等关键词）。适用场景：快速查找法国馆藏的敦煌写本，用于与 CBETA 版本比对。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "keyword": {"type": "STRING", "description": "额外关键词（可选，如经名、人名）"},
+                        "max_records": {"type": "INTEGER", "description": "最大返回数量（默认10）"}
+                    },
+                    "required": []
+                }
+            },
+            {
+                "name": "search_gallica_by_title",
+                "description": "【Gallica 题名搜索】基于 MCP 的 search_by_title，适合按题名精确定位法国馆藏写本。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "title": {"type": "STRING", "description": "文献题名"},
+                        "exact_match": {"type": "BOOLEAN", "description": "是否要求完全匹配（默认 false）"},
+                        "max_results": {"type": "INTEGER", "description": "最大返回数量（默认10）"}
+                    },
+                    "required": ["title"]
+                }
+            },
+            {
+                "name": "search_gallica_by_author",
+                "description": "【Gallica 作者搜索】使用 MCP 的 search_by_author，查找特定作者或收藏者的写本。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "author": {"type": "STRING", "description": "作者或藏者姓名"},
+                        "exact_match": {"type": "BOOLEAN", "description": "是否完全匹配（默认 false）"},
+                        "max_results": {"type": "INTEGER", "description": "最大返回数量（默认10）"}
+                    },
+                    "required": ["author"]
+                }
+            },
+            {
+                "name": "search_gallica_by_subject",
+                "description": "【Gallica 主题搜索】基于 MCP 的 search_by_subject，可用于按主题/关键词聚焦敦煌分类。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "subject": {"type": "STRING", "description": "主题关键词"},
+                        "exact_match": {"type": "BOOLEAN", "description": "是否完全匹配（默认 false）"},
+                        "max_results": {"type": "INTEGER", "description": "最大返回数量（默认10）"}
+                    },
+                    "required": ["subject"]
+                }
+            },
+            {
+                "name": "search_gallica_advanced",
+                "description": "【Gallica 高级搜索】对应 MCP 的 advanced_search，支持 Gallica CQL 语法组合多个字段。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "query": {"type": "STRING", "description": "CQL 查询字符串"},
+                        "max_results": {"type": "INTEGER", "description": "最大返回数量（默认10）"}
+                    },
+                    "required": ["query"]
+                }
+            },
+            {
+                "name": "get_gallica_manifest",
+                "description": "【Gallica 文档结构】获取指定 Gallica 文档的 IIIF Manifest，包含页面列表、元数据、图像链接。适用场景：已知 ARK ID，需要了解文档有多少页、获取高清图像链接。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "ark": {"type": "STRING", "description": "ARK 标识符（如 ark:/12148/btv1b8304226d 或短 ID btv1b8304226d）"}
+                    },
+                    "required": ["ark"]
+                }
+            },
+            {
+                "name": "get_gallica_pages",
+                "description": "【Gallica 页面枚举】调用 MCP get_item_pages，支持分页获取某份写本的页面列表。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "ark": {"type": "STRING", "description": "ARK 标识符"},
+                        "page": {"type": "INTEGER", "description": "指定页码（可选）"},
+                        "page_size": {"type": "INTEGER", "description": "返回页数（可选）"}
+                    },
+                    "required": ["ark"]
+                }
+            },
+            {
+                "name": "get_gallica_page",
+                "description": "【Gallica 单页信息】获取 Gallica 文档某一页的详细信息，包括分辨率、图像 URL、缩略图。适用场景：需要查看或比对特定页面的高清图像。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "ark": {"type": "STRING", "description": "ARK 标识符"},
+                        "page": {"type": "STRING", "description": "页码（如 f1、f2，默认 f1）"}
+                    },
+                    "required": ["ark"]
+                }
+            },
+            {
+                "name": "get_gallica_page_text",
+                "description": "【Gallica 页面文本】调用 MCP get_page_text，直接获取 ALTO/Plain OCR 内容，快速比对写本文字。",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "ark": {"type": "STRING", "description": "ARK 标识符"},
+                        "page": {"type": "INTEGER", "description": "页码数字（如 1 代表 f1）"},
+                        "format": {"type": "STRING", "description": "文本格式 plain/alto/tei（默认 plain）"}
+                    },
+                    "required": ["ark", "page"]
+                }
+            }
+        ]
+    }
+]
+
+@lru_cache(maxsize=1)
+def _tools_declarations() -> List[types.Tool]:
+    """首次创建代理时校验为 types.Tool 一次，所有代理实例共享，每轮生成时无需再从字典重新校验"""
+    types = _lazy_types()
+    return [types.Tool.model_validate(spec) for spec in _TOOL_SPECS]
+
+
+# FinalAnswer 是静态模型，JSON Schema 在导入时生成一次
+_FINAL_ANSWER_SCHEMA: Dict[str, Any] = FinalAnswer.model_json_schema()
+
+
+@lru_cache(maxsize=1)
+def _final_generate_config() -> types.GenerateContentConfig:
+    """
+    最终轮的 structured output 配置，构建一次后复用（SDK 在构建时复制 schema，发送请求时不修改配置）：
+    - response_mime_type 固定为 application/json
+    - response_schema 传入 Pydantic 生成的 JSON Schema
+    """
+    return _lazy_types().GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=_FINAL_ANSWER_SCHEMA,
+    )
+
+
+# 常见图片格式的文件头 -> MIME，据此判断实际格式，不必用 PIL 解析图片头
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+)
+
+
+def sniff_image_mime(data: bytes, path: Optional[str] = None) -> Optional[str]:
+    """按文件头识别图片 MIME；无法识别时按扩展名推断，仍不是图片则返回 None"""
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if path:
+        guessed = mimetypes.guess_type(path)[0]
+        if guessed and guessed.startswith("image/"):
+            return guessed
+    return None
+
+
+# Gemini 请求的 HTTP 连接池上限：批处理各 session、各轮工具调用会同时发起请求
+_HTTP_MAX_CONNECTIONS = 64
+_HTTP_MAX_KEEPALIVE_CONNECTIONS = 32
+
+
+@lru_cache(maxsize=None)
+def _vertex_client(project_id: str, location: str):
+    """
+    按 (project, location) 在进程内只创建一个 genai.Client：
+    凭据只加载一次，底层 httpx 连接池与 TLS 连接在所有代理实例、所有轮次间复用。
+    """
+    import httpx
+    from google import genai
+
+    # google-genai 在 vertexai=True 模式下会基于 ADC 与 Vertex AI 通信
+    return genai.Client(
+        vertexai=True,
+        project=project_id,
+        location=location,
+        http_options=_lazy_types().HttpOptions(
+            client_args={
+                "limits": httpx.Limits(
+                    max_connections=_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+            },
+        ),
+    )
+
+
+# 请求超时 / 限流，稍后重试可能成功的 4xx 状态码
+_RETRYABLE_CLIENT_CODES = frozenset({408, 429})
+
+# 分析提示词：开头按输入类型二选一，正文固定不变，只在导入时构建一次
+_PROMPT_OCR_HEAD = """你是一位佛教文献考证专家。现在有一段古籍文字：
+
+{ocr_text}
+
+"""
+
+_PROMPT_IMAGE = """你是一位佛教文献考证专家。请分析这张图片中的古籍文字，找出其在 CBETA 中的出处。
+
+"""
+
+_PROMPT_BODY = """## 核心目标
+**优先考证出处；OCR 仅需提炼可辨认片段，并清晰标注不确定字符。**
+
+## 工作流
+
+### 1. 快速 OCR 摘要
+- 逐列或逐句记录可读文字（示例："列1：淨土中… "）
+- 用 `[?]` 或 `[unclear]` 标记模糊字，不要强猜
+- 提炼关键字/短语，便于后续搜索
+
+### 2. 并行搜索策略（可同时调用多个工具）
+**CBETA 工具（主线程）：**
+- `search_similar`：用于 6-50 字长片段（含不确定位也可）
+- `search_full_text`：用于高置信度关键词组合
+- `search_title` / `search_toc`：探索可能经名或章节
+- `search_variants`：获取异体字以扩大发现
+
+**Gallica 工具（敦煌分身）—— 当 CBETA 结果不足或需跨版本比对时：**
+- `search_gallica_dunhuang`：快速查找法国国家图书馆的敦煌写本
+- `search_gallica`：按关键词搜索 Pelliot 藏品、西域出土文献
+- `get_gallica_manifest`：获取文档结构与高清图像链接
+- `get_gallica_page`：获取单页图像 URL，用于多模态比对
+
+**子任务分工示例：**
+- 主线程：继续 CBETA 深挖，用 `search_kwic` 精确定位
+- Gallica 分身：同时搜索敦煌写本，返回候选 ARK 与图像链接
+- 图像比对分身（可选）：获取 Gallica 页面缩略图，与原图对照
+
+### 3. 精确定位与交叉验证
+- 对高置信度候选，使用 `search_kwic` 等获取上下文
+- 汇总证据：匹配字句、卷次、作译者、朝代
+- **CBETA vs Gallica 对照**：在 `candidate_insights` 中记录两者差异（可选）
+- 指出仍需人工确认的差异或疑点
+
+### 4. 结构化输出（便于人工校对）
+最终 JSON 中请确保：
+- `ocr_result.recognized_text`：合并后的全文；`uncertain_chars`：列出所有标记
+- `ocr_notes`：列表，逐列/逐句描述 OCR 摘要（含不确定说明）
+- `scripture_locations`：至多 5 条候选，含匹配片段、置信度、证据：
+  - 对 **CBETA** 候选：可设置 `source="CBETA"`，`work_id`/`canon`/`juan` 等字段准确完整，`external_url` 可留空（系统会自动生成 CBETA 在线链接）。
+  - 对 **Gallica** 候选：允许将写本视作“藏卷”加入 `scripture_locations`，并设置：
+    - `source="Gallica"`
+    - 若已知 ARK 与页码，尽量填入 `external_url` 为可直接打开的 Gallica 在线阅读链接（例如 `https://gallica.bnf.fr/ark:/12148/btv1b8304226d/f3.item`）
+- `key_facts`：片段关键信息列表，每项一句，直接基于图像与正文可见内容（**不**依赖外部文献），例如：
+  - 物质形态：册子本/单叶/对开叶，页数或叶数，装订情况，残损位置（首/尾/左右上下）。
+  - 题记与尾题：首题、尾题、署名、题记中的时间与人物。
+  - 版式与标记：有无科分标题、行数栏数、朱笔圈点/删除、杂写、插图等。
+- `candidate_insights`：逐条概述候选为何值得关注，**包括 Gallica 证据**，以及需人工核对的点
+- `verification_points`：列出人工校对要点（疑难字、需查卷、**Gallica ARK/页码**、建议的 KWIC 位置等）
+- `next_actions`：给实地研究者的后续建议（如"去查 T1753 卷2 KWIC 0258a25"、**"查阅 Gallica ark:/12148/xxx f3 页"**）
+- `tools_used`、`search_iterations`、`session_id`：保持完整，可用于追踪
+
+## 置信度评分建议
+- **0.8-1.0**：多处关键字连续匹配，卷次/作译者一致，**Gallica 有对应写本佐证**
+- **0.6-0.8**：主要字句吻合，少量 OCR 或版本出入
+- **0.4-0.6**：仅部分关键词匹配
+- **0.0-0.4**：证据不足，仅用作线索
+
+## 注意事项
+- 任何模糊字必须标注 `[?]`，并在 `ocr_notes` 中说明
+- 每轮思考时给出"为何调用某工具"与"得到的人工可读结论"
+- **当调用 Gallica 工具时，说明与 CBETA 的对照意图**
+- 若 Gallica 返回图像链接，在 `next_actions` 中附上供人工查看
+- 结果要像"人工校对笔记"：短句、要点、可直接引用
+
+请开始分析并调用工具。"""
+
+# 两种完整提示词在导入时拼好：图片模式直接返回常量，OCR 模式只需把文字插在前后两段之间
+_PROMPT_IMAGE_FULL = _PROMPT_IMAGE + _PROMPT_BODY
+_PROMPT_OCR_BEFORE, _PROMPT_OCR_AFTER = (_PROMPT_OCR_HEAD + _PROMPT_BODY).split("{ocr_text}")
 
-    return contents
 
 class CBETAAgent:
     def __init__(self, config: Optional[AgentConfig] = None):
@@ -154,12 +727,8 @@ class CBETAAgent:
                 "详细说明见 docs/vertex_directions.md。"
             )
 
-        # google-genai 在 vertexai=True 模式下会基于 ADC 与 Vertex AI 通信
-        self.client = genai.Client(
-            vertexai=True,
-            project=project_id,
-            location=location,
-        )
+        # 同一进程内的代理实例共享同一个客户端及其连接池
+        self.client = _vertex_client(project_id, location)
         self.session_manager = SessionManager()
         self.cbeta_tools = CBETATools()
         
@@ -177,7 +746,8 @@ class CBETAAgent:
             else:
                 print("ℹ️ Gallica 使用本地回退模式")
 
-        self.tools_map = {
+        # 工具名 -> 绑定方法，构造时绑定一次后只读
+        self.tools_map = MappingProxyType({
             # ===== CBETA 工具 =====
             "search_full_text": self.cbeta_tools.search_full_text,
             "search_advanced": self.cbeta_tools.search_advanced,
@@ -199,37 +769,52 @@ class CBETAAgent:
             "get_gallica_pages": self.gallica_client.get_item_pages,
             "get_gallica_page": self.gallica_client.get_page_info,
             "get_gallica_page_text": self.gallica_client.get_page_text,
-        }
-        self.tools_declarations = self._init_tools_declarations()
+        })
+        self.tools_declarations = _tools_declarations()
+        self._tool_slots = threading.BoundedSemaphore(self.config.max_concurrent_tools)
+        # 事件分发方式在构造时确定一次，流式热路径上不再逐个分片判断 verbose
+        self._emit_event = self._emit_event_verbose if self.config.verbose else self._emit_event_quiet
 
-    def _call_with_retry(self, func, *args, max_retries: int = 3, retry_interval: int = 30, **kwargs):
+    def _call_with_retry(self, func, *args, max_retries: int = 3, retry_interval: float = 2, **kwargs):
         """
         通用重试包装，适用于 Gemini API 调用。
+        等待时间按指数退避（上限 retry_max_interval）并加入随机抖动；
+        请求本身有误的 4xx 错误（429/408 除外）重试也不会成功，直接抛出。
         Args:
             func: 要调用的函数
             max_retries: 最大重试次数（默认3次）
-            retry_interval: 重试间隔秒数（默认30秒）
+            retry_interval: 首次重试前的等待秒数（默认2秒）
         """
         attempt = 0
         while attempt <= max_retries:
             try:
                 return func(*args, **kwargs)
             except Exception as e:
+                from google.genai import errors
+
+                if isinstance(e, errors.ClientError) and e.code not in _RETRYABLE_CLIENT_CODES:
+                    print(f"❌ API 调用失败（请求错误，不再重试）: {e}")
+                    raise
                 attempt += 1
                 if attempt > max_retries:
                     print(f"❌ API 调用失败，已达最大重试次数 ({max_retries}): {e}")
                     raise
+                delay = min(retry_interval * 2 ** (attempt - 1), self.config.retry_max_interval)
+                delay += random.uniform(0, delay * 0.25)
                 print(f"❌ API 调用失败 (尝试 {attempt}/{max_retries}): {e}")
-                print(f"⏳ 等待 {retry_interval}s 后重试...")
-                time.sleep(retry_interval)
+                print(f"⏳ 等待 {delay:.1f}s 后重试...")
+                time.sleep(delay)
         raise RuntimeError("API 调用全部重试失败")
 
-    def _emit_event(self, event_type: str, payload: Dict[str, Any], handler: Optional[StreamHandler]):
-        """统一的流式事件分发。"""
+    def _emit_event_quiet(self, event_type: str, payload: Dict[str, Any], handler: Optional[StreamHandler]):
+        """流式事件分发（非 verbose）：只转交给调用方的 handler。"""
+        if handler:
+            handler(event_type, payload)
+
+    def _emit_event_verbose(self, event_type: str, payload: Dict[str, Any], handler: Optional[StreamHandler]):
+        """流式事件分发（verbose）：没有 handler 时打印到终端。"""
         if handler:
             handler(event_type, payload)
-            return
-        if not self.config.verbose:
             return
 
         if event_type == "thought":
@@ -251,34 +836,36 @@ class CBETAAgent:
         chunk: types.GenerateContentResponse,
         stream_handler: Optional[StreamHandler],
     ) -> List[types.Part]:
-        """分析单个流式 chunk，返回其新增 parts。"""
-        collected: List[types.Part] = []
+        """分析单个流式 chunk，返回其新增 parts（直接返回分块自身的列表，由调用方聚合）。"""
         if not chunk.candidates:
-            return collected
+            return []
 
         candidate = chunk.candidates[0]
         content = candidate.content
         if not content or not content.parts:
-            return collected
+            return []
 
+        emit = self._emit_event
+        # 只有确实有人消费事件时才整理工具参数
+        report_calls = stream_handler is not None or self.config.verbose
         for part in content.parts:
-            collected.append(part)
-            if getattr(part, "thought", False):
-                self._emit_event("thought", {"text": part.text or ""}, stream_handler)
-            elif part.function_call:
-                raw_args = part.function_call.args or {}
-                if hasattr(raw_args, "items"):
-                    args_view = {k: v for k, v in raw_args.items()}
-                else:
-                    args_view = raw_args
-                self._emit_event(
-                    "tool_call",
-                    {"name": part.function_call.name, "args": args_view},
-                    stream_handler,
-                )
-            elif part.text:
-                self._emit_event("text", {"text": part.text}, stream_handler)
-        return collected
+            text = part.text
+            function_call = part.function_call
+            if part.thought:
+                emit("thought", {"text": text or ""}, stream_handler)
+            elif function_call:
+                if report_calls:
+                    # args 通常已是 dict，无需复制
+                    raw_args = function_call.args or {}
+                    args_view = raw_args if isinstance(raw_args, dict) else dict(raw_args)
+                    emit(
+                        "tool_call",
+                        {"name": function_call.name, "args": args_view},
+                        stream_handler,
+                    )
+            elif text:
+                emit("text", {"text": text}, stream_handler)
+        return content.parts
 
     def _consume_stream(
         self,
@@ -298,11 +885,12 @@ class CBETAAgent:
         if not last_chunk:
             return None
 
-        response = last_chunk.model_copy(deep=True)
+        # 最后一个分块只在这里使用，直接在其上替换为聚合后的 parts，无需深拷贝整个响应
+        response = last_chunk
         if response.candidates and response.candidates[0].content:
             response.candidates[0].content.parts = aggregated_parts
         elif response.candidates:
-            response.candidates[0].content = types.Content(
+            response.candidates[0].content = _lazy_types().Content(
                 role="model", parts=aggregated_parts
             )
         return response
@@ -322,349 +910,54 @@ class CBETAAgent:
         return self._consume_stream(stream, stream_handler)
 
 
-    def _init_tools_declarations(self) -> List[Dict]:
-        """定义 Gemini 工具声明"""
-        return [
-            {
-                "function_declarations": [
-                    # ===== 核心检索工具 =====
-                    {
-                        "name": "search_full_text",
-                        "description": "【全文检索】在 CBETA 全库进行关键词搜索。返回匹配的经卷列表及上下文片段。适用场景：已知关键词，需要找出所有出处。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "query": {"type": "STRING", "description": "搜索关键词（简繁皆可，系统自动转换）"},
-                                "rows": {"type": "INTEGER", "description": "返回数量（默认20）"},
-                                "canon": {"type": "STRING", "description": "限制藏经版本：T=大正藏, X=卍续藏, J=嘉兴藏, H=正史佛教资料, A=赵城金藏 等"},
-                                "category": {"type": "STRING", "description": "限制部类（如：阿含部类、般若部类、华严部类）"},
-                                "dynasty": {"type": "STRING", "description": "限制朝代（如：唐、宋、隋）"}
-                            },
-                            "required": ["query"]
-                        }
-                    },
-                    {
-                        "name": "search_advanced",
-                        "description": "【高级检索】支持复杂布尔语法的整合检索，同时返回 KWIC 前后文和分类统计。语法：空格=AND, |=OR, !=NOT, NEAR/n=邻近。适用场景：需要精确组合多个条件。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "query": {"type": "STRING", "description": "高级查询串。示例：'\"法鼓\" \"聖嚴\"'(AND), '\"波羅蜜\"|\"波羅密\"'(OR), '\"法鼓\" NEAR/7 \"迦葉\"'(邻近7字内)"},
-                                "facet": {"type": "BOOLEAN", "description": "是否返回藏经/部类/朝代/作者统计（默认true）"},
-                                "around": {"type": "INTEGER", "description": "KWIC 上下文字数（默认15）"}
-                            },
-                            "required": ["query"]
-                        }
-                    },
-                    {
-                        "name": "search_similar",
-                        "description": "【相似文本搜索】基于 Smith-Waterman 算法查找相似段落。适用场景：输入 OCR 识别的长文本（6-50字），找出 CBETA 中相似的经文段落。对 OCR 错字有一定容错。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "text": {"type": "STRING", "description": "文本片段（建议6-50字，不含标点）"},
-                                "score_min": {"type": "INTEGER", "description": "最低匹配分数（默认16，越高越严格）"}
-                            },
-                            "required": ["text"]
-                        }
-                    },
-                    # ===== 精确定位工具 =====
-                    {
-                        "name": "search_title",
-                        "description": "【经名搜索】仅搜索佛典标题（经名），快速查找特定经典。适用场景：知道经名但不确定完整名称或经号。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "query": {"type": "STRING", "description": "经名关键词（如：金刚经、阿含、华严）"},
-                                "rows": {"type": "INTEGER", "description": "返回数量（默认20）"}
-                            },
-                            "required": ["query"]
-                        }
-                    },
-                    {
-                        "name": "search_kwic",
-                        "description": "【单卷精确检索】针对特定佛典的特定卷进行 KWIC 检索，返回所有匹配位置及前后文。适用场景：已知经号和卷号，需要精确定位关键词在该卷中的位置。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "work": {"type": "STRING", "description": "佛典编号（如：T0001, T0235, X0087）"},
-                                "juan": {"type": "INTEGER", "description": "卷号（如：1, 2, 3）"},
-                                "query": {"type": "STRING", "description": "关键词，多词用逗号分隔"},
-                                "around": {"type": "INTEGER", "description": "前后文字数（默认15）"},
-                                "include_notes": {"type": "BOOLEAN", "description": "是否包含夹注（默认true）"}
-                            },
-                            "required": ["work", "juan", "query"]
-                        }
-                    },
-                    {
-                        "name": "search_toc",
-                        "description": "【目录搜索】搜索经名、部类目录或佛典内目次结构。适用场景：查找某部经的章节结构，或按部类浏览。返回类型：catalog(部类目录)、work(佛典标题)、toc(内部目次)。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "query": {"type": "STRING", "description": "搜索词（如：阿含、般若、涅槃）"},
-                                "rows": {"type": "INTEGER", "description": "返回数量（默认20）"}
-                            },
-                            "required": ["query"]
-                        }
-                    },
-                    # ===== 辅助研究工具 =====
-                    {
-                        "name": "search_notes",
-                        "description": "【注解检索】专门搜索校勘条目、注解或夹注。支持高级语法。适用场景：查找某词在校勘/注解中的出现，研究版本差异。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "query": {"type": "STRING", "description": "搜索词（支持 AND/OR/NOT/NEAR 语法）"},
-                                "facet": {"type": "BOOLEAN", "description": "是否返回分类统计（默认false）"},
-                                "rows": {"type": "INTEGER", "description": "返回数量（默认20）"}
-                            },
-                            "required": ["query"]
-                        }
-                    },
-                    {
-                        "name": "search_variants",
-                        "description": "【异体字查询】列出关键词的所有异体字变化。适用场景：OCR 结果可能有异体字（如：著/着、鉢/钵），先用此工具获取变体再搜索可提高召回率。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "query": {"type": "STRING", "description": "原始词（如：著衣持鉢）"},
-                                "scope": {"type": "STRING", "description": "可选 'title' 仅列出佛典题名中的异体字"}
-                            },
-                            "required": ["query"]
-                        }
-                    },
-                    {
-                        "name": "get_facet_stats",
-                        "description": "【统计分析】获取关键词在不同维度下的分布统计。适用场景：了解某词在各藏经/部类/朝代/作者中的使用频率分布。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "query": {"type": "STRING", "description": "搜索词"},
-                                "facet_type": {"type": "STRING", "description": "维度类型：canon(藏经)、category(部类)、creator(作译者)、dynasty(朝代)、work(佛典)。留空返回所有维度。"}
-                            },
-                            "required": ["query"]
-                        }
-                    },
-                    # ===== Gallica 工具（法国国家图书馆敦煌文献） =====
-                    {
-                        "name": "search_gallica",
-                        "description": "【Gallica 搜索】在法国国家图书馆 (BnF) Gallica 馆藏中搜索文献。适用场景：CBETA 缺少的敦煌写本、Pelliot 藏品、西域出土文献等。可与 CBETA 结果交叉验证。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "query": {"type": "STRING", "description": "搜索关键词（如：Dunhuang、敦煌、Pelliot、经名等）"},
-                                "max_records": {"type": "INTEGER", "description": "最大返回数量（默认10）"},
-                                "doc_type": {"type": "STRING", "description": "限制文档类型：manuscrit(手稿)、image(图像)"},
-                                "language": {"type": "STRING", "description": "限制语言：chi(中文)、san(梵文)、tib(藏文)"}
-                            },
-                            "required": ["query"]
-                        }
-                    },
-                    {
-                        "name": "search_gallica_dunhuang",
-                        "description": "【Gallica 敦煌专搜】专门搜索 Gallica 中的敦煌相关文献（自动包含 Dunhuang、Pelliot、敦煌等关键词）。适用场景：快速查找法国馆藏的敦煌写本，用于与 CBETA 版本比对。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "keyword": {"type": "STRING", "description": "额外关键词（可选，如经名、人名）"},
-                                "max_records": {"type": "INTEGER", "description": "最大返回数量（默认10）"}
-                            },
-                            "required": []
-                        }
-                    },
-                    {
-                        "name": "search_gallica_by_title",
-                        "description": "【Gallica 题名搜索】基于 MCP 的 search_by_title，适合按题名精确定位法国馆藏写本。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "title": {"type": "STRING", "description": "文献题名"},
-                                "exact_match": {"type": "BOOLEAN", "description": "是否要求完全匹配（默认 false）"},
-                                "max_results": {"type": "INTEGER", "description": "最大返回数量（默认10）"}
-                            },
-                            "required": ["title"]
-                        }
-                    },
-                    {
-                        "name": "search_gallica_by_author",
-                        "description": "【Gallica 作者搜索】使用 MCP 的 search_by_author，查找特定作者或收藏者的写本。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "author": {"type": "STRING", "description": "作者或藏者姓名"},
-                                "exact_match": {"type": "BOOLEAN", "description": "是否完全匹配（默认 false）"},
-                                "max_results": {"type": "INTEGER", "description": "最大返回数量（默认10）"}
-                            },
-                            "required": ["author"]
-                        }
-                    },
-                    {
-                        "name": "search_gallica_by_subject",
-                        "description": "【Gallica 主题搜索】基于 MCP 的 search_by_subject，可用于按主题/关键词聚焦敦煌分类。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "subject": {"type": "STRING", "description": "主题关键词"},
-                                "exact_match": {"type": "BOOLEAN", "description": "是否完全匹配（默认 false）"},
-                                "max_results": {"type": "INTEGER", "description": "最大返回数量（默认10）"}
-                            },
-                            "required": ["subject"]
-                        }
-                    },
-                    {
-                        "name": "search_gallica_advanced",
-                        "description": "【Gallica 高级搜索】对应 MCP 的 advanced_search，支持 Gallica CQL 语法组合多个字段。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "query": {"type": "STRING", "description": "CQL 查询字符串"},
-                                "max_results": {"type": "INTEGER", "description": "最大返回数量（默认10）"}
-                            },
-                            "required": ["query"]
-                        }
-                    },
-                    {
-                        "name": "get_gallica_manifest",
-                        "description": "【Gallica 文档结构】获取指定 Gallica 文档的 IIIF Manifest，包含页面列表、元数据、图像链接。适用场景：已知 ARK ID，需要了解文档有多少页、获取高清图像链接。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "ark": {"type": "STRING", "description": "ARK 标识符（如 ark:/12148/btv1b8304226d 或短 ID btv1b8304226d）"}
-                            },
-                            "required": ["ark"]
-                        }
-                    },
-                    {
-                        "name": "get_gallica_pages",
-                        "description": "【Gallica 页面枚举】调用 MCP get_item_pages，支持分页获取某份写本的页面列表。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "ark": {"type": "STRING", "description": "ARK 标识符"},
-                                "page": {"type": "INTEGER", "description": "指定页码（可选）"},
-                                "page_size": {"type": "INTEGER", "description": "返回页数（可选）"}
-                            },
-                            "required": ["ark"]
-                        }
-                    },
-                    {
-                        "name": "get_gallica_page",
-                        "description": "【Gallica 单页信息】获取 Gallica 文档某一页的详细信息，包括分辨率、图像 URL、缩略图。适用场景：需要查看或比对特定页面的高清图像。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "ark": {"type": "STRING", "description": "ARK 标识符"},
-                                "page": {"type": "STRING", "description": "页码（如 f1、f2，默认 f1）"}
-                            },
-                            "required": ["ark"]
-                        }
-                    },
-                    {
-                        "name": "get_gallica_page_text",
-                        "description": "【Gallica 页面文本】调用 MCP get_page_text，直接获取 ALTO/Plain OCR 内容，快速比对写本文字。",
-                        "parameters": {
-                            "type": "OBJECT",
-                            "properties": {
-                                "ark": {"type": "STRING", "description": "ARK 标识符"},
-                                "page": {"type": "INTEGER", "description": "页码数字（如 1 代表 f1）"},
-                                "format": {"type": "STRING", "description": "文本格式 plain/alto/tei（默认 plain）"}
-                            },
-                            "required": ["ark", "page"]
-                        }
-                    }
-                ]
-            }
-        ]
-
-    def _build_prompt(self, ocr_text: str = None, image_path: str = None) -> str:
-        if ocr_text:
-            base_prompt = f"""你是一位佛教文献考证专家。现在有一段古籍文字：
-
-{ocr_text}
-
-"""
-        else:
-            base_prompt = """你是一位佛教文献考证专家。请分析这张图片中的古籍文字，找出其在 CBETA 中的出处。
-
-"""
-
-        return base_prompt + """## 核心目标
-**优先考证出处；OCR 仅需提炼可辨认片段，并清晰标注不确定字符。**
-
-## 工作流
-
-### 1. 快速 OCR 摘要
-- 逐列或逐句记录可读文字（示例："列1：淨土中… "）
-- 用 `[?]` 或 `[unclear]` 标记模糊字，不要强猜
-- 提炼关键字/短语，便于后续搜索
-
-### 2. 并行搜索策略（可同时调用多个工具）
-**CBETA 工具（主线程）：**
-- `search_similar`：用于 6-50 字长片段（含不确定位也可）
-- `search_full_text`：用于高置信度关键词组合
-- `search_title` / `search_toc`：探索可能经名或章节
-- `search_variants`：获取异体字以扩大发现
-
-**Gallica 工具（敦煌分身）—— 当 CBETA 结果不足或需跨版本比对时：**
-- `search_gallica_dunhuang`：快速查找法国国家图书馆的敦煌写本
-- `search_gallica`：按关键词搜索 Pelliot 藏品、西域出土文献
-- `get_gallica_manifest`：获取文档结构与高清图像链接
-- `get_gallica_page`：获取单页图像 URL，用于多模态比对
-
-**子任务分工示例：**
-- 主线程：继续 CBETA 深挖，用 `search_kwic` 精确定位
-- Gallica 分身：同时搜索敦煌写本，返回候选 ARK 与图像链接
-- 图像比对分身（可选）：获取 Gallica 页面缩略图，与原图对照
-
-### 3. 精确定位与交叉验证
-- 对高置信度候选，使用 `search_kwic` 等获取上下文
-- 汇总证据：匹配字句、卷次、作译者、朝代
-- **CBETA vs Gallica 对照**：在 `candidate_insights` 中记录两者差异（可选）
-- 指出仍需人工确认的差异或疑点
-
-### 4. 结构化输出（便于人工校对）
-最终 JSON 中请确保：
-- `ocr_result.recognized_text`：合并后的全文；`uncertain_chars`：列出所有标记
-- `ocr_notes`：列表，逐列/逐句描述 OCR 摘要（含不确定说明）
-- `scripture_locations`：至多 5 条候选，含匹配片段、置信度、证据：
-  - 对 **CBETA** 候选：可设置 `source="CBETA"`，`work_id`/`canon`/`juan` 等字段准确完整，`external_url` 可留空（系统会自动生成 CBETA 在线链接）。
-  - 对 **Gallica** 候选：允许将写本视作“藏卷”加入 `scripture_locations`，并设置：
-    - `source="Gallica"`
-    - 若已知 ARK 与页码，尽量填入 `external_url` 为可直接打开的 Gallica 在线阅读链接（例如 `https://gallica.bnf.fr/ark:/12148/btv1b8304226d/f3.item`）
-- `key_facts`：片段关键信息列表，每项一句，直接基于图像与正文可见内容（**不**依赖外部文献），例如：
-  - 物质形态：册子本/单叶/对开叶，页数或叶数，装订情况，残损位置（首/尾/左右上下）。
-  - 题记与尾题：首题、尾题、署名、题记中的时间与人物。
-  - 版式与标记：有无科分标题、行数栏数、朱笔圈点/删除、杂写、插图等。
-- `candidate_insights`：逐条概述候选为何值得关注，**包括 Gallica 证据**，以及需人工核对的点
-- `verification_points`：列出人工校对要点（疑难字、需查卷、**Gallica ARK/页码**、建议的 KWIC 位置等）
-- `next_actions`：给实地研究者的后续建议（如"去查 T1753 卷2 KWIC 0258a25"、**"查阅 Gallica ark:/12148/xxx f3 页"**）
-- `tools_used`、`search_iterations`、`session_id`：保持完整，可用于追踪
+    def _create_context_cache(self, contents: List[types.Content], session_id: str) -> Optional[str]:
+        """创建上下文缓存（连同工具声明），失败时返回 None，调用方按完整历史发送"""
+        types = _lazy_types()
+        try:
+            cache = self.client.caches.create(
+                model=self.config.model_name,
+                config=types.CreateCachedContentConfig(
+                    contents=contents,
+                    tools=self.tools_declarations,
+                    tool_config=types.ToolConfig(
+                        function_calling_config=types.FunctionCallingConfig(mode="AUTO")
+                    ),
+                    ttl=self.config.context_cache_ttl,
+                    display_name=f"session-{session_id}",
+                ),
+            )
+        except Exception as e:
+            print(f"⚠️ 创建上下文缓存失败，改为每轮发送完整历史: {e}")
+            return None
+        if self.config.verbose:
+            print(f"🗂️ 已创建上下文缓存: {cache.name}")
+        return cache.name
 
-## 置信度评分建议
-- **0.8-1.0**：多处关键字连续匹配，卷次/作译者一致，**Gallica 有对应写本佐证**
-- **0.6-0.8**：主要字句吻合，少量 OCR 或版本出入
-- **0.4-0.6**：仅部分关键词匹配
-- **0.0-0.4**：证据不足，仅用作线索
+    def _delete_context_cache(self, cache_name: str):
+        try:
+            self.client.caches.delete(name=cache_name)
+        except Exception as e:
+            print(f"⚠️ 删除上下文缓存失败（将在 TTL 到期后自动清除）: {e}")
 
-## 注意事项
-- 任何模糊字必须标注 `[?]`，并在 `ocr_notes` 中说明
-- 每轮思考时给出"为何调用某工具"与"得到的人工可读结论"
-- **当调用 Gallica 工具时，说明与 CBETA 的对照意图**
-- 若 Gallica 返回图像链接，在 `next_actions` 中附上供人工查看
-- 结果要像"人工校对笔记"：短句、要点、可直接引用
+    def _init_tools_declarations(self) -> List[types.Tool]:
+        """Gemini 工具声明（模块级常量，保留该方法以兼容旧调用）"""
+        return _tools_declarations()
 
-请开始分析并调用工具。"""
+    def _build_prompt(self, ocr_text: str = None, image_path: str = None) -> str:
+        if ocr_text:
+            return _PROMPT_OCR_BEFORE + ocr_text + _PROMPT_OCR_AFTER
+        return _PROMPT_IMAGE_FULL
 
     def _execute_functions(
         self,
         response,
         stream_handler: Optional[StreamHandler],
     ) -> Generator[Dict, None, None]:
-        """执行工具调用并可视化反馈"""
+        """执行工具调用并可视化反馈；同一轮的多个工具调用并行执行，结果按调用顺序产出"""
         if not response.candidates or not response.candidates[0].content.parts:
             return
 
+        calls = []
         for part in response.candidates[0].content.parts:
             if part.function_call:
                 fn = part.function_call
@@ -674,63 +967,9 @@ class CBETAAgent:
                     print(f"\n🤖 AI 决定调用工具: {fn.name}")
                     print(f"   参数: {fn.args}")
                 
-                # 执行实际函数
-                if fn.name in self.tools_map:
-                    try:
-                        args = {k: v for k, v in (fn.args or {}).items()}
-                        result = self.tools_map[fn.name](**args)
-
-                        if self.config.verbose:
-                            print(f"   ✅ 工具执行完成")
-                            res_str = str(result)
-                            print(f"   结果摘要: {res_str[:100]}..." if len(res_str) > 100 else f"   结果: {res_str}")
-
-                        summary = self._shorten_text(str(result), width=120)
-                        record = {
-                            "name": fn.name,
-                            "args": self._serialize_args(args),
-                            "result_summary": summary,
-                            "status": "success",
-                        }
-
-                        self._emit_event(
-                            "tool_result",
-                            {"name": fn.name, "status": "success", "summary": summary},
-                            stream_handler,
-                        )
-
-                        yield {
-                            "function_response": {
-                                "name": fn.name,
-                                "response": {"result": result}
-                            },
-                            "tool_record": record,
-                        }
-                    except Exception as e:
-                        print(f"   ❌ 工具执行失败: {e}")
-                        summary = self._shorten_text(str(e), width=120)
-                        record = {
-                            "name": fn.name,
-                            "args": self._serialize_args({k: v for k, v in (fn.args or {}).items()}),
-                            "result_summary": summary,
-                            "status": "error",
-                        }
-                        self._emit_event(
-                            "tool_result",
-                            {
-                                "name": fn.name,
-                                "status": "error",
-                                "summary": summary,
-                            },
-                            stream_handler,
-                        )
-                        yield {
-                            "function_response": {
-                                "name": fn.name,
-                                "response": {"error": str(e)}
-                            },
-                            "tool_record": record,
-                        }
+                tool = self.tools_map.get(fn.name)
+                if tool is not None:
+                    calls.append((fn, tool))
                 else:
                     print(f"   ⚠️ 未知工具: {fn.name}")
                     self._emit_event(
@@ -739,36 +978,120 @@ class CBETAAgent:
                         stream_handler,
                     )
 
+        if not calls:
+            return
+
+        # 工具均为阻塞的网络请求，互不依赖；多个调用时放到线程池并行，总耗时取决于最慢的一个
+        def run(fn, tool):
+            try:
+                with self._tool_slots:
+                    return tool(**(fn.args or {})), None
+            except Exception as e:
+                return None, e
+
+        if len(calls) == 1:
+            yield from self._tool_outputs(calls, [run(*calls[0])], stream_handler)
+            return
+
+        workers = max(1, min(self.config.max_parallel_tools, len(calls)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-tool") as executor:
+            # executor.map 按调用顺序惰性产出：前面的调用一完成就立即反馈，不必等最慢的一个
+            outcomes = executor.map(lambda call: run(*call), calls)
+            yield from self._tool_outputs(calls, outcomes, stream_handler)
+
+    def _tool_outputs(
+        self,
+        calls: List[tuple],
+        outcomes,
+        stream_handler: Optional[StreamHandler],
+    ) -> Generator[Dict, None, None]:
+        """按调用顺序整理工具执行结果：打印、广播事件并产出 function_response"""
+        for (fn, _), (result, error) in zip(calls, outcomes):
+            args = fn.args or {}
+            if error is None:
+                if self.config.verbose:
+                    print(f"   ✅ 工具 {fn.name} 执行完成")
+                    res_str = str(result)
+                    print(f"   结果摘要: {res_str[:100]}..." if len(res_str) > 100 else f"   结果: {res_str}")
+
+                summary = self._shorten_text(str(result), width=120)
+                record = {
+                    "name": fn.name,
+                    "args": self._serialize_args(args),
+                    "result_summary": summary,
+                    "status": "success",
+                }
+
+                self._emit_event(
+                    "tool_result",
+                    {"name": fn.name, "status": "success", "summary": summary},
+                    stream_handler,
+                )
+
+                yield {
+                    "function_response": {
+                        "name": fn.name,
+                        "response": {"result": result}
+                    },
+                    "tool_record": record,
+                }
+            else:
+                print(f"   ❌ 工具 {fn.name} 执行失败: {error}")
+                summary = self._shorten_text(str(error), width=120)
+                record = {
+                    "name": fn.name,
+                    "args": self._serialize_args(args),
+                    "result_summary": summary,
+                    "status": "error",
+                }
+                self._emit_event(
+                    "tool_result",
+                    {
+                        "name": fn.name,
+                        "status": "error",
+                        "summary": summary,
+                    },
+                    stream_handler,
+                )
+                yield {
+                    "function_response": {
+                        "name": fn.name,
+                        "response": {"error": str(error)}
+                    },
+                    "tool_record": record,
+                }
+
     def _serialize_args(self, args: Dict[str, Any]) -> Dict[str, Any]:
-        """将工具参数转换为 JSON 友好的形式"""
-        def convert(value: Any) -> Any:
-            if isinstance(value, (str, int, float, bool)) or value is None:
-                return value
-            if isinstance(value, dict):
-                return {k: convert(v) for k, v in value.items()}
-            if isinstance(value, (list, tuple)):
-                return [convert(v) for v in value]
-            return str(value)
-
-        return {k: convert(v) for k, v in args.items()}
+        """将工具参数转换为 JSON 友好的形式（由 orjson 一次遍历完成，无法序列化的值按 str 处理）"""
+        try:
+            return orjson.loads(_dump_args(args))
+        except orjson.JSONEncodeError:
+            # 超出 64 位的整数等 orjson 不支持的值，退回逐层转换
+            return {k: _json_safe(v) for k, v in args.items()}
 
     def _shorten_text(self, text: str, width: int) -> str:
+        # 压缩空白后按长度直接截断，省去 textwrap 的分词与按词回退
         cleaned = " ".join(str(text).split())
-        if not cleaned:
-            return ""
-        return textwrap.shorten(cleaned, width=width, placeholder="...")
+        if len(cleaned) <= width:
+            return cleaned
+        return cleaned[:width - 3] + "..."
 
-    def _extract_round_text_summary(self, parts: List[types.Part]) -> str:
-        texts = []
+    def _extract_round_text_summary(self, parts: List[types.Part], width: int = 600) -> str:
+        """
+        拼接本轮文本（空白统一压缩为单个空格）并截断到 width。
+        只切分一次；累计长度已超过 width 后不再处理剩余内容，结果与先拼接再截断相同。
+        """
+        tokens: List[str] = []
+        length = -1  # 按 " ".join(tokens) 计算的长度
         for part in parts:
-            if part.text and not part.function_call:
-                cleaned = " ".join(part.text.split())
-                if cleaned:
-                    texts.append(cleaned)
-        if not texts:
-            return ""
-        joined = " ".join(texts)
-        return self._shorten_text(joined, width=600)
+            if not part.text or part.function_call:
+                continue
+            for token in part.text.split():
+                tokens.append(token)
+                length += len(token) + 1
+                if length > width:
+                    return " ".join(tokens)[:width - 3] + "..."
+        return " ".join(tokens)
 
     def _persist_round_summary(
         self,
@@ -799,6 +1122,7 @@ class CBETAAgent:
         """
         统一处理单轮模型返回，执行工具并生成摘要，供单任务与批量流程复用。
         """
+        types = _lazy_types()
         round_summary = self._extract_round_text_summary(content.parts)
         tool_records: List[Dict[str, Any]] = []
         json_result: Optional[FinalAnswer] = None
@@ -829,17 +1153,24 @@ class CBETAAgent:
             if self.config.verbose:
                 print(f"\n📝 AI 回复（第 {round_index} 轮无工具调用）")
 
-            if "{" in text_response and "}" in text_response:
+            start = text_response.find("{")
+            end = text_response.rfind("}") + 1
+            if 0 <= start < end:
+                # 先用 orjson 解析并检查结构，普通文本回复不必走完整的 Pydantic 校验
                 try:
-                    start = text_response.find("{")
-                    end = text_response.rfind("}") + 1
-                    json_str = text_response[start:end]
-                    result = FinalAnswer.model_validate_json(json_str)
-                    result.session_id = session_id
-                    json_result = result
-                except Exception as e:
+                    obj = orjson.loads(text_response[start:end])
+                except orjson.JSONDecodeError as e:
+                    obj = None
                     if self.config.verbose:
                         print(f"   JSON 解析失败: {e}，进入最终结构化输出轮...")
+                if isinstance(obj, dict) and "ocr_result" in obj:
+                    try:
+                        result = FinalAnswer.model_validate(obj)
+                        result.session_id = session_id
+                        json_result = result
+                    except Exception as e:
+                        if self.config.verbose:
+                            print(f"   JSON 校验失败: {e}，进入最终结构化输出轮...")
 
             if not json_result:
                 should_break = True
@@ -883,6 +1214,7 @@ class CBETAAgent:
         """
         强制生成结构化输出（最终轮），使用更多重试次数。
         """
+        types = _lazy_types()
         if self.config.verbose:
             print("\n🔄 【最终轮】强制生成结构化答案...")
         
@@ -897,20 +1229,12 @@ class CBETAAgent:
         
         history.append(types.Content(role="user", parts=[types.Part(text=final_prompt)]))
         
-        # 使用官方推荐的 structured output 配置：
-        # - response_mime_type 固定为 application/json
-        # - response_schema 传入 Pydantic 生成的 JSON Schema
-        final_config = types.GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema=FinalAnswer.model_json_schema(),
-        )
-        
         try:
             final_resp = self._call_with_retry(
                 self.client.models.generate_content,
                 model=self.config.model_name,
                 contents=history,
-                config=final_config,
+                config=_final_generate_config(),
                 max_retries=self.config.final_retries,
                 retry_interval=self.config.retry_interval,
             )
@@ -946,6 +1270,7 @@ class CBETAAgent:
         Args:
             cancel_check: 可选的取消检查回调，返回 True 表示应取消任务
         """
+        types = _lazy_types()
         history: List[types.Content] = []
         if resume_session_id:
             session_id = resume_session_id
@@ -960,16 +1285,16 @@ class CBETAAgent:
         prompt = self._build_prompt(ocr_text, image_path)
         
         # 如果有图片，加载图片
+        image_part = None
         if image_path:
             try:
-                from PIL import Image
-                # 使用上下文管理器，避免文件句柄未关闭导致 Windows 下 unlink 失败
-                with Image.open(image_path) as img:
-                    if self.config.verbose:
-                        print(f"🖼️ 已加载图片: {image_path}")
-                    mime_type = Image.MIME.get(img.format, "image/png")
-                with open(image_path, "rb") as f:
-                    image_bytes = f.read()
+                # 只读一次文件，格式由文件头判断
+                image_bytes = Path(image_path).read_bytes()
+                mime_type = sniff_image_mime(image_bytes, image_path)
+                if mime_type is None:
+                    raise ValueError(f"无法识别的图片格式: {image_path}")
+                if self.config.verbose:
+                    print(f"🖼️ 已加载图片: {image_path}")
                 image_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
                 contents = [prompt, image_part]
             except Exception as e:
@@ -993,79 +1318,112 @@ class CBETAAgent:
         tool_round = 0  # 工具调用轮数计数
         successful_rounds = 0
         
+        # 生成配置在各轮之间不变，整个流程只构建一次
+        generate_config = types.GenerateContentConfig(
+            temperature=1.0,
+            max_output_tokens=8192,
+            thinking_config=types.ThinkingConfig(
+                thinking_level=self.config.thinking_level,
+                include_thoughts=True
+            ),
+            tools=self.tools_declarations,
+            tool_config=types.ToolConfig(
+                function_calling_config=types.FunctionCallingConfig(
+                    mode="AUTO"
+                )
+            ),
+        )
+        
+        # 可选：图片等不变的前缀放入上下文缓存，之后每轮只发送缓存之后的内容
+        round_config = generate_config
+        sent_from = 0
+        cache_name = None
+        if self.config.context_cache and image_part is not None:
+            # 缓存前缀需为完整的若干轮：图片单独成一轮放入缓存，提示词留在请求中，保证每轮请求都有内容
+            prefix = history[:-1] + [types.Content(role="user", parts=[image_part])]
+            cache_name = self._create_context_cache(prefix, session_id)
+            if cache_name:
+                # 历史保持完整（供存档与最终结构化输出使用）：…, 图片, 提示词
+                history[-1:] = [prefix[-1], types.Content(role="user", parts=[types.Part(text=prompt)])]
+                sent_from = len(prefix)
+                # 使用缓存时工具声明与工具配置须放在缓存中，请求配置里不能再携带
+                round_config = types.GenerateContentConfig(
+                    temperature=generate_config.temperature,
+                    max_output_tokens=generate_config.max_output_tokens,
+                    thinking_config=generate_config.thinking_config,
+                    cached_content=cache_name,
+                )
+        
+        # 流式事件只在工具调用阶段产生，交给后台线程分发，不阻塞工具调度
+        dispatcher = _StreamDispatcher(stream_handler) if stream_handler else None
+        if dispatcher:
+            stream_handler = dispatcher
+
         # 工具调用阶段（最多 max_tool_rounds 轮）
-        while tool_round < self.config.max_tool_rounds:
-            # 检查是否被取消
-            if cancel_check and cancel_check():
-                if self.config.verbose:
-                    print("⏹️ 任务被取消，保存当前进度...")
-                self.session_manager.save_session(session_id, history)
-                return None
+        try:
+            while tool_round < self.config.max_tool_rounds:
+                # 检查是否被取消
+                if cancel_check and cancel_check():
+                    if self.config.verbose:
+                        print("⏹️ 任务被取消，保存当前进度...")
+                    self.session_manager.save_session(session_id, history)
+                    return None
             
-            tool_round += 1
-            if self.config.verbose:
-                print(f"\n🔄 第 {tool_round}/{self.config.max_tool_rounds} 轮思考...")
+                tool_round += 1
+                if self.config.verbose:
+                    print(f"\n🔄 第 {tool_round}/{self.config.max_tool_rounds} 轮思考...")
             
-            generate_config = types.GenerateContentConfig(
-                temperature=1.0,
-                max_output_tokens=8192,
-                thinking_config=types.ThinkingConfig(
-                    thinking_level=self.config.thinking_level,
-                    include_thoughts=True
-                ),
-                tools=self.tools_declarations,
-                tool_config=types.ToolConfig(
-                    function_calling_config=types.FunctionCallingConfig(
-                        mode="AUTO"
+                try:
+                    response = self._call_with_retry(
+                        self._generate_with_stream,
+                        contents=history[sent_from:],
+                        config=round_config,
+                        stream_handler=stream_handler,
+                        max_retries=self.config.normal_retries,
+                        retry_interval=self.config.retry_interval,
                     )
-                ),
-            )
-            
-            try:
-                response = self._call_with_retry(
-                    self._generate_with_stream,
-                    contents=history,
-                    config=generate_config,
-                    stream_handler=stream_handler,
-                    max_retries=self.config.normal_retries,
-                    retry_interval=self.config.retry_interval,
-                )
-            except Exception as e:
-                print(f"❌ 第 {tool_round} 轮 API 调用失败: {e}")
-                break  # 跳出循环，进入最终结构化输出
+                except Exception as e:
+                    print(f"❌ 第 {tool_round} 轮 API 调用失败: {e}")
+                    break  # 跳出循环，进入最终结构化输出
 
-            # 处理响应
-            if not response or not response.candidates:
-                print("⚠️ 无响应候选")
-                break
+                # 处理响应
+                if not response or not response.candidates:
+                    print("⚠️ 无响应候选")
+                    break
                 
-            candidate = response.candidates[0]
-            content = candidate.content
-            successful_rounds += 1
+                candidate = response.candidates[0]
+                content = candidate.content
+                successful_rounds += 1
 
-            # 将模型响应加入历史
-            history.append(content)
+                # 将模型响应加入历史
+                history.append(content)
             
-            round_result = self._handle_model_response(
-                session_id=session_id,
-                round_index=tool_round,
-                response=response,
-                content=content,
-                stream_handler=stream_handler,
-            )
+                round_result = self._handle_model_response(
+                    session_id=session_id,
+                    round_index=tool_round,
+                    response=response,
+                    content=content,
+                    stream_handler=stream_handler,
+                )
 
-            json_result: Optional[FinalAnswer] = round_result["json_result"]
-            should_break = round_result["should_break"]
-            next_user_content = round_result["next_user_content"]
+                json_result: Optional[FinalAnswer] = round_result["json_result"]
+                should_break = round_result["should_break"]
+                next_user_content = round_result["next_user_content"]
 
-            if next_user_content:
-                history.append(next_user_content)
+                if next_user_content:
+                    history.append(next_user_content)
 
-            if json_result:
-                self.session_manager.save_session(session_id, history)
-                return json_result
-            if should_break:
-                break
+                if json_result:
+                    self.session_manager.save_session(session_id, history)
+                    return json_result
+                if should_break:
+                    break
+        
+        finally:
+            if dispatcher:
+                dispatcher.close()
+            if cache_name:
+                self._delete_context_cache(cache_name)
         
         # ===== 最终结构化输出轮（不计入工具调用轮数） =====
         # 再次检查是否被取消
@@ -2,7 +2,15 @@ from datetime import datetime
 from enum import Enum
 from typing import Any, Dict, List, Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class _FrozenModel(BaseModel):
+    """
+    接口模型基类：实例构建后只读取、序列化，不再修改。
+    冻结后可安全地缓存与共享（如按文件 mtime 缓存的 RoundInfo）。
+    """
+    model_config = ConfigDict(frozen=True)
 
 
 class JobStatusEnum(str, Enum):
@@ -16,11 +24,11 @@ class JobStatusEnum(str, Enum):
     batch_merging = "BATCH_MERGING"
 
 
-class JobCreateResponse(BaseModel):
+class JobCreateResponse(_FrozenModel):
     task_id: str = Field(..., description="单张图片异步任务 ID")
 
 
-class JobStatusResponse(BaseModel):
+class JobStatusResponse(_FrozenModel):
     task_id: str
     status: JobStatusEnum
     created_at: datetime
@@ -29,11 +37,21 @@ class JobStatusResponse(BaseModel):
     error: Optional[str] = None
 
 
-class BatchCreateResponse(BaseModel):
+class JobsStatusRequest(_FrozenModel):
+    """批量查询单图任务状态请求"""
+    task_ids: List[str] = Field(..., description="要查询的任务 ID 列表")
+
+
+class JobsStatusResponse(_FrozenModel):
+    """批量查询单图任务状态响应（不存在的任务 ID 不会出现在结果中）"""
+    jobs: Dict[str, JobStatusResponse]
+
+
+class BatchCreateResponse(_FrozenModel):
     batch_id: str = Field(..., description="批处理任务 ID")
 
 
-class BatchStatusResponse(BaseModel):
+class BatchStatusResponse(_FrozenModel):
     batch_id: str
     status: JobStatusEnum
     round: int
@@ -43,19 +61,19 @@ class BatchStatusResponse(BaseModel):
     details: List[Dict[str, Any]] = []
 
 
-class BatchResultItem(BaseModel):
+class BatchResultItem(_FrozenModel):
     session_id: str
     status: JobStatusEnum
     result: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
 
 
-class BatchResultsResponse(BaseModel):
+class BatchResultsResponse(_FrozenModel):
     batch_id: str
     items: List[BatchResultItem]
 
 
-class RoundInfo(BaseModel):
+class RoundInfo(_FrozenModel):
     """单轮处理信息"""
     round_index: int
     timestamp: str
@@ -64,32 +82,32 @@ class RoundInfo(BaseModel):
     notes: List[str] = Field(default_factory=list, description="额外注释")
 
 
-class ProcessResponse(BaseModel):
+class ProcessResponse(_FrozenModel):
     """处理过程响应"""
     session_id: str
     rounds: List[RoundInfo] = Field(..., description="每一轮的处理信息")
     total_rounds: int
 
 
-class CancelResponse(BaseModel):
+class CancelResponse(_FrozenModel):
     """取消任务响应"""
     task_id: str
     status: JobStatusEnum
     message: str
 
 
-class ResumeRequest(BaseModel):
+class ResumeRequest(_FrozenModel):
     """断点续传请求"""
     session_id: str = Field(..., description="要恢复的 session_id")
 
 
-class ResumeResponse(BaseModel):
+class ResumeResponse(_FrozenModel):
     """断点续传响应"""
     task_id: str = Field(..., description="新创建的任务 ID")
     session_id: str = Field(..., description="复用的 session_id")
 
 
-class MetaResponse(BaseModel):
+class MetaResponse(_FrozenModel):
     """服务元信息响应"""
     version: str
     output_dir: str
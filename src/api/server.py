@@ -1,7 +1,14 @@
+import asyncio
+import hashlib
 import re
+import shutil
 import uuid
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Tuple
+
+import orjson
+import pydantic_core
 
 from dotenv import load_dotenv
 from fastapi import (
@@ -9,9 +16,14 @@ from fastapi import (
     FastAPI,
     File,
     HTTPException,
+    Request,
+    Response,
     UploadFile,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 
 from src.ai_agent import AgentConfig, CBETAAgent
 from src.schemas import FinalAnswer
@@ -23,6 +35,8 @@ from src.api.schemas import (
     JobCreateResponse,
     JobStatusResponse,
     JobStatusEnum,
+    JobsStatusRequest,
+    JobsStatusResponse,
     MetaResponse,
     ProcessResponse,
     ResumeResponse,
@@ -31,7 +45,7 @@ from src.api.schemas import (
 from src.api.task_store import InMemoryTaskStore
 from src.batch_jobs import BatchProcessor
 from src.config import get_output_dir, supports_batch, VERSION
-from src.main import summarize_final_answer, build_fragment_note
+from src.main import write_result_files
 
 load_dotenv()
 
@@ -42,15 +56,36 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# 批处理结果与处理过程等 JSON 响应体积较大且压缩率高
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# 长轮询单次最多等待的秒数
+JOB_WAIT_MAX = 30.0
+# 长轮询与任务事件流检查状态变化的间隔（秒）
+JOB_EVENTS_POLL_INTERVAL = 0.5
+_TERMINAL_JOB_STATUSES = (
+    JobStatusEnum.succeeded,
+    JobStatusEnum.failed,
+    JobStatusEnum.cancelled,
+)
+
+# 上传文件落盘时每次拷贝的块大小（字节）
+UPLOAD_CHUNK_SIZE = 1 << 20
+# 轮次记录目录，与 SessionManager 默认的 storage_dir 一致
+SESSIONS_DIR = Path("sessions")
 
 task_store = InMemoryTaskStore()
 agent = CBETAAgent(AgentConfig(verbose=False))
 batch_processor = BatchProcessor(agent=agent)
 
 
+# 输出文件/文件夹名中允许保留的字符之外的部分
+_UNSAFE_NAME_RE = re.compile(r"[^0-9A-Za-z\u4e00-\u9fff._-]+")
+
+
 def _sanitize_output_name(name: str) -> str:
     """将文件/文件夹名称中不安全的字符替换为下划线。"""
-    safe = re.sub(r"[^0-9A-Za-z\u4e00-\u9fff._-]+", "_", name.strip())
+    safe = _UNSAFE_NAME_RE.sub("_", name.strip())
     safe = safe.strip("._")
     return safe or "output"
 
@@ -69,11 +104,17 @@ async def _persist_upload(file: UploadFile, namespace: str) -> Path:
     tmp_dir = Path("tmp") / namespace
     tmp_dir.mkdir(parents=True, exist_ok=True)
     tmp_path = tmp_dir / f"{uuid.uuid4()}{suffix}"
-    data = await file.read()
-    tmp_path.write_bytes(data)
+    # 按块从上传的临时文件拷贝到磁盘，不把整张图片读入内存；阻塞 IO 放到线程中执行
+    await file.seek(0)
+    await asyncio.to_thread(_copy_upload, file.file, tmp_path)
     return tmp_path
 
 
+def _copy_upload(src, dest: Path):
+    with dest.open("wb") as out:
+        shutil.copyfileobj(src, out, UPLOAD_CHUNK_SIZE)
+
+
 def _run_single_job(
     task_id: str,
     image_path: Path,
@@ -91,9 +132,11 @@ def _run_single_job(
     """
     session_id = None
     should_delete_image = True  # 默认删除临时图片
+    # 记录在提交任务前已创建；取消检查直接读记录上的 Event，无需每次查表加锁
+    cancel = task_store.get(task_id).cancel
     try:
         # 检查是否已被取消
-        if task_store.is_cancel_requested(task_id):
+        if cancel.is_set():
             task_store.update(task_id, status=JobStatusEnum.cancelled)
             return
         
@@ -110,11 +153,11 @@ def _run_single_job(
         result: FinalAnswer | None = agent.analyze_and_locate(
             image_path=str(image_path), 
             resume_session_id=session_id,
-            cancel_check=lambda: task_store.is_cancel_requested(task_id),
+            cancel_check=cancel.is_set,
         )
         
         # 再次检查是否被取消
-        if task_store.is_cancel_requested(task_id):
+        if cancel.is_set():
             task_store.update(task_id, status=JobStatusEnum.cancelled)
             should_delete_image = False  # 取消时保留图片以便续传
             return
@@ -133,35 +176,15 @@ def _run_single_job(
         output_base = get_output_dir()
         pic_name = _derive_pic_name(original_name, image_path)
         
-        # 创建以图片名称命名的子文件夹
-        pic_output_dir = output_base / pic_name
-        pic_output_dir.mkdir(parents=True, exist_ok=True)
-        
-        # 保存 JSON 结果
-        json_path = pic_output_dir / f"{pic_name}_result.json"
-        json_path.write_text(
-            result.model_dump_json(indent=2, ensure_ascii=False),
-            encoding="utf-8",
-        )
-        
-        # 保存文本报告
-        report_path = pic_output_dir / f"{pic_name}_report.txt"
-        report_path.write_text(
-            summarize_final_answer(result),
-            encoding="utf-8",
-        )
-        
-        # 保存文献整理说明
-        note_path = pic_output_dir / f"{pic_name}_note.txt"
-        note_path.write_text(
-            build_fragment_note(result, pic_name),
-            encoding="utf-8",
-        )
+        # 以图片名称命名的子文件夹下保存 JSON 结果、文本报告与文献整理说明；
+        # model_dump 只做一次，同一份数据也作为任务结果返回
+        payload = result.model_dump(mode="json")
+        write_result_files(result, output_base / pic_name, pic_name, payload)
         
         task_store.update(
             task_id,
             status=JobStatusEnum.succeeded,
-            result=result.model_dump(mode="json"),
+            result=payload,
         )
     except Exception as exc:
         task_store.update(task_id, status=JobStatusEnum.failed, error=str(exc))
@@ -195,11 +218,7 @@ async def create_async_job(
     return JobCreateResponse(task_id=task_id)
 
 
-@app.get("/api/v1/jobs/{task_id}", response_model=JobStatusResponse)
-async def get_async_job(task_id: str):
-    record = task_store.get(task_id)
-    if not record:
-        raise HTTPException(status_code=404, detail="task not found")
+def _job_status_response(record) -> JobStatusResponse:
     return JobStatusResponse(
         task_id=record.task_id,
         status=record.status,
@@ -210,6 +229,78 @@ async def get_async_job(task_id: str):
     )
 
 
+def _conditional_json(request: Request, model: BaseModel) -> Response:
+    """
+    返回带 ETag 的 JSON 响应；客户端携带的 If-None-Match 与当前内容一致时返回 304，
+    轮询方无需再下载和解析未变化的状态。
+    直接序列化为 bytes，响应结构与其他接口一致（值为 None 的字段输出 null）。
+    """
+    body = pydantic_core.to_json(model)
+    etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/v1/jobs/{task_id}", response_model=JobStatusResponse)
+async def get_async_job(task_id: str, request: Request, wait: float = 0):
+    """
+    查询任务状态。wait > 0 时为长轮询：任务未结束则最多等待 wait 秒（上限 JOB_WAIT_MAX），
+    任务一进入终态立即返回，客户端无需高频轮询。
+    """
+    record = task_store.get(task_id)
+    if not record:
+        raise HTTPException(status_code=404, detail="task not found")
+    if wait > 0 and not record.done.is_set():
+        # 在事件循环上定时检查，不占用默认线程池（上传落盘也在其中执行）
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(wait, JOB_WAIT_MAX)
+        while not record.done.is_set():
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(JOB_EVENTS_POLL_INTERVAL, remaining))
+    return _conditional_json(request, _job_status_response(record))
+
+
+@app.get("/api/v1/jobs/{task_id}/events")
+async def stream_job_events(task_id: str):
+    """
+    以 Server-Sent Events 推送任务状态变化，任务进入终态后结束流。
+    客户端保持一条长连接即可，无需定时轮询。
+    """
+    if not task_store.get(task_id):
+        raise HTTPException(status_code=404, detail="task not found")
+
+    async def event_stream():
+        last_updated_at = None
+        while True:
+            record = task_store.get(task_id)
+            if not record:
+                break
+            if record.updated_at != last_updated_at:
+                last_updated_at = record.updated_at
+                payload = _job_status_response(record).model_dump_json()
+                yield f"data: {payload}\n\n"
+                if record.status in _TERMINAL_JOB_STATUSES:
+                    break
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+@app.post("/api/v1/jobs/batch_status", response_model=JobsStatusResponse)
+async def get_async_jobs(request: JobsStatusRequest):
+    """一次请求查询多个单图任务状态，供客户端轮询时合并请求。"""
+    jobs = {}
+    for task_id in request.task_ids:
+        record = task_store.get(task_id)
+        if record:
+            jobs[task_id] = _job_status_response(record)
+    return JobsStatusResponse(jobs=jobs)
+
+
 @app.post("/api/v1/batches", response_model=BatchCreateResponse)
 async def create_batch(
     background_tasks: BackgroundTasks, files: List[UploadFile] = File(...)
@@ -234,11 +325,11 @@ async def create_batch(
 
 
 @app.get("/api/v1/batches/{batch_id}", response_model=BatchStatusResponse)
-async def get_batch(batch_id: str):
+async def get_batch(batch_id: str, request: Request):
     status = batch_processor.get_status(batch_id)
     if not status:
         raise HTTPException(status_code=404, detail="batch not found")
-    return status
+    return _conditional_json(request, status)
 
 
 @app.get("/api/v1/batches/{batch_id}/results", response_model=BatchResultsResponse)
@@ -249,35 +340,73 @@ async def get_batch_results(batch_id: str, session_id: Optional[str] = None):
     return results
 
 
+# session_id -> (已解析到的字节偏移, mtime_ns, 已解析的轮次)
+# 轮次文件只追加不改写：文件增长时从上次的偏移继续读，只解析新增的行
+_ROUNDS_CACHE_MAX = 128
+_rounds_cache: "OrderedDict[str, Tuple[int, int, Tuple[RoundInfo, ...]]]" = OrderedDict()
+
+
+def _parse_round_lines(data: bytes) -> Tuple[RoundInfo, ...]:
+    return tuple(
+        RoundInfo.model_validate(orjson.loads(line))
+        for line in data.splitlines()
+        if line.strip()
+    )
+
+
+def _load_rounds(session_id: str) -> Optional[Tuple[RoundInfo, ...]]:
+    """读取 session 的轮次记录，文件不存在时返回 None"""
+    rounds_file = SESSIONS_DIR / f"{session_id}.rounds.jsonl"
+    try:
+        stat = rounds_file.stat()
+    except FileNotFoundError:
+        _rounds_cache.pop(session_id, None)
+        return None
+
+    offset, rounds = 0, ()
+    cached = _rounds_cache.get(session_id)
+    if cached:
+        cached_offset, cached_mtime, cached_rounds = cached
+        if stat.st_size == cached_offset and stat.st_mtime_ns == cached_mtime:
+            _rounds_cache.move_to_end(session_id)
+            return cached_rounds
+        # 文件只追加时增量读取新增部分；变短或同长度被改写则整体重读
+        if stat.st_size > cached_offset:
+            offset, rounds = cached_offset, cached_rounds
+
+    try:
+        with rounds_file.open("rb") as f:
+            f.seek(offset)
+            data = f.read()
+        # 只解析完整的行，尚未写完的最后一行留到下次
+        end = data.rfind(b"\n") + 1
+        rounds += _parse_round_lines(data[:end])
+    except Exception as exc:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"读取处理记录失败: {str(exc)}"
+        )
+
+    _rounds_cache[session_id] = (offset + end, stat.st_mtime_ns, rounds)
+    _rounds_cache.move_to_end(session_id)
+    if len(_rounds_cache) > _ROUNDS_CACHE_MAX:
+        _rounds_cache.popitem(last=False)
+    return rounds
+
+
 @app.get("/api/v1/process/{session_id}", response_model=ProcessResponse)
 async def get_process_details(session_id: str):
     """获取 AI 处理的中间过程（思考、工具调用等）"""
-    import json
-    from pathlib import Path
-    
-    rounds_file = Path("sessions") / f"{session_id}.rounds.jsonl"
-    if not rounds_file.exists():
+    rounds = _load_rounds(session_id)
+    if rounds is None:
         raise HTTPException(
             status_code=404, 
             detail=f"未找到 session {session_id} 的处理记录"
         )
     
-    rounds = []
-    try:
-        with open(rounds_file, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    round_data = json.loads(line)
-                    rounds.append(RoundInfo(**round_data))
-    except Exception as exc:
-        raise HTTPException(
-            status_code=500, 
-            detail=f"读取处理记录失败: {str(exc)}"
-        )
-    
     return ProcessResponse(
         session_id=session_id,
-        rounds=rounds,
+        rounds=list(rounds),
         total_rounds=len(rounds)
     )
 
@@ -295,34 +424,17 @@ async def get_job_process(task_id: str):
             detail="该任务没有关联的 session_id，可能任务未开始执行"
         )
     
-    # 复用上面的逻辑
-    import json
-    from pathlib import Path
-    
     session_id = record.session_id
-    rounds_file = Path("sessions") / f"{session_id}.rounds.jsonl"
-    if not rounds_file.exists():
+    rounds = _load_rounds(session_id)
+    if rounds is None:
         raise HTTPException(
             status_code=404, 
             detail=f"未找到处理记录（session: {session_id}）"
         )
     
-    rounds = []
-    try:
-        with open(rounds_file, "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip():
-                    round_data = json.loads(line)
-                    rounds.append(RoundInfo(**round_data))
-    except Exception as exc:
-        raise HTTPException(
-            status_code=500, 
-            detail=f"读取处理记录失败: {str(exc)}"
-        )
-    
     return ProcessResponse(
         session_id=session_id,
-        rounds=rounds,
+        rounds=list(rounds),
         total_rounds=len(rounds)
     )
 
@@ -373,8 +485,7 @@ async def resume_job(
         raise HTTPException(status_code=400, detail="file is required")
     
     # 验证 session 是否存在
-    sessions_dir = Path("sessions")
-    rounds_file = sessions_dir / f"{session_id}.rounds.jsonl"
+    rounds_file = SESSIONS_DIR / f"{session_id}.rounds.jsonl"
     if not rounds_file.exists():
         raise HTTPException(
             status_code=404,
@@ -405,7 +516,7 @@ async def resume_job(
 # 元信息接口
 # ------------------------------------------------------------------ #
 
-@app.get("/api/v1/meta", response_model=MetaResponse)
+@app.api_route("/api/v1/meta", methods=["GET", "HEAD"], response_model=MetaResponse)
 async def get_meta():
     """获取服务元信息，包括输出目录、版本号等。"""
     output_dir = get_output_dir()
@@ -5,6 +5,12 @@ from typing import Any, Dict, Optional
 
 from .schemas import JobStatusEnum
 
+_TERMINAL_STATUSES = (
+    JobStatusEnum.succeeded,
+    JobStatusEnum.failed,
+    JobStatusEnum.cancelled,
+)
+
 
 @dataclass
 class TaskRecord:
@@ -16,7 +22,15 @@ class TaskRecord:
     error: Optional[str] = None
     session_id: Optional[str] = None  # 关联的 session_id
     image_path: Optional[str] = None  # 原始图片路径（用于断点续传）
-    cancel_requested: bool = False  # 取消标志
+    # 任务在后台线程中执行，用 threading.Event 跨线程通知：
+    # done 在进入终态时置位（供长轮询等待），cancel 在请求取消时置位（供工作线程检查）
+    done: threading.Event = field(default_factory=threading.Event, repr=False, compare=False)
+    cancel: threading.Event = field(default_factory=threading.Event, repr=False, compare=False)
+
+    @property
+    def cancel_requested(self) -> bool:
+        """取消标志"""
+        return self.cancel.is_set()
 
 
 class InMemoryTaskStore:
@@ -57,6 +71,9 @@ class InMemoryTaskStore:
             if image_path is not None:
                 record.image_path = image_path
             record.updated_at = datetime.utcnow()
+            # 字段全部更新后再唤醒长轮询，等待方读到的是完整结果
+            if record.status in _TERMINAL_STATUSES:
+                record.done.set()
             return record
 
     def get(self, task_id: str) -> Optional[TaskRecord]:
@@ -72,15 +89,14 @@ class InMemoryTaskStore:
             # 只有 PENDING 或 RUNNING 状态的任务可以被取消
             if record.status not in (JobStatusEnum.pending, JobStatusEnum.running):
                 return False
-            record.cancel_requested = True
+            record.cancel.set()
             record.updated_at = datetime.utcnow()
             return True
 
     def is_cancel_requested(self, task_id: str) -> bool:
         """检查任务是否被请求取消。"""
-        with self._lock:
-            record = self._tasks.get(task_id)
-            return record.cancel_requested if record else False
+        record = self.get(task_id)
+        return record.cancel.is_set() if record else False
 
     def find_by_session_id(self, session_id: str) -> Optional[TaskRecord]:
         """通过 session_id 查找任务记录。"""
@@ -2,18 +2,18 @@ import json
 import os
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 from google import genai
 from google.genai import types
 from google.cloud import storage
-from PIL import Image
 
-from src.ai_agent import CBETAAgent
+from src.ai_agent import CBETAAgent, sniff_image_mime
 from src.schemas import FinalAnswer
-from src.main import summarize_final_answer, build_fragment_note
+from src.main import write_result_files
 from src.config import get_output_dir
 from src.api.schemas import (
     JobStatusEnum,
@@ -40,8 +40,17 @@ class BatchProcessor:
     负责 orchestrate 多任务 × 多轮 Batch API 调度，并与本地 Session 记录互通。
     """
 
-    def __init__(self, agent: CBETAAgent, *, bucket_name: Optional[str] = None):
+    def __init__(
+        self,
+        agent: CBETAAgent,
+        *,
+        bucket_name: Optional[str] = None,
+        max_parallel_sessions: int = 4,
+    ):
         self.agent = agent
+        # 同一轮内各 session 的工具执行、最终结构化输出互不依赖，可并行的 session 数上限；
+        # 各 session 的工具调用共用 Agent 的 max_concurrent_tools 总上限
+        self.max_parallel_sessions = max_parallel_sessions
         # 直接复用 Agent 已初始化好的 Vertex AI 客户端，确保批处理与单图流程共享同一凭据/项目配置。
         self.client = agent.client
         self.gcs_bucket_name = bucket_name or os.getenv(
@@ -54,6 +63,8 @@ class BatchProcessor:
         self.storage_client = storage.Client()
         self._gcs_bucket = self.storage_client.bucket(self.gcs_bucket_name)
         self._lock = threading.Lock()
+        # 同一图片重复提交时各 session 的输出路径相同，结果文件逐个写出，后完成的整体覆盖先完成的
+        self._output_lock = threading.Lock()
         self._batches: Dict[str, Dict] = {}
 
     # ------------------------------------------------------------------ #
@@ -106,7 +117,7 @@ class BatchProcessor:
 
                 # 使用与单图流程一致的重试策略：
                 # - 普通轮：normal_retries 次（AgentConfig.normal_retries）
-                # - 每次失败后等待 retry_interval 秒（AgentConfig.retry_interval）
+                # - 失败后从 retry_interval 秒开始指数退避（AgentConfig.retry_interval / retry_max_interval）
                 def _create_and_wait():
                     job = self.client.batches.create(
                         model=self.agent.config.model_name,
@@ -130,70 +141,20 @@ class BatchProcessor:
                         session.error = "Batch 返回空结果"
                     continue
 
-                for idx, payload in enumerate(responses_payload):
-                    if idx >= len(pending_sessions):
-                        continue
-                    session = pending_sessions[idx]
-                    if payload.get("error"):
-                        session.error = self._stringify_error(payload["error"])
-                        continue
-
-                    response_data = payload.get("response")
-                    if not response_data:
-                        session.error = "Batch 响应为空"
-                        continue
-
-                    try:
-                        response = types.GenerateContentResponse.model_validate(
-                            response_data
-                        )
-                    except Exception as exc:
-                        session.error = f"解析 Batch 响应失败: {exc}"
-                        continue
-
-                    if not response.candidates:
-                        session.error = "空响应"
-                        continue
-                    content = response.candidates[0].content
-                    session.history.append(content)
-
-                    round_result = self.agent._handle_model_response(
-                        session_id=session.session_id,
-                        round_index=round_index,
-                        response=response,
-                        content=content,
-                        stream_handler=None,
-                    )
-
-                    session.last_round = round_index
-
-                    if round_result["next_user_content"]:
-                        session.history.append(round_result["next_user_content"])
-
-                    if round_result["json_result"]:
-                        session.done = True
-                        session.final_answer = round_result["json_result"]
-                        self._finalize_session(session)
-                    elif round_result["should_break"]:
-                        session.error = "模型未返回结构化结果"
+                # Batch 输出与 pending_sessions 按顺序一一对应
+                self._for_each_session(
+                    lambda pair: self._apply_round_payload(*pair, round_index),
+                    list(zip(pending_sessions, responses_payload)),
+                )
 
             # 对仍未完成的 session 进行最终结构化输出
             self._update_batch_progress(
                 batch_id, JobStatusEnum.batch_merging, max_rounds + 1
             )
-            for session in session_map.values():
-                if session.done or session.error:
-                    continue
-                # 进入最终结构化阶段
-                result = self.agent._force_structured_output(
-                    session.history, session.session_id
-                )
-                if result:
-                    session.done = True
-                    session.final_answer = result
-                    self._finalize_session(session)
-                else:
-                    session.error = "最终结构化输出失败"
+            self._for_each_session(
+                self._force_final_answer,
+                [s for s in session_map.values() if not s.done and not s.error],
+            )
 
             has_error = any(s.error for s in session_map.values())
             final_status = (
@@ -283,15 +244,78 @@ class BatchProcessor:
     # ------------------------------------------------------------------ #
     # Internal helpers
     # ------------------------------------------------------------------ #
+    def _for_each_session(self, func: Callable[[Any], None], items: List[Any]):
+        """对每个 session 执行 func；多个 session 时放到线程池并行，异常照常向上抛出"""
+        if len(items) <= 1 or self.max_parallel_sessions <= 1:
+            for item in items:
+                func(item)
+            return
+        workers = min(self.max_parallel_sessions, len(items))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-session") as executor:
+            list(executor.map(func, items))
+
+    def _apply_round_payload(
+        self, session: SessionJob, payload: Dict[str, Any], round_index: int
+    ):
+        """处理单个 session 在本轮的 Batch 输出：执行工具、记录轮次并更新 session 状态"""
+        if payload.get("error"):
+            session.error = self._stringify_error(payload["error"])
+            return
+
+        response_data = payload.get("response")
+        if not response_data:
+            session.error = "Batch 响应为空"
+            return
+
+        try:
+            response = types.GenerateContentResponse.model_validate(response_data)
+        except Exception as exc:
+            session.error = f"解析 Batch 响应失败: {exc}"
+            return
+
+        if not response.candidates:
+            session.error = "空响应"
+            return
+        content = response.candidates[0].content
+        session.history.append(content)
+
+        round_result = self.agent._handle_model_response(
+            session_id=session.session_id,
+            round_index=round_index,
+            response=response,
+            content=content,
+            stream_handler=None,
+        )
+
+        session.last_round = round_index
+
+        if round_result["next_user_content"]:
+            session.history.append(round_result["next_user_content"])
+
+        if round_result["json_result"]:
+            session.done = True
+            session.final_answer = round_result["json_result"]
+            self._finalize_session(session)
+        elif round_result["should_break"]:
+            session.error = "模型未返回结构化结果"
+
+    def _force_final_answer(self, session: SessionJob):
+        """对未完成的 session 进入最终结构化阶段"""
+        result = self.agent._force_structured_output(
+            session.history, session.session_id
+        )
+        if result:
+            session.done = True
+            session.final_answer = result
+            self._finalize_session(session)
+        else:
+            session.error = "最终结构化输出失败"
+
     def _build_initial_history(self, image_path: Path) -> List[types.Content]:
         prompt = self.agent._build_prompt(ocr_text=None, image_path=None)
         parts: List[types.Part] = [types.Part(text=prompt)]
-        try:
-            with Image.open(image_path) as img:
-                mime_type = Image.MIME.get(img.format, "image/png")
-        except Exception:
-            mime_type = "image/png"
         image_bytes = image_path.read_bytes()
+        mime_type = sniff_image_mime(image_bytes, str(image_path)) or "image/png"
         parts.append(types.Part.from_bytes(data=image_bytes, mime_type=mime_type))
         return [types.Content(role="user", parts=parts)]
 
@@ -350,27 +374,9 @@ class BatchProcessor:
         else:
             pic_name = session.alias
         
-        # 创建以图片名称命名的子文件夹
-        pic_output_dir = output_base / pic_name
-        pic_output_dir.mkdir(parents=True, exist_ok=True)
-
-        json_path = pic_output_dir / f"{pic_name}_result.json"
-        json_path.write_text(
-            session.final_answer.model_dump_json(indent=2, ensure_ascii=False),
-            encoding="utf-8",
-        )
-
-        report_path = pic_output_dir / f"{pic_name}_report.txt"
-        report_path.write_text(
-            summarize_final_answer(session.final_answer),
-            encoding="utf-8",
-        )
-
-        note_path = pic_output_dir / f"{pic_name}_note.txt"
-        note_path.write_text(
-            build_fragment_note(session.final_answer, pic_name),
-            encoding="utf-8",
-        )
+        # 以图片名称命名的子文件夹下保存结果文件
+        with self._output_lock:
+            write_result_files(session.final_answer, output_base / pic_name, pic_name)
 
     def _update_batch_progress(
         self, batch_id: str, status: JobStatusEnum, round_index: int
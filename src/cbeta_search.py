@@ -1,6 +1,7 @@
 import os
 import time
-from typing import List, Tuple, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Any, Sequence
 
 from src.cbeta_tools import CBETATools
 
@@ -55,6 +56,23 @@ class CBETASearcher:
             })
         return cleaned_results, num_found
 
+    def search_many(
+        self,
+        queries: Sequence[str],
+        max_workers: int = 4,
+        **kwargs: Any,
+    ) -> List[Tuple[List[Dict[str, Any]], int]]:
+        """
+        并发执行多条全文检索，结果顺序与 queries 一致。
+
+        各查询共用 CBETATools 内部的 Session 连接池，避免逐条串行等待。
+        """
+        if not queries:
+            return []
+        workers = max(1, min(max_workers, len(queries)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda q: self.search(q, **kwargs), queries))
+
     def search_similar(self, query: str) -> List[Dict[str, Any]]:
         """
         相似文本搜索 (适用于 OCR 结果)
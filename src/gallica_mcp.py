@@ -67,6 +67,7 @@ class GallicaMCPClient:
         self._reader_thread: Optional[threading.Thread] = None
         self._response_queues: Dict[str, queue.Queue] = {}
         self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # 多个工具调用可能并发发送请求，按行串行写入 stdin
         self._running = False
         self._tools: Dict[str, Dict] = {}  # 缓存工具元数据
         self._initialized = False
@@ -184,8 +185,9 @@ class GallicaMCPClient:
             if self.config.debug:
                 print(f"📤 MCP 请求: {request_line.strip()[:200]}...")
             
-            self._process.stdin.write(request_line)
-            self._process.stdin.flush()
+            with self._write_lock:
+                self._process.stdin.write(request_line)
+                self._process.stdin.flush()
             
             # 等待响应
             try:
@@ -242,8 +244,9 @@ class GallicaMCPClient:
             notification["params"] = params
         
         notification_line = json.dumps(notification) + "\n"
-        self._process.stdin.write(notification_line)
-        self._process.stdin.flush()
+        with self._write_lock:
+            self._process.stdin.write(notification_line)
+            self._process.stdin.flush()
     
     def _call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -3,8 +3,9 @@ import json
 import os
 from datetime import datetime
 from pathlib import Path
-from typing import Iterable, List
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
+import orjson
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -239,6 +240,30 @@ def build_fragment_note(answer: FinalAnswer, image_name: str) -> str:
 
     return "\n".join(lines)
 
+
+def write_result_files(
+    answer: FinalAnswer,
+    pic_output_dir: Path,
+    pic_name: str,
+    payload: Optional[Dict[str, Any]] = None,
+) -> Tuple[Path, Path, Path]:
+    """
+    在 pic_output_dir 下写出 {pic_name}_result.json / _report.txt / _note.txt，
+    返回三个文件路径。payload 为调用方已有的 answer.model_dump(mode="json")，可避免重复序列化。
+    """
+    pic_output_dir.mkdir(parents=True, exist_ok=True)
+    if payload is None:
+        payload = answer.model_dump(mode="json")
+
+    json_path = pic_output_dir / f"{pic_name}_result.json"
+    report_path = pic_output_dir / f"{pic_name}_report.txt"
+    note_path = pic_output_dir / f"{pic_name}_note.txt"
+    json_path.write_bytes(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+    report_path.write_text(summarize_final_answer(answer), encoding="utf-8")
+    note_path.write_text(build_fragment_note(answer, pic_name), encoding="utf-8")
+    return json_path, report_path, note_path
+
+
 def process_image(agent: CBETAAgent, image_path: Path, output_dir: Path, mirror_stdout: bool):
     print(f"\n📷 处理图片: {image_path.name}")
     
@@ -258,17 +283,10 @@ def process_image(agent: CBETAAgent, image_path: Path, output_dir: Path, mirror_
         print("❌ 本次未获取到结构化结果")
         return
 
-    json_path = pic_output_dir / f"{image_path.stem}_result.json"
-    json_path.write_text(result.model_dump_json(indent=2, ensure_ascii=False), encoding="utf-8")
+    # 结构化结果、文本报告与"文献整理说明"附带文档
+    json_path, report_path, note_path = write_result_files(result, pic_output_dir, image_path.stem)
     print(f"💾 结构化结果已保存: {json_path}")
-
-    report_path = pic_output_dir / f"{image_path.stem}_report.txt"
-    report_path.write_text(summarize_final_answer(result), encoding="utf-8")
     print(f"📝 文本报告已保存: {report_path}")
-
-    # 生成"文献整理说明"附带文档
-    note_path = pic_output_dir / f"{image_path.stem}_note.txt"
-    note_path.write_text(build_fragment_note(result, image_path.stem), encoding="utf-8")
     print(f"📄 文献整理说明已保存: {note_path}")
 
 
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+os.environ.setdefault("API_CLIENT_DISABLE_PREWARM", "1")
+
+from desktop_client.api_client import APIClient  # noqa: E402
+
+
+def _job(task_id, status="RUNNING"):
+    return {
+        "task_id": task_id,
+        "status": status,
+        "created_at": "2025-12-01T00:00:00",
+        "updated_at": "2025-12-01T00:00:00",
+        "result": None,
+        "error": None,
+    }
+
+
+class _StubBackend:
+    """记录收到的请求并按测试设定返回响应的最小 HTTP 服务"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.batch_status_enabled = True
+        self.batch_status_code = 404
+        self.requests = []
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code, body=None, headers=None):
+                data = b"" if body is None else json.dumps(body).encode()
+                self.send_response(code)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                backend.requests.append(("POST", self.path, body))
+                if self.path == "/api/v1/jobs/batch_status" and backend.batch_status_enabled:
+                    jobs = {i: backend.jobs[i] for i in body["task_ids"] if i in backend.jobs}
+                    self._send(200, {"jobs": jobs})
+                elif self.path == "/api/v1/jobs/batch_status":
+                    self._send(backend.batch_status_code, {"detail": "Not Found"})
+                else:
+                    self._send(404, {"detail": "Not Found"})
+
+            def do_HEAD(self):
+                backend.requests.append(("HEAD", self.path, None))
+                self.send_response(200 if self.path == "/api/v1/meta" else 404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                backend.requests.append(("GET", self.path, self.headers.get("If-None-Match")))
+                task_id = self.path.rsplit("/", 1)[-1]
+                job = backend.jobs.get(task_id)
+                if job is None:
+                    self._send(404, {"detail": "task not found"})
+                    return
+                etag = f'W/"{job["status"]}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, headers={"ETag": etag})
+                else:
+                    self._send(200, job, headers={"ETag": etag})
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def backend():
+    stub = _StubBackend()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def api(backend):
+    client = APIClient(base_url=backend.url)
+    yield client
+    client.close()
+
+
+def test_get_jobs_status_chunks_requests(backend, api):
+    ids = [f"t{i}" for i in range(APIClient.STATUS_CHUNK_SIZE * 2 + 3)]
+    for task_id in ids[:-1]:
+        backend.jobs[task_id] = _job(task_id)
+
+    statuses = api.get_jobs_status(ids)
+
+    assert set(statuses) == set(ids[:-1])  # 后端不存在的任务不出现在结果中
+    posts = [body["task_ids"] for method, _, body in backend.requests if method == "POST"]
+    assert [len(chunk) for chunk in posts] == [64, 64, 3]
+    assert [i for chunk in posts for i in chunk] == ids
+
+
+def test_get_jobs_status_serves_terminal_jobs_from_cache(backend, api):
+    backend.jobs["done"] = _job("done", "SUCCEEDED")
+    backend.jobs["busy"] = _job("busy")
+    api.get_jobs_status(["done", "busy"])
+    backend.requests.clear()
+
+    statuses = api.get_jobs_status(["done", "busy"])
+    assert statuses["done"]["status"] == "SUCCEEDED"
+    assert backend.requests == [("POST", "/api/v1/jobs/batch_status", {"task_ids": ["busy"]})]
+
+
+@pytest.mark.parametrize("code", [404, 405])
+def test_get_jobs_status_falls_back_to_single_queries(backend, api, code):
+    backend.batch_status_enabled = False
+    backend.batch_status_code = code
+    backend.jobs["a"] = _job("a")
+    backend.jobs["b"] = _job("b", "FAILED")
+
+    statuses = api.get_jobs_status(["a", "missing", "b"])
+
+    assert set(statuses) == {"a", "b"}
+    assert statuses["b"]["status"] == "FAILED"
+    gets = sorted(path for method, path, _ in backend.requests if method == "GET")
+    assert gets == ["/api/v1/jobs/a", "/api/v1/jobs/b", "/api/v1/jobs/missing"]
+
+
+def test_get_job_status_reuses_data_on_304(backend, api):
+    backend.jobs["a"] = _job("a")
+    first = api.get_job_status("a")
+    second = api.get_job_status("a")
+
+    assert second == first
+    assert backend.requests == [
+        ("GET", "/api/v1/jobs/a", None),
+        ("GET", "/api/v1/jobs/a", 'W/"RUNNING"'),
+    ]
+
+    backend.jobs["a"] = _job("a", "SUCCEEDED")
+    assert api.get_job_status("a")["status"] == "SUCCEEDED"
+    # 终态直接命中本地缓存，不再请求
+    count = len(backend.requests)
+    assert api.get_job_status("a")["status"] == "SUCCEEDED"
+    assert len(backend.requests) == count
+
+
+def test_prewarm_probes_meta_with_head(backend, api):
+    api._prewarm()
+    assert backend.requests == [("HEAD", "/api/v1/meta", None)]
+    assert api.health_check() is True
+    assert len(backend.requests) == 1  # 健康检查结果已缓存
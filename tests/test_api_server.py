@@ -0,0 +1,282 @@
+import importlib
+import os
+import sys
+import threading
+import time
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+from src.api.schemas import BatchStatusResponse, JobStatusEnum
+
+
+class _StubSessionManager:
+    def create_session(self) -> str:
+        return "stub-session"
+
+
+class _StubAgent:
+    """替代 CBETAAgent：不连接 Vertex，分析流程由各测试自行指定"""
+
+    def __init__(self, config=None):
+        self.config = config
+        self.client = None
+        self.session_manager = _StubSessionManager()
+
+    def analyze_and_locate(self, **kwargs):
+        return None
+
+
+class _StubStorageClient:
+    def bucket(self, name):
+        return name
+
+
+@pytest.fixture(scope="module")
+def server():
+    mp = pytest.MonkeyPatch()
+    mp.setattr("src.ai_agent.CBETAAgent", _StubAgent)
+    mp.setattr("google.cloud.storage.Client", _StubStorageClient)
+    sys.modules.pop("src.api.server", None)
+    module = importlib.import_module("src.api.server")
+    yield module
+    sys.modules.pop("src.api.server", None)
+    mp.undo()
+
+
+@pytest.fixture
+def client(server):
+    with TestClient(server.app) as c:
+        yield c
+
+
+def _new_task(server) -> str:
+    task_id = f"task-{time.monotonic_ns()}"
+    server.task_store.create(task_id)
+    return task_id
+
+
+def test_long_poll_returns_when_task_finishes(server, client):
+    task_id = _new_task(server)
+    server.task_store.update(task_id, status=JobStatusEnum.running)
+
+    def finish():
+        time.sleep(0.3)
+        server.task_store.update(task_id, status=JobStatusEnum.succeeded, result={"ok": True})
+
+    threading.Thread(target=finish).start()
+    start = time.monotonic()
+    resp = client.get(f"/api/v1/jobs/{task_id}", params={"wait": 10})
+    elapsed = time.monotonic() - start
+
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body["status"] == JobStatusEnum.succeeded.value
+    assert body["result"] == {"ok": True}
+    assert body["error"] is None
+    assert 0.25 <= elapsed < server.JOB_EVENTS_POLL_INTERVAL + 2
+
+
+def test_long_poll_times_out_with_current_status(server, client):
+    task_id = _new_task(server)
+    start = time.monotonic()
+    resp = client.get(f"/api/v1/jobs/{task_id}", params={"wait": 0.3})
+    elapsed = time.monotonic() - start
+
+    assert resp.json()["status"] == JobStatusEnum.pending.value
+    assert 0.3 <= elapsed < 2
+
+
+def test_long_poll_does_not_use_default_executor(server, client, monkeypatch):
+    def forbidden(*args, **kwargs):
+        raise AssertionError("long poll must not occupy a worker thread")
+
+    monkeypatch.setattr(server.asyncio, "to_thread", forbidden)
+    task_id = _new_task(server)
+    resp = client.get(f"/api/v1/jobs/{task_id}", params={"wait": 0.1})
+    assert resp.status_code == 200
+
+
+def test_done_event_set_only_on_terminal_status(server):
+    task_id = _new_task(server)
+    record = server.task_store.get(task_id)
+    server.task_store.update(task_id, status=JobStatusEnum.running)
+    assert not record.done.is_set()
+    server.task_store.update(task_id, status=JobStatusEnum.failed, error="boom")
+    assert record.done.is_set()
+    assert record.error == "boom"
+
+
+def test_cancel_running_job_stops_worker(server, client, tmp_path, monkeypatch):
+    image = tmp_path / "frag.png"
+    image.write_bytes(b"\x89PNG\r\n\x1a\n")
+    started = threading.Event()
+
+    def analyze(cancel_check, **kwargs):
+        started.set()
+        deadline = time.monotonic() + 5
+        while not cancel_check() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return None
+
+    monkeypatch.setattr(server.agent, "analyze_and_locate", analyze)
+    task_id = _new_task(server)
+    worker = threading.Thread(target=server._run_single_job, args=(task_id, image))
+    worker.start()
+    assert started.wait(5)
+
+    resp = client.post(f"/api/v1/jobs/{task_id}/cancel")
+    assert resp.status_code == 200
+    assert server.task_store.get(task_id).cancel.is_set()
+
+    worker.join(5)
+    record = server.task_store.get(task_id)
+    assert record.status == JobStatusEnum.cancelled
+    assert record.done.is_set()
+    assert image.exists()  # 取消时保留图片以便续传
+
+    # 已结束的任务不能再次取消
+    assert client.post(f"/api/v1/jobs/{task_id}/cancel").status_code == 400
+
+
+def test_cancel_pending_job(server, client):
+    task_id = _new_task(server)
+    resp = client.post(f"/api/v1/jobs/{task_id}/cancel")
+    assert resp.status_code == 200
+    record = server.task_store.get(task_id)
+    assert record.cancel_requested
+    assert record.status == JobStatusEnum.cancelled
+    assert record.done.is_set()
+
+
+def test_batch_status_skips_unknown_ids(server, client):
+    known = _new_task(server)
+    server.task_store.update(known, status=JobStatusEnum.running)
+
+    resp = client.post("/api/v1/jobs/batch_status", json={"task_ids": [known, "missing"]})
+    assert resp.status_code == 200
+    jobs = resp.json()["jobs"]
+    assert list(jobs) == [known]
+    assert jobs[known]["status"] == JobStatusEnum.running.value
+    assert jobs[known]["result"] is None
+    assert jobs[known]["error"] is None
+
+    assert client.post("/api/v1/jobs/batch_status", json={"task_ids": []}).json() == {"jobs": {}}
+
+
+def test_job_status_etag_returns_304_until_changed(server, client):
+    task_id = _new_task(server)
+    first = client.get(f"/api/v1/jobs/{task_id}")
+    etag = first.headers["ETag"]
+    assert first.json()["status"] == JobStatusEnum.pending.value
+
+    cached = client.get(f"/api/v1/jobs/{task_id}", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag
+    assert cached.content == b""
+
+    server.task_store.update(task_id, status=JobStatusEnum.running)
+    changed = client.get(f"/api/v1/jobs/{task_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["status"] == JobStatusEnum.running.value
+
+
+def test_batch_status_etag(server, client, monkeypatch):
+    status = BatchStatusResponse(
+        batch_id="b1",
+        status=JobStatusEnum.failed,
+        round=1,
+        total_jobs=1,
+        completed_jobs=0,
+        failed_jobs=1,
+        details=[{"session_id": "s1", "status": "FAILED", "error": None}],
+    )
+    monkeypatch.setattr(server.batch_processor, "get_status", lambda batch_id: status if batch_id == "b1" else None)
+
+    first = client.get("/api/v1/batches/b1")
+    assert first.status_code == 200
+    assert first.json()["details"][0]["error"] is None
+    again = client.get("/api/v1/batches/b1", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert client.get("/api/v1/batches/other").status_code == 404
+
+
+def _round_line(index, summary="摘要"):
+    return orjson.dumps({"round_index": index, "timestamp": "2025-12-01T00:00:00", "summary": summary}) + b"\n"
+
+
+@pytest.fixture
+def sessions_dir(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "SESSIONS_DIR", tmp_path)
+    server._rounds_cache.clear()
+    yield tmp_path
+    server._rounds_cache.clear()
+
+
+def test_load_rounds_defers_partial_last_line(server, sessions_dir):
+    path = sessions_dir / "s1.rounds.jsonl"
+    line = _round_line(2)
+    path.write_bytes(_round_line(1) + line[:10])
+
+    rounds = server._load_rounds("s1")
+    assert [r.round_index for r in rounds] == [1]
+
+    with path.open("ab") as f:
+        f.write(line[10:])
+    rounds = server._load_rounds("s1")
+    assert [r.round_index for r in rounds] == [1, 2]
+    assert server._rounds_cache["s1"][0] == path.stat().st_size
+
+
+def test_load_rounds_cache_hit_and_append(server, sessions_dir):
+    path = sessions_dir / "s1.rounds.jsonl"
+    path.write_bytes(_round_line(1))
+    first = server._load_rounds("s1")
+    assert server._load_rounds("s1") is first
+
+    with path.open("ab") as f:
+        f.write(_round_line(2))
+    appended = server._load_rounds("s1")
+    assert appended[0] is first[0]  # 已解析的轮次直接复用
+    assert [r.round_index for r in appended] == [1, 2]
+
+
+def test_load_rounds_rereads_rewritten_file(server, sessions_dir):
+    path = sessions_dir / "s1.rounds.jsonl"
+    path.write_bytes(_round_line(1, "旧") + _round_line(2, "旧"))
+    server._load_rounds("s1")
+
+    path.write_bytes(_round_line(1, "新"))
+    assert [r.summary for r in server._load_rounds("s1")] == ["新"]
+
+    # 同长度改写同样整体重读
+    before = path.stat()
+    path.write_bytes(_round_line(1, "改"))
+    os.utime(path, ns=(before.st_atime_ns, before.st_mtime_ns + 1_000_000))
+    assert [r.summary for r in server._load_rounds("s1")] == ["改"]
+
+    path.unlink()
+    assert server._load_rounds("s1") is None
+    assert "s1" not in server._rounds_cache
+
+
+def test_load_rounds_cache_evicts_least_recent(server, sessions_dir, monkeypatch):
+    monkeypatch.setattr(server, "_ROUNDS_CACHE_MAX", 2)
+    for sid in ("a", "b", "c"):
+        (sessions_dir / f"{sid}.rounds.jsonl").write_bytes(_round_line(1))
+
+    server._load_rounds("a")
+    server._load_rounds("b")
+    server._load_rounds("a")  # a 变为最近使用
+    server._load_rounds("c")
+    assert list(server._rounds_cache) == ["a", "c"]
+
+
+def test_process_endpoint_reads_rounds(server, client, sessions_dir):
+    (sessions_dir / "s1.rounds.jsonl").write_bytes(_round_line(1) + _round_line(2))
+    body = client.get("/api/v1/process/s1").json()
+    assert body["total_rounds"] == 2
+    assert [r["round_index"] for r in body["rounds"]] == [1, 2]
+    assert client.get("/api/v1/process/missing").status_code == 404
@@ -1,6 +1,8 @@
 import json
+import time
 from pathlib import Path
 
+from src import ai_agent
 from src.ai_agent import SessionManager, build_round_history_contents
 
 
@@ -62,3 +64,50 @@ def test_build_round_history_contents_includes_tool_calls():
     assert "工具调用:" in text
     assert "search_similar" in text
 
+
+
+def _slow_writer(monkeypatch, delay):
+    """换上一个写入前会等待的独立写线程，便于观察 save_round 的异步行为"""
+    writer = ai_agent._RoundWriter()
+    fd_for = writer._fd_for
+
+    def slow_fd_for(path):
+        time.sleep(delay)
+        return fd_for(path)
+
+    monkeypatch.setattr(writer, "_fd_for", slow_fd_for)
+    monkeypatch.setattr(ai_agent, "_round_writer", writer)
+    return writer
+
+
+def test_save_round_is_async_and_load_rounds_flushes(tmp_path, monkeypatch):
+    _slow_writer(monkeypatch, 0.3)
+    manager = SessionManager(storage_dir=str(tmp_path))
+
+    start = time.monotonic()
+    for index in range(1, 4):
+        manager.save_round("s1", {"round_index": index, "summary": f"第 {index} 轮"})
+    assert time.monotonic() - start < 0.2
+
+    loaded = manager.load_rounds("s1")
+    assert [r["round_index"] for r in loaded] == [1, 2, 3]
+
+
+def test_round_writer_evicts_descriptors_beyond_cap(tmp_path, monkeypatch):
+    writer = _slow_writer(monkeypatch, 0)
+    manager = SessionManager(storage_dir=str(tmp_path))
+    cap = ai_agent._RoundWriter.MAX_OPEN_FILES
+    sessions = [f"s{i}" for i in range(cap + 8)]
+
+    for session_id in sessions:
+        manager.save_round(session_id, {"round_index": 1, "summary": session_id})
+    writer.flush()
+    assert len(writer._fds) == cap
+    assert list(writer._fds) == [tmp_path / f"{s}.rounds.jsonl" for s in sessions[-cap:]]
+
+    # 被关闭的文件再次写入时重新打开，继续追加
+    manager.save_round(sessions[0], {"round_index": 2, "summary": "again"})
+    loaded = manager.load_rounds(sessions[0])
+    assert [r["round_index"] for r in loaded] == [1, 2]
+    assert len(writer._fds) == cap
+    assert next(reversed(writer._fds)) == tmp_path / f"{sessions[0]}.rounds.jsonl"
@@ -0,0 +1,209 @@
+import json
+from datetime import datetime
+
+import orjson
+
+from desktop_client.models import TaskStatus, TaskType
+from desktop_client.task_store import TaskStore
+
+
+def _reload(path):
+    return TaskStore(storage_path=path)
+
+
+def test_journal_replay_restores_changes(tmp_path):
+    path = tmp_path / "tasks.json"
+    store = TaskStore(storage_path=path)
+    a = store.create_task(["a.png"])
+    b = store.create_task(["b.png", "c.png"], TaskType.BATCH)
+    store.update_task(a.local_id, status=TaskStatus.RUNNING, progress=0.5, task_id="job-a")
+    store.delete_task(b.local_id)
+    store.flush()
+
+    # 尚未合并：只有日志，没有快照
+    assert not path.exists()
+    journal = store._journal_path.read_bytes().splitlines()
+    assert [orjson.loads(line)["op"] for line in journal] == ["upsert", "delete"]
+
+    loaded = _reload(path)
+    assert [t.local_id for t in loaded.get_all_tasks()] == [a.local_id]
+    restored = loaded.get_task(a.local_id)
+    assert restored.status == TaskStatus.RUNNING
+    assert restored.progress == 0.5
+    assert restored.task_id == "job-a"
+    assert list(restored.image_paths) == ["a.png"]
+    assert loaded.get_active_tasks() == [restored]
+
+
+def test_torn_trailing_line_is_truncated(tmp_path):
+    path = tmp_path / "tasks.json"
+    store = TaskStore(storage_path=path)
+    a = store.create_task(["a.png"])
+    store.flush()
+    complete = store._journal_path.stat().st_size
+
+    with open(store._journal_path, "ab") as f:
+        f.write(b'{"op": "upsert", "r": {"local_id"')
+
+    loaded = _reload(path)
+    assert [t.local_id for t in loaded.get_all_tasks()] == [a.local_id]
+    assert loaded._journal_path.stat().st_size == complete
+
+    # 截断后继续追加的记录不会与残行粘连
+    b = loaded.create_task(["b.png"])
+    loaded.flush()
+    again = _reload(path)
+    assert {t.local_id for t in again.get_all_tasks()} == {a.local_id, b.local_id}
+
+
+def test_failed_append_keeps_pending_changes(tmp_path, monkeypatch):
+    path = tmp_path / "tasks.json"
+    store = TaskStore(storage_path=path)
+    a = store.create_task(["a.png"])
+    store.flush()
+    complete = store._journal_path.stat().st_size
+
+    store.update_task(a.local_id, status=TaskStatus.FAILED, error="boom")
+
+    import builtins
+    real_open = builtins.open
+
+    class _TornFile:
+        def __init__(self, f):
+            self._f = f
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self._f.close()
+
+        def truncate(self, size):
+            self._f.truncate(size)
+
+        def write(self, data):
+            self._f.write(data[:7])
+            self._f.flush()
+            raise OSError("disk full")
+
+    def flaky_open(file, mode="r", *args, **kwargs):
+        if file == store._journal_path and mode == "ab":
+            return _TornFile(real_open(file, mode, *args, **kwargs))
+        return real_open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", flaky_open)
+    store.flush()
+    monkeypatch.setattr(builtins, "open", real_open)
+
+    assert a.local_id in store._pending
+    store.flush()
+    assert not store._pending
+
+    loaded = _reload(path)
+    restored = loaded.get_task(a.local_id)
+    assert restored.status == TaskStatus.FAILED
+    assert restored.error == "boom"
+    assert len(loaded._journal_path.read_bytes().splitlines()) == 2
+    assert loaded._journal_path.stat().st_size > complete
+
+
+def test_compaction_threshold(tmp_path, monkeypatch):
+    path = tmp_path / "tasks.json"
+    monkeypatch.setattr(TaskStore, "COMPACT_MIN_BYTES", 1)
+    store = TaskStore(storage_path=path)
+    a = store.create_task(["a.png"])
+    store.flush()
+
+    # 快照为空时日志一写入即超过阈值，合并后日志清空
+    assert path.exists()
+    assert store._journal_path.stat().st_size == 0
+    snapshot_bytes = store._snapshot_bytes
+    assert snapshot_bytes == path.stat().st_size
+
+    # 日志未超过 COMPACT_RATIO 倍快照时只追加
+    store.update_task(a.local_id, progress=0.1)
+    store.flush()
+    assert 0 < store._journal_bytes <= TaskStore.COMPACT_RATIO * snapshot_bytes
+    assert path.stat().st_size == snapshot_bytes
+
+    while store._journal_bytes:
+        store.update_task(a.local_id, progress=store.get_task(a.local_id).progress + 0.1)
+        store.flush()
+        assert store._journal_bytes <= TaskStore.COMPACT_RATIO * snapshot_bytes
+    assert store._journal_path.stat().st_size == 0
+
+    loaded = _reload(path)
+    assert loaded.get_task(a.local_id).progress == store.get_task(a.local_id).progress
+
+
+def test_bulk_create_and_update_many(tmp_path):
+    path = tmp_path / "tasks.json"
+    store = TaskStore(storage_path=path)
+    records = store.create_tasks_bulk([
+        (["a.png"], TaskType.SINGLE),
+        (["b.png"], TaskType.SINGLE),
+        (["c.png", "d.png"], TaskType.BATCH),
+    ])
+    ids = [r.local_id for r in records]
+    assert [t.local_id for t in store.get_queued_tasks()] == ids
+
+    updated = store.update_many({
+        ids[0]: {"status": TaskStatus.SUCCEEDED},
+        ids[2]: {"status": TaskStatus.BATCH_RUNNING, "completed_jobs": 1},
+        "missing": {"status": TaskStatus.FAILED},
+    })
+    assert [r.local_id for r in updated] == [ids[0], ids[2]]
+    assert [t.local_id for t in store.get_queued_tasks()] == [ids[1]]
+    assert [t.local_id for t in store.get_active_tasks()] == [ids[2]]
+    store.flush()
+
+    loaded = _reload(path)
+    assert [t.local_id for t in loaded.get_all_tasks()] == ids
+    assert loaded.get_task(ids[0]).status == TaskStatus.SUCCEEDED
+    assert loaded.get_task(ids[2]).completed_jobs == 1
+    assert loaded.get_task(ids[2]).task_type == TaskType.BATCH
+
+    assert loaded.clear_completed() == 1
+    loaded.flush()
+    assert [t.local_id for t in _reload(path).get_all_tasks()] == ids[1:]
+
+
+def test_loads_legacy_tasks_json(tmp_path):
+    path = tmp_path / "tasks.json"
+    now = datetime(2025, 12, 1, 8, 30).isoformat()
+    legacy = {
+        "tasks": [
+            {
+                "local_id": "legacy-1",
+                "task_type": "single",
+                "image_paths": ["残片.png"],
+                "status": "SUCCEEDED",
+                "task_id": "job-1",
+                "batch_id": None,
+                "session_id": "sess-1",
+                "progress": 1.0,
+                "current_round": 3,
+                "total_jobs": 0,
+                "completed_jobs": 0,
+                "failed_jobs": 0,
+                "result": {"ocr_result": {"recognized_text": "如是我聞"}},
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+                "retry_count": 1,
+            }
+        ]
+    }
+    path.write_text(json.dumps(legacy, indent=2, ensure_ascii=False), encoding="utf-8")
+
+    store = TaskStore(storage_path=path)
+    record = store.get_task("legacy-1")
+    assert record.status == TaskStatus.SUCCEEDED
+    assert list(record.image_paths) == ["残片.png"]
+    assert record.result["ocr_result"]["recognized_text"] == "如是我聞"
+    assert record.created_at == datetime.fromisoformat(now)
+
+    # 旧快照之上追加的修改同样可以重放
+    store.update_task("legacy-1", retry_count=2)
+    store.flush()
+    assert _reload(path).get_task("legacy-1").retry_count == 2